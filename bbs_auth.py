@@ -1,47 +1,88 @@
 import sqlite3
-import getpass
+from bbs_data_access import bbs_connection, characters_connection
+from bbs_io import input, print, getpass
+from bbs_passwords import hash_password, verify_password
+from bbs_session import role_changed, start_session
 
 def register():
-    conn = sqlite3.connect('bbs.db')
-    c = conn.cursor()
-
     username = input("Enter a username: ")
-    password = getpass.getpass("Enter a password: ")
+    password = getpass("Enter a password: ")
     role = 'user'  # default role for all users is 'user'
+    hashed = hash_password(password)  # Hash before borrowing a connection, it takes a while
 
-    try:
-        c.execute('INSERT INTO users (username, password, role) VALUES (?, ?, ?)',
-                  (username, password, role))
-        conn.commit()
-        print("Registration successful.")
-    except sqlite3.IntegrityError:
-        print("Username already exists.")
-    
-    conn.close()
+    with bbs_connection() as conn:
+        c = conn.cursor()
+        try:
+            c.execute('INSERT INTO users (username, password, role) VALUES (?, ?, ?)',
+                      (username, hashed, role))
+            conn.commit()
+            print("Registration successful.")
+        except sqlite3.IntegrityError:
+            print("Username already exists.")
 
 def login():
-    conn = sqlite3.connect('bbs.db')
-    c = conn.cursor()
-
     username = input("Enter your username: ")
-    password = getpass.getpass("Enter your password: ")
+    password = getpass("Enter your password: ")
 
-    c.execute('SELECT id, role FROM users WHERE username = ? AND password = ?', 
-              (username, password))
-    user = c.fetchone()
+    with bbs_connection() as conn:
+        c = conn.cursor()
+        c.execute('SELECT id, role, password FROM users WHERE username = ?', (username,))
+        row = c.fetchone()
+
+    matches, needs_rehash = verify_password(password, row[2] if row else None)
+    user = row[:2] if matches else None
+    if user and needs_rehash:
+        update_password(user[0], hash_password(password))
 
     if user:
         print(f"Login successful. Welcome, {username}!")
-        return user  # return user ID and role
+        return start_session(user[0], username, user[1])  # Carried through every menu until logout
     else:
         print("Invalid credentials.")
         return None
 
+def update_password(user_id, hashed):
+    """Store a new password hash for a user, in both databases that keep one."""
+    with bbs_connection() as conn:
+        conn.execute('UPDATE users SET password = ? WHERE id = ?', (hashed, user_id))
+    with characters_connection() as conn:
+        conn.execute('UPDATE users SET password = ? WHERE id = ?', (hashed, user_id))
+
+def set_role(user_id, role):
+    """Change a user's role ('user' or 'gm') and update any sessions they have open."""
+    with bbs_connection() as conn:
+        conn.execute('UPDATE users SET role = ? WHERE id = ?', (role, user_id))
+    with characters_connection() as conn:
+        conn.execute('UPDATE users SET role = ? WHERE id = ?', (role, user_id))
+    role_changed(user_id, role)
+
+# Function to let the GM change another user's role
+def change_user_role(session):
+    username = input("Enter the username: ")
+    user_id = get_user_id(username)
+    if user_id is None:
+        print("User not found.")
+        return
+    if user_id == session.user_id:
+        print("You can't change your own role.")
+        return
+    role = input("Enter the new role (user/gm): ").strip().lower()
+    if role not in ('user', 'gm'):
+        print("Invalid role.")
+        return
+    set_role(user_id, role)  # Also updates the sessions that user has open
+    print(f"{username} is now a {role}.")
+
+# Username -> id for users already looked up. Usernames never change and ids are never reused.
+_user_ids = {}
+
 def get_user_id(username):
-    conn = sqlite3.connect('bbs.db')
-    c = conn.cursor()
-    
-    c.execute('SELECT id FROM users WHERE username = ?', (username,))
-    user_id = c.fetchone()
-    conn.close()
+    if username in _user_ids:
+        return _user_ids[username]
+    with bbs_connection() as conn:
+        c = conn.cursor()
+        c.execute('SELECT id FROM users WHERE username = ?', (username,))
+        user_id = c.fetchone()
+    if user_id:
+        _user_ids[username] = user_id[0]
     return user_id[0] if user_id else None
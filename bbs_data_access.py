@@ -0,0 +1,165 @@
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+# Database files used by the BBS
+BBS_DB = 'bbs.db'
+CHARACTERS_DB = 'characters_npcs.db'
+
+# Pool sizing
+POOL_SIZE = 8  # Maximum number of open connections per database
+POOL_TIMEOUT = 30  # Seconds to wait for a free connection before giving up
+
+# PRAGMAs applied once when a connection is first opened
+CONNECTION_PRAGMAS = (
+    'PRAGMA journal_mode = WAL',  # Readers don't block the writer
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA busy_timeout = 5000',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA cache_size = -8000',  # 8 MB page cache per connection
+)
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes free within the pool timeout."""
+
+
+class ConnectionPool:
+    """A bounded, thread-safe pool of SQLite connections to a single database file."""
+
+    def __init__(self, db_path, size=POOL_SIZE, timeout=POOL_TIMEOUT):
+        self.db_path = db_path
+        self.size = size
+        self.timeout = timeout
+        self._idle = []  # Connections ready to be handed out
+        self._open = 0  # Connections currently owned by the pool (idle or in use)
+        self._cond = threading.Condition()
+        self.hits = 0  # Requests served by an idle connection
+        self.misses = 0  # Requests that had to open a new connection
+        self.waits = 0  # Requests that had to wait for another caller to release one
+        self.wait_time = 0.0
+
+    def _open_connection(self):
+        """Open a new connection and apply the per-connection PRAGMAs."""
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout, check_same_thread=False)
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def acquire(self):
+        """Take a connection from the pool, opening or waiting for one as needed."""
+        with self._cond:
+            if self._idle:
+                self.hits += 1
+                return self._idle.pop()
+
+            if self._open >= self.size:
+                # Every connection is in use, wait for one to be released
+                self.waits += 1
+                started = time.monotonic()
+                deadline = started + self.timeout
+                while not self._idle and self._open >= self.size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.wait_time += time.monotonic() - started
+                        raise PoolTimeout(f"No free connection to '{self.db_path}' after {self.timeout}s.")
+                    self._cond.wait(remaining)
+                self.wait_time += time.monotonic() - started
+                if self._idle:
+                    return self._idle.pop()
+
+            self._open += 1
+            self.misses += 1
+
+        # Open outside the lock so other callers aren't held up by file I/O
+        try:
+            return self._open_connection()
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, conn, discard=False):
+        """Return a connection to the pool, closing it instead if it is broken."""
+        if not discard and conn.in_transaction:
+            conn.rollback()  # Never hand out a connection with a half-finished transaction
+        with self._cond:
+            if discard:
+                self._open -= 1
+                conn.close()
+            else:
+                self._idle.append(conn)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """Context manager that commits on success, rolls back on error and always releases."""
+        conn = self.acquire()
+        discard = False
+        try:
+            yield conn
+            if conn.in_transaction:
+                conn.commit()
+        except sqlite3.ProgrammingError:
+            # The handle was closed or misused by the caller, don't reuse it
+            discard = True
+            raise
+        finally:
+            self.release(conn, discard=discard)
+
+    def close_all(self):
+        """Close every idle connection, e.g. before the database file is removed."""
+        with self._cond:
+            while self._idle:
+                self._idle.pop().close()
+                self._open -= 1
+
+    def stats(self):
+        """Return a snapshot of the pool counters."""
+        with self._cond:
+            return {
+                'db': self.db_path,
+                'size': self.size,
+                'open': self._open,
+                'idle': len(self._idle),
+                'hits': self.hits,
+                'misses': self.misses,
+                'waits': self.waits,
+                'wait_time': round(self.wait_time, 4),
+            }
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+# Function to look up (or lazily create) the pool for a database file
+def get_pool(db_path):
+    """Return the shared connection pool for the given database file."""
+    with _pools_lock:
+        pool = _pools.get(db_path)
+        if pool is None:
+            pool = _pools[db_path] = ConnectionPool(db_path)
+        return pool
+
+def bbs_connection():
+    """Borrow a pooled connection to bbs.db."""
+    return get_pool(BBS_DB).connection()
+
+def characters_connection():
+    """Borrow a pooled connection to characters_npcs.db."""
+    return get_pool(CHARACTERS_DB).connection()
+
+def pool_stats():
+    """Return hit/miss/wait counters for every pool created so far."""
+    with _pools_lock:
+        pools = list(_pools.values())
+    return [pool.stats() for pool in pools]
+
+def close_all_pools():
+    """Close every idle pooled connection."""
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.close_all()
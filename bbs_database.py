@@ -1,62 +1,61 @@
-import sqlite3
+from bbs_data_access import bbs_connection
 
 def create_tables():
-    conn = sqlite3.connect('bbs.db')
-    c = conn.cursor()
+    with bbs_connection() as conn:
+        c = conn.cursor()
 
-    # Users Table
-    c.execute('''
-    CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        username TEXT UNIQUE NOT NULL,
-        password TEXT NOT NULL,
-        role TEXT NOT NULL
-    )
-    ''')
+        # Users Table
+        c.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            role TEXT NOT NULL
+        )
+        ''')
 
-    # Threads Table
-    c.execute('''
-    CREATE TABLE IF NOT EXISTS threads (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        category TEXT NOT NULL,
-        title TEXT NOT NULL,
-        created_by INTEGER,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        locked INTEGER DEFAULT 0,
-        FOREIGN KEY (created_by) REFERENCES users(id)
-    )
-    ''')
+        # Threads Table
+        c.execute('''
+        CREATE TABLE IF NOT EXISTS threads (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            category TEXT NOT NULL,
+            title TEXT NOT NULL,
+            created_by INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            locked INTEGER DEFAULT 0,
+            FOREIGN KEY (created_by) REFERENCES users(id)
+        )
+        ''')
 
-    # Posts Table
-    c.execute('''
-    CREATE TABLE IF NOT EXISTS posts (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        thread_id INTEGER,
-        content TEXT NOT NULL,
-        created_by INTEGER,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        edited_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,  -- Automatically stores the last edit time
-        locked INTEGER DEFAULT 0,  -- Add a lock for posts as well
-        FOREIGN KEY (thread_id) REFERENCES threads(id),
-        FOREIGN KEY (created_by) REFERENCES users(id)
-    )
-    ''')
+        # Posts Table
+        c.execute('''
+        CREATE TABLE IF NOT EXISTS posts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            thread_id INTEGER,
+            content TEXT NOT NULL,
+            created_by INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            edited_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,  -- Automatically stores the last edit time
+            locked INTEGER DEFAULT 0,  -- Add a lock for posts as well
+            FOREIGN KEY (thread_id) REFERENCES threads(id),
+            FOREIGN KEY (created_by) REFERENCES users(id)
+        )
+        ''')
 
-    # Private Messages Table
-    c.execute('''
-    CREATE TABLE IF NOT EXISTS private_messages (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        sender_id INTEGER,
-        receiver_id INTEGER,
-        content TEXT NOT NULL,
-        sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (sender_id) REFERENCES users(id),
-        FOREIGN KEY (receiver_id) REFERENCES users(id)
-    )
-    ''')
+        # Private Messages Table
+        c.execute('''
+        CREATE TABLE IF NOT EXISTS private_messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sender_id INTEGER,
+            receiver_id INTEGER,
+            content TEXT NOT NULL,
+            sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (sender_id) REFERENCES users(id),
+            FOREIGN KEY (receiver_id) REFERENCES users(id)
+        )
+        ''')
 
-    conn.commit()
-    conn.close()
+        conn.commit()
 
 # Call the function to create or update the tables
 create_tables()
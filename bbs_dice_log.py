@@ -0,0 +1,115 @@
+import hashlib
+import json
+import random
+import secrets
+from datetime import datetime
+
+from bbs_data_access import bbs_connection
+from bbs_dice_roller import compile_expression, roll_plan
+from bbs_io import input, print
+
+# Columns shown by the roll listings
+ROLL_COLUMNS = 'id, seq, user_id, post_id, expression, total, dice, rolled_at'
+
+
+def roll_rng(seed, seq):
+    """The RNG for roll number `seq` of a thread's stream.
+
+    Every roll gets its own generator derived from the thread seed and the
+    roll's sequence number, so any single roll can be replayed on its own.
+    """
+    digest = hashlib.sha256(f"{seed}:{seq}".encode()).digest()
+    return random.Random(int.from_bytes(digest, 'big'))
+
+def reserve_rolls(conn, thread_id, count):
+    """Claim `count` sequence numbers from a thread's stream, creating it if needed. Returns (seed, first seq)."""
+    conn.execute('INSERT OR IGNORE INTO dice_streams (thread_id, seed) VALUES (?, ?)',
+                 (thread_id, secrets.token_hex(16)))
+    conn.execute('UPDATE dice_streams SET next_seq = next_seq + ? WHERE thread_id = ?', (count, thread_id))
+    seed, next_seq = conn.execute('SELECT seed, next_seq FROM dice_streams WHERE thread_id = ?',
+                                  (thread_id,)).fetchone()
+    return seed, next_seq - count
+
+def roll_in_thread(conn, thread_id, expressions):
+    """Roll each expression from the thread's stream. Returns [(seq, expression, RollResult)].
+
+    Must run inside the transaction that stores the post, so the claimed
+    sequence numbers and the logged rolls commit together.
+    """
+    if not expressions:
+        return []
+    seed, first = reserve_rolls(conn, thread_id, len(expressions))
+    return [(first + i, expression, roll_plan(compile_expression(expression), roll_rng(seed, first + i)))
+            for i, expression in enumerate(expressions)]
+
+def dice_json(result):
+    """Every die rolled, per repeat and per term, as stored in dice_rolls.dice."""
+    return json.dumps([[roll.rolls for roll in term_rolls] for term_rolls in result.dice], separators=(',', ':'))
+
+def log_rolls(conn, thread_id, post_id, user_id, rolls):
+    """Store the rolls of one post in a single batch."""
+    conn.executemany('''
+        INSERT INTO dice_rolls (thread_id, seq, post_id, user_id, expression, total, totals, dice)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [(thread_id, seq, post_id, user_id, expression, result.total, json.dumps(result.totals), dice_json(result))
+          for seq, expression, result in rolls])
+
+def format_rolls(rolls):
+    """The text appended to a post for its rolls."""
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    return ''.join(f"\n[DICE ROLL #{seq}: {expression} = {result} at {timestamp}]" for seq, expression, result in rolls)
+
+def rolls_in_thread(thread_id, user_id=None, limit=50):
+    """The latest rolls in a thread, optionally only one user's, newest first."""
+    sql = f'SELECT {ROLL_COLUMNS} FROM dice_rolls WHERE thread_id = ?'
+    params = [thread_id]
+    if user_id is not None:
+        sql += ' AND user_id = ?'
+        params.append(user_id)
+    sql += ' ORDER BY seq DESC LIMIT ?'
+    params.append(limit)
+    with bbs_connection() as conn:
+        return conn.execute(sql, params).fetchall()
+
+def rolls_for_post(post_id):
+    """The rolls made in one post, in the order they were rolled."""
+    with bbs_connection() as conn:
+        return conn.execute(f'SELECT {ROLL_COLUMNS} FROM dice_rolls WHERE post_id = ? ORDER BY seq',
+                            (post_id,)).fetchall()
+
+def verify_roll(roll_id):
+    """Replay a logged roll from its thread's seed. Returns True if the dice match, None if the roll doesn't exist."""
+    with bbs_connection() as conn:
+        row = conn.execute('''
+            SELECT r.expression, r.seq, r.total, r.dice, s.seed
+            FROM dice_rolls r JOIN dice_streams s ON s.thread_id = r.thread_id
+            WHERE r.id = ?
+        ''', (roll_id,)).fetchone()
+    if row is None:
+        return None
+    expression, seq, total, dice, seed = row
+    replay = roll_plan(compile_expression(expression), roll_rng(seed, seq))
+    return replay.total == total and dice_json(replay) == dice
+
+def dice_log_menu(thread_id):
+    """Show the dice rolled in a thread and let anyone check a roll against the thread's seed."""
+    user_filter = input("Show rolls by user ID (press Enter for everyone): ").strip()
+    user_id = int(user_filter) if user_filter.isdigit() else None
+    rolls = rolls_in_thread(thread_id, user_id)
+    if not rolls:
+        print("No dice have been rolled in this thread.")
+        return
+
+    print("\n--- Dice rolls in this thread (newest first) ---")
+    for roll_id, seq, roller, post_id, expression, total, dice, rolled_at in rolls:
+        print(f"#{seq}: {expression} = {total} {dice} (By User ID: {roller}, Post ID: {post_id}, At: {rolled_at}) [Roll ID: {roll_id}]")
+
+    choice = input("\nEnter a Roll ID to verify it, or press Enter to return: ").strip()
+    if choice.isdigit():
+        verified = verify_roll(int(choice))
+        if verified is None:
+            print("Roll not found.")
+        elif verified:
+            print("Verified: replaying the thread's dice stream gives exactly these dice.")
+        else:
+            print("MISMATCH: this roll does not match the thread's dice stream.")
@@ -1,30 +1,233 @@
 import random
+import re
+from collections import namedtuple
 from datetime import datetime
+from functools import lru_cache
 
-def roll_dice(dice_expression):
-    try:
-        num_dice, dice_modifier = dice_expression.split('d')
-        num_dice = int(num_dice)
-
-        if '+' in dice_modifier:
-            sides, modifier = dice_modifier.split('+')
-            modifier = int(modifier)
-        elif '-' in dice_modifier:
-            sides, modifier = dice_modifier.split('-')
-            modifier = -int(modifier)
+# Limits that keep a single roll cheap
+MAX_DICE = 10000  # Dice in one term
+MAX_SIDES = 10000
+MAX_TERMS = 20
+MAX_REPEAT = 20  # The N in N#expression
+MAX_EXPLOSIONS = 100  # Rounds of exploding dice before we stop re-rolling
+SHOWN_DICE = 20  # Individual dice listed per term when a result is printed
+
+# Tokens of the dice language, longest first so 'kh' wins over 'k'
+TOKEN_PATTERN = re.compile(r'\s*(?:(\d+)|(kh|kl|dh|dl|k|d|%|!|#|\+|-))', re.IGNORECASE)
+
+KEEP_MODES = ('kh', 'kl', 'dh', 'dl')
+
+# One 'NdS' term: sign is +1 or -1, keep is None or (mode, n) with mode in KEEP_MODES
+DiceTerm = namedtuple('DiceTerm', 'sign count sides explode keep')
+# A compiled expression: the dice terms, the sum of the constant terms, and how often to roll it
+RollPlan = namedtuple('RollPlan', 'expression repeat terms modifier')
+# What one term rolled: every die (explosions included) and the ones that count
+TermRoll = namedtuple('TermRoll', 'term rolls kept')
+
+
+class DiceError(ValueError):
+    """Raised for dice expressions that can't be parsed or exceed the limits."""
+
+
+class RollResult:
+    """The outcome of rolling a plan: one total per repeat, plus every die rolled."""
+
+    def __init__(self, plan, totals, dice):
+        self.plan = plan
+        self.expression = plan.expression
+        self.totals = totals
+        self.dice = dice  # Per repeat, a list of TermRoll
+        self.total = totals[0] if len(totals) == 1 else sum(totals)
+
+    def __str__(self):
+        parts = []
+        for total, term_rolls in zip(self.totals, self.dice):
+            shown = '; '.join(f"{format_term(roll.term)}: {format_rolls(roll.rolls)}" for roll in term_rolls)
+            parts.append(f"{total} ({shown})" if shown else str(total))
+        return ', '.join(parts)
+
+    def __int__(self):
+        return self.total
+
+
+def tokenize(expression):
+    """Split a dice expression into number and operator tokens."""
+    tokens = []
+    position = 0
+    text = expression.strip()
+    while position < len(text):
+        match = TOKEN_PATTERN.match(text, position)
+        if match is None:
+            raise DiceError(f"Unexpected '{text[position:].strip()[:1]}' in dice expression.")
+        number, operator = match.groups()
+        tokens.append(int(number) if number is not None else operator.lower())
+        position = match.end()
+    return tokens
+
+def parse(tokens, expression=''):
+    """Parse tokens into a RollPlan.
+
+    Grammar: [N#] term (('+'|'-') term)*, where a term is a number or
+    [count]d(sides|%)[!][kh|kl|dh|dl|k n].
+    """
+    tokens = list(tokens)
+    position = 0
+
+    def peek():
+        return tokens[position] if position < len(tokens) else None
+
+    def take_number(what):
+        nonlocal position
+        if not isinstance(peek(), int):
+            raise DiceError(f"Expected {what} in dice expression.")
+        position += 1
+        return tokens[position - 1]
+
+    repeat = 1
+    if len(tokens) >= 2 and isinstance(tokens[0], int) and tokens[1] == '#':
+        repeat = tokens[0]
+        position = 2
+        if not 1 <= repeat <= MAX_REPEAT:
+            raise DiceError(f"Repeat count must be between 1 and {MAX_REPEAT}.")
+
+    terms = []
+    modifier = 0
+    sign = 1
+    if peek() in ('+', '-'):  # A leading sign, e.g. '-1+1d6'
+        sign = -1 if tokens[position] == '-' else 1
+        position += 1
+    while True:
+        count = take_number("a number or die") if peek() != 'd' else 1
+        if peek() == 'd':
+            position += 1
+            if peek() == '%':
+                position += 1
+                sides = 100
+            else:
+                sides = take_number("the number of sides")
+            explode = False
+            if peek() == '!':
+                position += 1
+                explode = True
+            keep = None
+            if peek() in KEEP_MODES + ('k',):
+                mode = 'kh' if tokens[position] == 'k' else tokens[position]
+                position += 1
+                keep = (mode, take_number("how many dice to keep or drop"))
+
+            if not 1 <= count <= MAX_DICE:
+                raise DiceError(f"Number of dice must be between 1 and {MAX_DICE}.")
+            if not 1 <= sides <= MAX_SIDES:
+                raise DiceError(f"Dice must have between 1 and {MAX_SIDES} sides.")
+            if explode and sides == 1:
+                raise DiceError("A one-sided die can't explode.")
+            if keep is not None and keep[1] > count:
+                raise DiceError(f"Can't keep or drop {keep[1]} of {count} dice.")
+            terms.append(DiceTerm(sign, count, sides, explode, keep))
+            if len(terms) > MAX_TERMS:
+                raise DiceError(f"At most {MAX_TERMS} dice terms are allowed.")
         else:
-            sides = dice_modifier
-            modifier = 0
-
-        sides = int(sides)
-        
-        # Roll the dice
-        total = sum(random.randint(1, sides) for _ in range(num_dice)) + modifier
-        
-        # Get the timestamp
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        
-        return total, timestamp
-
-    except ValueError:
+            modifier += sign * count
+
+        if peek() is None:
+            break
+        if peek() not in ('+', '-'):
+            raise DiceError(f"Unexpected '{peek()}' in dice expression.")
+        sign = -1 if tokens[position] == '-' else 1
+        position += 1
+        if peek() is None:
+            raise DiceError("Dice expression ends with an operator.")
+
+    return RollPlan(expression, repeat, tuple(terms), modifier)
+
+def format_rolls(rolls):
+    """List the dice of a term, shortening big pools."""
+    text = ', '.join(str(value) for value in rolls[:SHOWN_DICE])
+    if len(rolls) > SHOWN_DICE:
+        text += f", ... ({len(rolls)} dice)"
+    return text
+
+def format_term(term):
+    """Write a DiceTerm back in dice notation, without its sign."""
+    text = f"{term.count}d{term.sides}"
+    if term.explode:
+        text += '!'
+    if term.keep is not None:
+        text += f"{term.keep[0]}{term.keep[1]}"
+    return text
+
+@lru_cache(maxsize=1024)
+def _compile(normalized):
+    return parse(tokenize(normalized), normalized)
+
+def compile_expression(expression):
+    """Return the cached RollPlan for an expression, parsing it only the first time it's seen."""
+    normalized = ' '.join(expression.split()).lower()
+    if not normalized:
+        raise DiceError("Empty dice expression.")
+    return _compile(normalized)
+
+def roll_term(term, rng=random):
+    """Roll one dice term, returning a TermRoll."""
+    faces = range(1, term.sides + 1)
+    rolls = rng.choices(faces, k=term.count)  # The whole pool in one call
+    if term.explode:
+        # Every die showing its highest face adds another die, which can explode in turn
+        fresh = rolls
+        for _ in range(MAX_EXPLOSIONS):
+            fresh = rng.choices(faces, k=fresh.count(term.sides))
+            if not fresh:
+                break
+            rolls = rolls + fresh
+
+    kept = rolls
+    if term.keep is not None:
+        mode, n = term.keep
+        ordered = sorted(rolls)
+        if mode == 'kh':
+            kept = ordered[len(ordered) - n:]
+        elif mode == 'kl':
+            kept = ordered[:n]
+        elif mode == 'dh':
+            kept = ordered[:len(ordered) - n]
+        else:
+            kept = ordered[n:]
+    return TermRoll(term, rolls, kept)
+
+def roll_plan(plan, rng=random):
+    """Roll a compiled plan once per repeat and return a RollResult."""
+    totals = []
+    dice = []
+    for _ in range(plan.repeat):
+        term_rolls = [roll_term(term, rng) for term in plan.terms]
+        totals.append(sum(roll.term.sign * sum(roll.kept) for roll in term_rolls) + plan.modifier)
+        dice.append(term_rolls)
+    return RollResult(plan, totals, dice)
+
+def roll_dice_result(dice_expression, rng=random):
+    """Roll a dice expression such as '2d6+1d4+3', '4d6kh3', '1d6!' or '3#1d20+5'.
+
+    Returns (RollResult, timestamp), or (None, None) if the expression is invalid.
+    """
+    try:
+        plan = compile_expression(dice_expression)
+    except DiceError:
+        return None, None
+
+    result = roll_plan(plan, rng)
+
+    # Get the timestamp
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    return result, timestamp
+
+def roll_dice(dice_expression, rng=random):
+    """Roll a dice expression and return (total, timestamp), or (None, None) if it is invalid.
+
+    A repeated expression such as '3#1d20+5' returns the sum of its totals;
+    use roll_dice_result() for each total and the individual dice.
+    """
+    result, timestamp = roll_dice_result(dice_expression, rng)
+    if result is None:
         return None, None
+    return result.total, timestamp
@@ -0,0 +1,267 @@
+import itertools
+import math
+import random
+from functools import lru_cache
+
+from bbs_dice_roller import DiceError, compile_expression, roll_term
+from bbs_io import input, print
+
+# NumPy is optional: it speeds up convolution and makes million-trial simulations practical
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+EXACT_MAX_OUTCOMES = 200000  # Largest range of totals we compute exactly
+EXACT_MAX_WORK = 5000000  # Pure-Python convolution budget (multiply-adds) without NumPy
+ENUMERATION_LIMIT = 200000  # Keep/drop pools are enumerated exactly up to this many outcomes
+EXPLOSION_TAIL = 1e-12  # Exploding dice are followed until the remaining probability is this small
+MONTE_CARLO_TRIALS = 1000000  # Simulated rolls with NumPy
+PYTHON_TRIALS = 20000  # Simulated rolls when each one has to be rolled in Python
+SIMULATION_CHUNK = 5000000  # Dice rolled per NumPy batch, bounds memory use
+PERCENTILES = (5, 10, 25, 50, 75, 90, 95)
+
+
+class Distribution:
+    """Probability distribution of a dice expression's total.
+
+    probs[i] is the probability of rolling offset + i. For a Monte-Carlo
+    estimate the probabilities are observed frequencies over `trials` rolls.
+    """
+
+    def __init__(self, expression, offset, probs, exact, trials=None):
+        self.expression = expression
+        self.offset = offset
+        self.probs = list(probs)
+        self.exact = exact
+        self.trials = trials
+        self.minimum = offset + next(i for i, p in enumerate(self.probs) if p > 0)
+        self.maximum = offset + max(i for i, p in enumerate(self.probs) if p > 0)
+        self.mean = sum((offset + i) * p for i, p in enumerate(self.probs))
+        self.stdev = math.sqrt(max(0.0, sum((offset + i - self.mean) ** 2 * p for i, p in enumerate(self.probs))))
+        self._cdf = list(itertools.accumulate(self.probs))
+
+    def probability(self, total):
+        """P(total == value)."""
+        index = total - self.offset
+        return self.probs[index] if 0 <= index < len(self.probs) else 0.0
+
+    def at_least(self, target):
+        """P(total >= target), e.g. the chance of meeting a DC."""
+        index = target - self.offset
+        if index <= 0:
+            return 1.0
+        if index > len(self.probs):
+            return 0.0
+        return max(0.0, 1.0 - self._cdf[index - 1])
+
+    def at_most(self, target):
+        """P(total <= target)."""
+        return 1.0 - self.at_least(target + 1)
+
+    def percentile(self, percent):
+        """The smallest total that at least `percent`% of rolls stay at or below."""
+        wanted = percent / 100 - 1e-12
+        for index, cumulative in enumerate(self._cdf):
+            if cumulative >= wanted:
+                return self.offset + index
+        return self.maximum
+
+    def percentiles(self, percents=PERCENTILES):
+        return {percent: self.percentile(percent) for percent in percents}
+
+
+# Exact distributions, as (offset, probabilities) pairs
+def convolve(a, b):
+    """Distribution of the sum of two independent distributions."""
+    if np is not None:
+        return np.convolve(np.asarray(a, dtype=float), np.asarray(b, dtype=float)).tolist()
+    out = [0.0] * (len(a) + len(b) - 1)
+    for i, p in enumerate(a):
+        if p:
+            for j, q in enumerate(b):
+                out[i + j] += p * q
+    return out
+
+def add_distributions(first, second):
+    return first[0] + second[0], convolve(first[1], second[1])
+
+def die_distribution(sides, explode=False):
+    """Distribution of a single die; an exploding die is followed until its tail is negligible."""
+    if not explode:
+        return 1, [1.0 / sides] * sides
+    probs = []
+    chance = 1.0  # Probability of having exploded this many times
+    while chance >= EXPLOSION_TAIL:
+        probs.extend([chance / sides] * (sides - 1))
+        chance /= sides
+        probs.append(0.0)  # A face showing the maximum always rolls on
+    return 1, probs
+
+def power_distribution(distribution, count):
+    """Distribution of the sum of `count` independent copies, by repeated squaring."""
+    result = (0, [1.0])
+    square = distribution
+    while count:
+        if count & 1:
+            result = add_distributions(result, square)
+        count >>= 1
+        if count:
+            square = add_distributions(square, square)
+    return result
+
+def keep_distribution(term):
+    """Distribution of a keep/drop term, by enumerating every way the dice can fall."""
+    mode, n = term.keep
+    counts = {}
+    for dice in itertools.product(range(1, term.sides + 1), repeat=term.count):
+        ordered = sorted(dice)
+        if mode == 'kh':
+            kept = ordered[term.count - n:]
+        elif mode == 'kl':
+            kept = ordered[:n]
+        elif mode == 'dh':
+            kept = ordered[:term.count - n]
+        else:
+            kept = ordered[n:]
+        total = sum(kept)
+        counts[total] = counts.get(total, 0) + 1
+    offset = min(counts)
+    outcomes = term.sides ** term.count
+    probs = [0.0] * (max(counts) - offset + 1)
+    for total, count in counts.items():
+        probs[total - offset] = count / outcomes
+    return offset, probs
+
+def negate(distribution):
+    offset, probs = distribution
+    return -(offset + len(probs) - 1), probs[::-1]
+
+def exact_distribution(plan):
+    """Return (offset, probabilities) for one roll of a plan, or None if it's too big to compute exactly."""
+    width = 1 + sum(term.count * (len(die_distribution(term.sides, term.explode)[1]) - 1) for term in plan.terms)
+    if width > EXACT_MAX_OUTCOMES:
+        return None
+    if np is None and width * width > EXACT_MAX_WORK:
+        return None
+
+    result = (plan.modifier, [1.0])
+    for term in plan.terms:
+        if term.keep is not None:
+            if term.explode or term.sides ** term.count > ENUMERATION_LIMIT:
+                return None
+            distribution = keep_distribution(term)
+        else:
+            distribution = power_distribution(die_distribution(term.sides, term.explode), term.count)
+        if term.sign < 0:
+            distribution = negate(distribution)
+        result = add_distributions(result, distribution)
+    return result
+
+
+# Monte-Carlo estimates
+def simulate_term_numpy(term, trials, generator):
+    """Totals of one term over `trials` rolls, rolled in bounded batches."""
+    totals = np.zeros(trials, dtype=np.int64)
+    batch = max(1, SIMULATION_CHUNK // term.count)
+    for start in range(0, trials, batch):
+        size = min(batch, trials - start)
+        dice = generator.integers(1, term.sides + 1, size=(size, term.count))
+        if term.keep is not None:
+            mode, n = term.keep
+            dice.sort(axis=1)
+            if mode == 'kh':
+                dice = dice[:, term.count - n:]
+            elif mode == 'kl':
+                dice = dice[:, :n]
+            elif mode == 'dh':
+                dice = dice[:, :term.count - n]
+            else:
+                dice = dice[:, n:]
+        chunk = dice.sum(axis=1)
+        if term.explode:
+            # Roll the extra dice for every trial at once, crediting each to its trial
+            pending = (dice == term.sides).sum(axis=1)
+            for _ in range(100):
+                if not pending.any():
+                    break
+                owners = np.repeat(np.arange(size), pending)
+                extra = generator.integers(1, term.sides + 1, size=owners.size)
+                chunk += np.bincount(owners, weights=extra, minlength=size).astype(np.int64)
+                pending = np.bincount(owners, weights=extra == term.sides, minlength=size).astype(np.int64)
+        totals[start:start + size] = chunk
+    return totals
+
+def simulate(plan, trials=MONTE_CARLO_TRIALS):
+    """Estimate a plan's distribution by rolling it up to `trials` times.
+
+    Returns (offset, probabilities, trials actually rolled). Without NumPy,
+    or for exploding keep/drop pools, at most PYTHON_TRIALS rolls are made.
+    """
+    if np is not None and not any(term.explode and term.keep for term in plan.terms):
+        generator = np.random.default_rng()
+        totals = np.full(trials, plan.modifier, dtype=np.int64)
+        for term in plan.terms:
+            totals += term.sign * simulate_term_numpy(term, trials, generator)
+        offset = int(totals.min())
+        counts = np.bincount(totals - offset)
+        return offset, (counts / trials).tolist(), trials
+
+    # Pure Python: roll the plan the same way a post would
+    trials = min(trials, PYTHON_TRIALS)
+    counts = {}
+    for _ in range(trials):
+        total = plan.modifier + sum(term.sign * sum(roll_term(term, random).kept) for term in plan.terms)
+        counts[total] = counts.get(total, 0) + 1
+    offset = min(counts)
+    probs = [0.0] * (max(counts) - offset + 1)
+    for total, count in counts.items():
+        probs[total - offset] = count / trials
+    return offset, probs, trials
+
+
+@lru_cache(maxsize=256)
+def _dice_stats(expression, trials):
+    plan = compile_expression(expression)
+    exact = exact_distribution(plan)
+    if exact is not None:
+        return Distribution(plan.expression, exact[0], exact[1], exact=True)
+    offset, probs, rolled = simulate(plan, trials)
+    return Distribution(plan.expression, offset, probs, exact=False, trials=rolled)
+
+def dice_stats(expression, trials=MONTE_CARLO_TRIALS):
+    """Return the Distribution of one roll of an expression (a repeat like '3#' is ignored).
+
+    The exact distribution is computed by convolution whenever the expression
+    allows it; otherwise it is estimated from `trials` simulated rolls.
+    Results are cached per expression.
+    """
+    return _dice_stats(compile_expression(expression).expression, trials)
+
+def dice_odds_menu():
+    """Show the odds of a dice expression, e.g. for choosing a DC."""
+    expression = input("Enter a dice expression (e.g., 1d20+5, 4d6kh3): ")
+    try:
+        stats = dice_stats(expression)
+    except DiceError as e:
+        print(f"Invalid dice expression: {e}")
+        return
+
+    if stats.exact:
+        print(f"\n--- Odds for {stats.expression} (exact) ---")
+    else:
+        print(f"\n--- Odds for {stats.expression} (estimated from {stats.trials:,} rolls) ---")
+    print(f"Range: {stats.minimum} to {stats.maximum}")
+    print(f"Mean: {stats.mean:.2f}  Standard deviation: {stats.stdev:.2f}")
+    print("Percentiles: " + ", ".join(f"{percent}%: {value}" for percent, value in stats.percentiles().items()))
+
+    while True:
+        target = input("\nEnter a target to beat (meet or exceed), or press Enter to return: ").strip()
+        if not target:
+            break
+        try:
+            target = int(target)
+        except ValueError:
+            print("Please enter a whole number.")
+            continue
+        print(f"Chance of rolling {target} or higher: {100 * stats.at_least(target):.2f}%")
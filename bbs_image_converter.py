@@ -1,80 +1,414 @@
-from PIL import Image
+from PIL import Image, UnidentifiedImageError
+import hashlib
+import os
 import re
+from functools import lru_cache
+from bbs_data_access import bbs_connection
+from bbs_io import input, print
+from bbs_render_cache import RenderCache
+
+# NumPy is optional: with it, pixels are converted as whole arrays; without it, one at a time
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+ANSI_RESET = "\033[0m"
+IMAGE_SIZE = (80, 40)  # Default width and height in characters
+MAX_IMAGE_SIZE = (200, 100)
+ASCII_CHARS = "@%#*+=-:. "  # Fixed character set for ASCII art
+HALF_BLOCK = "\u2580"  # Upper half block: foreground on top, background below
+
+# Color depths: 24-bit escapes, the xterm 256-color palette, or the 16 basic ANSI colors
+TRUECOLOR = 'truecolor'
+COLOR_256 = '256'
+COLOR_16 = '16'
+COLOR_DEPTHS = (TRUECOLOR, COLOR_256, COLOR_16)
+CUBE_LEVELS = (0, 95, 135, 175, 215, 255)  # Channel values of the 256-color cube
+PALETTE_16 = (
+    (0, 0, 0), (170, 0, 0), (0, 170, 0), (170, 85, 0), (0, 0, 170), (170, 0, 170), (0, 170, 170), (170, 170, 170),
+    (85, 85, 85), (255, 85, 85), (85, 255, 85), (255, 255, 85), (85, 85, 255), (255, 85, 255), (85, 255, 255), (255, 255, 255),
+)
+
+# Posts keep a [pic=N] reference to a row of image_cache instead of the art itself
+IMAGE_REFERENCE = re.compile(r'\[pic=(\d+)\]')
+image_render_cache = RenderCache(max_entries=200, max_bytes=16 * 1024 * 1024)
+IMAGE_DIR = None  # Set in telnet mode: /pic then only opens images under this directory
 
 # ANSI color escape codes
 def rgb_to_ansi(r, g, b):
     return f"\033[38;2;{r};{g};{b}m"
 
-# Function to convert an image to colored ANSI art (supports transparency handling)
-def convert_image_to_colored_ansi(image_path, use_quarter_blocks=False):
+# Function to quantize a color to the chosen depth, returning a code that identifies it
+@lru_cache(maxsize=65536)
+def quantize_color(r, g, b, depth=TRUECOLOR):
+    if depth == TRUECOLOR:
+        return (r << 16) | (g << 8) | b
+    if depth == COLOR_256:
+        # Nearest of the 6x6x6 color cube (16-231) or the 24-step gray ramp (232-255)
+        levels = [0 if v < 48 else 1 if v < 115 else (v - 35) // 40 for v in (r, g, b)]
+        cube_distance = sum((v - CUBE_LEVELS[level]) ** 2 for v, level in zip((r, g, b), levels))
+        gray_index = min(23, max(0, ((r + g + b) // 3 - 3) // 10))
+        gray = 8 + 10 * gray_index
+        gray_distance = (r - gray) ** 2 + (g - gray) ** 2 + (b - gray) ** 2
+        if gray_distance < cube_distance:
+            return 232 + gray_index
+        return 16 + 36 * levels[0] + 6 * levels[1] + levels[2]
+    # 16 colors: nearest entry of the standard palette
+    return min(range(16), key=lambda i: sum((v - p) ** 2 for v, p in zip((r, g, b), PALETTE_16[i])))
+
+# Function to turn a quantized color code into its SGR parameters (without the escape and 'm')
+def sgr_color(code, depth=TRUECOLOR, background=False):
+    if depth == TRUECOLOR:
+        return f"{48 if background else 38};2;{code >> 16};{(code >> 8) & 255};{code & 255}"
+    if depth == COLOR_256:
+        return f"{48 if background else 38};5;{code}"
+    base = (40 if code < 8 else 92) if background else (30 if code < 8 else 82)
+    return str(base + code)
+
+# Function to load an image and resize it to fit the terminal
+def load_image(image_path, size=IMAGE_SIZE):
     img = Image.open(image_path).convert('RGBA')  # Support images with transparency (RGBA)
-    img = img.resize((80, 40))  # Resize image to fit better in the terminal
+    return img.resize(size)
 
-    shades = " .:-=+*%@#" if not use_quarter_blocks else " ░▒▓█"
-    ansi_image = []
-    
-    for y in range(img.height):
+# Function to read a loaded image's pixels as RGB rows
+def opaque_rows(img):
+    pixels = [(255, 255, 255) if a == 0 else (r, g, b) for r, g, b, a in img.getdata()]  # Treat transparency as white
+    return [pixels[y * img.width:(y + 1) * img.width] for y in range(img.height)]
+
+def render_mono(img, chars):
+    """Render without color, one shade character per pixel."""
+    step = 256 // len(chars)
+    last_char = len(chars) - 1
+    return "\n".join("".join(chars[min((r + g + b) // 3 // step, last_char)] for r, g, b in row)
+                     for row in opaque_rows(img))
+
+def render_colored_python(img, chars, depth=TRUECOLOR):
+    """Pure-Python renderer: one shade character per pixel, colored at the given depth.
+
+    Fully transparent pixels are drawn as white. Adjacent cells that quantize
+    to the same color share one escape, and each row ends with a single reset.
+    """
+    step = 256 // len(chars)
+    last_char = len(chars) - 1
+    rows = []
+    for pixels in opaque_rows(img):
         row = []
-        for x in range(img.width):
-            r, g, b, a = img.getpixel((x, y))  # Get RGBA values
-            if a == 0:  # Fully transparent pixel
-                r, g, b = 255, 255, 255  # Treat transparency as white
-            pixel_value = (r + g + b) // 3  # Grayscale value
-            color = rgb_to_ansi(r, g, b)
-            shade_char = shades[pixel_value // (256 // len(shades))]  # Map grayscale to shade
-            row.append(f"{color}{shade_char}\033[0m")  # Add ANSI color and reset
-        ansi_image.append("".join(row))
-    
-    return "\n".join(ansi_image)
+        previous = None
+        for r, g, b in pixels:
+            code = quantize_color(r, g, b, depth)
+            if code != previous:
+                row.append(f"\033[{sgr_color(code, depth)}m")
+                previous = code
+            row.append(chars[min((r + g + b) // 3 // step, last_char)])  # Map grayscale to shade
+        row.append(ANSI_RESET)
+        rows.append("".join(row))
+    return "\n".join(rows)
 
-# Function to convert an image to colored ASCII art (does not use quarter blocks)
-def convert_image_to_colored_ascii(image_path, use_quarter_blocks=False):
-    img = Image.open(image_path).convert('RGBA')  # Support images with transparency (RGBA)
-    img = img.resize((80, 40))  # Resize image to fit better in the terminal
+def render_half_blocks_python(img, depth=TRUECOLOR):
+    """Pure-Python half-block renderer: each cell shows two pixels stacked vertically.
 
-    # For ASCII mode, quarter blocks are not applicable, so we revert to the standard ASCII character set
-    ascii_chars = "@%#*+=-:. "  # Fixed character set for ASCII art
-    ascii_image = []
-    
-    for y in range(img.height):
+    The upper half block is drawn in the top pixel's color on the bottom
+    pixel's color, so the image needs twice as many pixel rows as text rows.
+    Only the foreground or background that changed is re-sent.
+    """
+    rows = []
+    pixel_rows = opaque_rows(img)
+    for top, bottom in zip(pixel_rows[0::2], pixel_rows[1::2]):
         row = []
-        for x in range(img.width):
-            r, g, b, a = img.getpixel((x, y))  # Get RGBA values
-            if a == 0:  # Fully transparent pixel
-                r, g, b = 255, 255, 255  # Treat transparency as white
-            pixel_value = (r + g + b) // 3  # Grayscale value
-            color = rgb_to_ansi(r, g, b)
-            char = ascii_chars[pixel_value // (256 // len(ascii_chars))]  # Map grayscale to char
-            row.append(f"{color}{char}\033[0m")  # Add ANSI color and reset
-        ascii_image.append("".join(row))
-    
-    return "\n".join(ascii_image)
+        foreground = background = None
+        for upper, lower in zip(top, bottom):
+            upper_code = quantize_color(*upper, depth)
+            lower_code = quantize_color(*lower, depth)
+            params = []
+            if upper_code != foreground:
+                params.append(sgr_color(upper_code, depth))
+                foreground = upper_code
+            if lower_code != background:
+                params.append(sgr_color(lower_code, depth, background=True))
+                background = lower_code
+            if params:
+                row.append(f"\033[{';'.join(params)}m")
+            row.append(HALF_BLOCK)
+        row.append(ANSI_RESET)
+        rows.append("".join(row))
+    return "\n".join(rows)
+
+def _opaque_rgb(img):
+    """The image as an (height, width, 3) array, with transparent pixels made white."""
+    pixels = np.asarray(img, dtype=np.int32)
+    rgb = pixels[..., :3].copy()
+    rgb[pixels[..., 3] == 0] = 255
+    return rgb
+
+def _quantize_array(rgb, depth):
+    """Vectorized quantize_color over an (..., 3) array."""
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    if depth == TRUECOLOR:
+        return (r << 16) | (g << 8) | b
+    if depth == COLOR_256:
+        # The cube level and its squared error only depend on the channel value, so they are looked up
+        cube_distance = _CUBE_ERROR.take(r) + _CUBE_ERROR.take(g) + _CUBE_ERROR.take(b)
+        cube = 16 + 36 * _CUBE_LEVEL.take(r) + 6 * _CUBE_LEVEL.take(g) + _CUBE_LEVEL.take(b)
+        gray_index = _GRAY_INDEX.take(r + g + b)
+        gray = 8 + 10 * gray_index
+        gray_distance = (r - gray) ** 2 + (g - gray) ** 2 + (b - gray) ** 2
+        return np.where(gray_distance < cube_distance, 232 + gray_index, cube)
+    # |c - p|^2 without the |c|^2 every entry shares: same order, same first minimum, one dot product
+    return (_PALETTE_16_NORMS - 2 * (rgb.astype(np.float32) @ _PALETTE_16.T)).argmin(axis=-1)
+
+def _text_table(strings):
+    """The strings as one array of UTF-8 bytes, with an empty entry at the end for cells that write nothing."""
+    return np.array([text.encode() for text in strings] + [b''])
+
+def _pick(table, index, present=True):
+    """Each cell's entry of a _text_table, or nothing where present is false."""
+    return table.take(np.where(present, index, len(table) - 1))
+
+def _text(text, present=True):
+    """Fixed text, written in the cells where present is true."""
+    return _pick(_text_table([text]), 0, present)
+
+def _sgr_parts(codes, depth, present, background=False):
+    """Vectorized sgr_color: the pieces spelling out each cell's SGR parameters."""
+    if depth == TRUECOLOR:
+        return [_pick(_RED_SEMI[background], codes >> 16, present),
+                _pick(_CHANNEL_SEMI, (codes >> 8) & 255, present),
+                _pick(_CHANNEL, codes & 255, present)]
+    return [_pick(_SGR_TABLES[depth, background], codes, present)]
+
+def _changes(codes):
+    """Mask of the cells whose color differs from their left neighbour (the first cell of a row always does)."""
+    changed = np.ones(codes.shape, dtype=bool)
+    changed[:, 1:] = codes[:, 1:] != codes[:, :-1]
+    return changed
+
+def _assemble(parts, shape):
+    """Write the pieces of every cell in order into one string, ending each row with a reset.
+
+    Each cell becomes one record of fixed-width byte fields, one field per
+    piece, with unused bytes left as NUL. The records of the whole image are
+    laid out row by row, so dropping the NULs from their bytes leaves the
+    output text, decoded in one call.
+    """
+    last_column = np.arange(shape[1]) == shape[1] - 1
+    parts = parts + [_text(ANSI_RESET + "\n", last_column)]
+    cells = np.empty(shape, dtype=[(f"f{i}", part.dtype) for i, part in enumerate(parts)])
+    for i, part in enumerate(parts):
+        cells[f"f{i}"] = part
+    return cells.tobytes().translate(None, b"\0")[:-1].decode()  # Without the last row's newline
+
+def render_colored_numpy(img, chars, depth=TRUECOLOR):
+    """NumPy renderer producing exactly the same output as render_colored_python.
+
+    Luminance, shade indices, the transparency mask, quantization, the
+    color-change mask and the escape text itself are computed as array
+    operations, leaving no per-cell work to Python.
+    """
+    rgb = _opaque_rgb(img)
+    luminance = (rgb[..., 0] + rgb[..., 1] + rgb[..., 2]) // 3
+    shade = np.minimum(luminance // (256 // len(chars)), len(chars) - 1)
+    codes = _quantize_array(rgb, depth)
+    changed = _changes(codes)
+    parts = [_text("\033[", changed), *_sgr_parts(codes, depth, changed), _text("m", changed),
+             _text_table(list(chars)).take(shade)]
+    return _assemble(parts, codes.shape)
+
+def render_half_blocks_numpy(img, depth=TRUECOLOR):
+    """NumPy renderer producing exactly the same output as render_half_blocks_python."""
+    codes = _quantize_array(_opaque_rgb(img), depth)
+    codes = codes[:len(codes) // 2 * 2]  # Like zip() in the Python renderer, an odd last pixel row is dropped
+    top, bottom = codes[0::2], codes[1::2]
+    foreground, background = _changes(top), _changes(bottom)
+    changed = foreground | background
+    parts = [_text("\033[", changed), *_sgr_parts(top, depth, foreground), _text(";", foreground & background),
+             *_sgr_parts(bottom, depth, background, background=True), _text("m" + HALF_BLOCK, changed),
+             _text(HALF_BLOCK, ~changed)]
+    return _assemble(parts, top.shape)
+
+if np is not None:
+    # "38;2;0;" .. "38;2;255;" (48 for the background), "0;" .. "255;" and "0" .. "255",
+    # so a 24-bit color is spelled out from three lookups
+    _RED_SEMI = {background: _text_table([f"{48 if background else 38};2;{value};" for value in range(256)])
+                 for background in (False, True)}
+    _CHANNEL_SEMI = _text_table([f"{value};" for value in range(256)])
+    _CHANNEL = _text_table([str(value) for value in range(256)])
+    _CUBE_LEVEL = np.array([0 if v < 48 else 1 if v < 115 else (v - 35) // 40 for v in range(256)])
+    _CUBE_ERROR = (np.arange(256) - np.array(CUBE_LEVELS)[_CUBE_LEVEL]) ** 2
+    _GRAY_INDEX = np.clip((np.arange(3 * 255 + 1) // 3 - 3) // 10, 0, 23)
+    _PALETTE_16 = np.array(PALETTE_16, dtype=np.float32)
+    _PALETTE_16_NORMS = (_PALETTE_16 ** 2).sum(axis=-1)
+    _SGR_TABLES = {
+        (depth, background): _text_table([sgr_color(code, depth, background) for code in range(count)])
+        for depth, count in ((COLOR_256, 256), (COLOR_16, 16)) for background in (False, True)
+    }
+
+# Functions to render a loaded image with the fastest renderer available
+def render_colored(img, chars, depth=TRUECOLOR):
+    if np is not None:
+        return render_colored_numpy(img, chars, depth)
+    return render_colored_python(img, chars, depth)
+
+def render_half_blocks(img, depth=TRUECOLOR):
+    if np is not None:
+        return render_half_blocks_numpy(img, depth)
+    return render_half_blocks_python(img, depth)
+
+# Function to convert an image to colored ANSI art (supports transparency handling)
+def convert_image_to_colored_ansi(image_path, use_quarter_blocks=False, size=IMAGE_SIZE, depth=TRUECOLOR,
+                                  use_half_blocks=False):
+    if use_half_blocks:
+        width, height = size
+        return render_half_blocks(load_image(image_path, (width, height * 2)), depth)
+    shades = " .:-=+*%@#" if not use_quarter_blocks else " ░▒▓█"
+    return render_colored(load_image(image_path, size), shades, depth)
+
+# Function to convert an image to colored ASCII art (does not use quarter blocks)
+def convert_image_to_colored_ascii(image_path, use_quarter_blocks=False, size=IMAGE_SIZE, depth=TRUECOLOR):
+    # For ASCII mode, quarter blocks are not applicable, so we revert to the standard ASCII character set
+    return render_colored(load_image(image_path, size), ASCII_CHARS, depth)
+
+# Function to convert an image to monochrome ANSI art
+def convert_image_to_ansi(image_path, use_quarter_blocks=False, size=IMAGE_SIZE):
+    shades = " .:-=+*%@#" if not use_quarter_blocks else " ░▒▓█"
+    return render_mono(load_image(image_path, size), shades)
+
+# Function to convert an image to plain ASCII art
+def convert_image_to_ascii(image_path, size=IMAGE_SIZE):
+    return render_mono(load_image(image_path, size), ASCII_CHARS)
+
+# Function to convert an image in the chosen mode
+def convert_image(image_path, mode="ansi", colored=True, use_quarter_blocks=False, size=IMAGE_SIZE,
+                  depth=TRUECOLOR, use_half_blocks=False):
+    if mode == "ansi":
+        if colored:
+            return convert_image_to_colored_ansi(image_path, use_quarter_blocks, size, depth, use_half_blocks)
+        return convert_image_to_ansi(image_path, use_quarter_blocks, size)
+    elif mode == "ascii":
+        # In ASCII mode, we ignore the quarter_block option
+        return convert_image_to_colored_ascii(image_path, False, size, depth) if colored else convert_image_to_ascii(image_path, size)
+    return ""
+
+# Function to hash an image file's contents, so the same picture is recognised under any name
+def file_digest(image_path):
+    digest = hashlib.sha256()
+    with open(image_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# Function to describe a rendering, two requests with the same key produce the same art
+def image_render_key(mode, colored, use_quarter_blocks, size=IMAGE_SIZE, depth=TRUECOLOR, use_half_blocks=False):
+    # Options that don't affect the output must not split the cache
+    if not colored:
+        depth, use_half_blocks = 'mono', False
+    if mode == "ascii":
+        use_quarter_blocks = use_half_blocks = False
+    blocks = 'half' if use_half_blocks else 'quarter' if use_quarter_blocks else 'plain'
+    return f"{mode}:{depth}:{blocks}:{size[0]}x{size[1]}"
+
+# Function to read a size like "120x50", falling back to the default and capping at the maximum
+def parse_image_size(text):
+    match = re.fullmatch(r'\s*(\d+)\s*[xX]\s*(\d+)\s*', text)
+    if not match:
+        return IMAGE_SIZE
+    width, height = int(match.group(1)), int(match.group(2))
+    return (max(1, min(width, MAX_IMAGE_SIZE[0])), max(1, min(height, MAX_IMAGE_SIZE[1])))
+
+def store_converted_image(image_path, mode="ansi", colored=True, use_quarter_blocks=False, size=IMAGE_SIZE,
+                          depth=TRUECOLOR, use_half_blocks=False):
+    """Return the image_cache id of this image rendered with these options.
+
+    The image is only decoded and converted the first time a given file
+    content and rendering is posted; later posts reuse the stored art.
+    """
+    file_hash = file_digest(image_path)
+    render_key = image_render_key(mode, colored, use_quarter_blocks, size, depth, use_half_blocks)
+    lookup = 'SELECT id FROM image_cache WHERE file_hash = ? AND render_key = ?'
+
+    with bbs_connection() as conn:
+        row = conn.execute(lookup, (file_hash, render_key)).fetchone()
+    if row is not None:
+        return row[0]
+
+    art = convert_image(image_path, mode, colored, use_quarter_blocks, size, depth, use_half_blocks)
+    with bbs_connection() as conn:
+        # Another caller may have stored the same rendering in the meantime
+        conn.execute('INSERT OR IGNORE INTO image_cache (file_hash, render_key, content) VALUES (?, ?, ?)',
+                     (file_hash, render_key, art))
+        return conn.execute(lookup, (file_hash, render_key)).fetchone()[0]
+
+def expand_pics(content):
+    """Replace the [pic=N] references in a post with the stored art."""
+    if '[pic=' not in content:
+        return content
+    art = {}
+    missing = []
+    for image_id in {int(image_id) for image_id in IMAGE_REFERENCE.findall(content)}:
+        cached = image_render_cache.get(image_id)
+        if cached is None:
+            missing.append(image_id)
+        else:
+            art[image_id] = cached
+
+    if missing:
+        marks = ', '.join('?' for _ in missing)
+        with bbs_connection() as conn:
+            rows = conn.execute(f'SELECT id, content FROM image_cache WHERE id IN ({marks})', missing).fetchall()
+        for image_id, image in rows:
+            image_render_cache.put(image_id, None, image)
+            art[image_id] = image
+
+    return IMAGE_REFERENCE.sub(lambda match: art.get(int(match.group(1)), "[image not found]"), content)
+
+# Function to check the path given to /pic, so network callers can't open arbitrary server files
+def resolve_image_path(image_path):
+    """Return the file /pic should open, or None if it lies outside IMAGE_DIR.
+
+    On the local console (IMAGE_DIR is None) any path is allowed. Otherwise
+    the path is taken relative to IMAGE_DIR and resolved, symlinks and '..'
+    included, and has to stay inside it.
+    """
+    if IMAGE_DIR is None:
+        return image_path
+    root = os.path.realpath(IMAGE_DIR)
+    path = os.path.realpath(os.path.join(root, image_path))
+    if os.path.commonpath([root, path]) != root:
+        return None
+    return path
 
 # BBCode parser with added functionality for /pic command
 def bbcode_parser_with_pic(content):
-    # Function to handle image conversion if /pic is found
-    def insert_image(content, image_path, mode="ansi", colored=True, use_quarter_blocks=False):
-        # Remove extra quotes around the image path
-        image_path = image_path.strip('"')
-        
-        if mode == "ansi":
-            return convert_image_to_colored_ansi(image_path, use_quarter_blocks=use_quarter_blocks) if colored else convert_image_to_ansi(image_path)
-        elif mode == "ascii":
-            # In ASCII mode, we ignore the quarter_block option
-            return convert_image_to_colored_ascii(image_path, use_quarter_blocks=False) if colored else convert_image_to_ascii(image_path)
-        return ""
-
+    """Convert the image named by /pic and append a [pic=N] reference to it."""
     # Look for /pic in the content
     match = re.search(r'/pic (\S+)', content)
     if match:
-        image_path = match.group(1)  # The second part of the match is the file path
+        image_path = resolve_image_path(match.group(1).strip('"'))  # Remove extra quotes around the image path
+        if image_path is None:
+            print(f"Image not found: images must be in the '{IMAGE_DIR}' folder.")
+            return content
         image_format = input("Choose image format (ansi/ascii): ").lower()
+        mode = "ascii" if image_format == "ascii" else "ansi"
         color_option = input("Would you like to use color? (yes/no): ").lower() == 'yes'
-        quarter_block_option = input("Would you like to use quarter blocks for more detail? (yes/no): ").lower() == 'yes'
-        
-        if image_format == "ascii":
-            return content + "\n" + insert_image(content, image_path, mode="ascii", colored=color_option, use_quarter_blocks=quarter_block_option)
-        else:
-            return content + "\n" + insert_image(content, image_path, mode="ansi", colored=color_option, use_quarter_blocks=quarter_block_option)
-    
+
+        depth = TRUECOLOR
+        half_block_option = quarter_block_option = False
+        if color_option:
+            depth = input("Color depth (truecolor/256/16, 16 is smallest over slow links) [truecolor]: ").strip().lower() or TRUECOLOR
+            if depth not in COLOR_DEPTHS:
+                print("Unknown color depth, using truecolor.")
+                depth = TRUECOLOR
+        if mode == "ansi" and color_option:
+            half_block_option = input("Would you like to use half blocks (two pixels per character)? (yes/no): ").lower() == 'yes'
+        if mode == "ansi" and not half_block_option:
+            quarter_block_option = input("Would you like to use quarter blocks for more detail? (yes/no): ").lower() == 'yes'
+        size = parse_image_size(input(f"Size in characters, WIDTHxHEIGHT [{IMAGE_SIZE[0]}x{IMAGE_SIZE[1]}]: "))
+
+        try:
+            image_id = store_converted_image(image_path, mode, color_option, quarter_block_option, size, depth, half_block_option)
+        except (OSError, UnidentifiedImageError):
+            print(f"Image not found or not a readable image: {match.group(1)}")
+            return content
+        return content + f"\n[pic={image_id}]"
+
     return content
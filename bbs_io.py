@@ -0,0 +1,67 @@
+import builtins
+import contextlib
+import contextvars
+import getpass as _getpass
+
+
+class ConsoleIO:
+    """Session I/O bound to the local terminal (stdin/stdout)."""
+
+    def write(self, text):
+        builtins.print(text, end='', flush=True)
+
+    def readline(self, prompt=''):
+        return builtins.input(prompt)
+
+    def readpassword(self, prompt='Password: '):
+        return _getpass.getpass(prompt)
+
+    def notify(self, text):
+        builtins.print(f"\n*** {text} ***", flush=True)
+
+
+# The I/O object for the session running in the current thread or task
+_session_io = contextvars.ContextVar('bbs_session_io', default=ConsoleIO())
+
+def set_session_io(io):
+    """Bind the given I/O object to the current session."""
+    _session_io.set(io)
+
+def get_session_io():
+    """Return the I/O object of the current session."""
+    return _session_io.get()
+
+# Drop-in replacements for the builtins used by the menu modules. They route
+# every prompt and line of output through the current session, so the same
+# menu code can serve the local console or a network caller.
+def print(*args, sep=' ', end='\n', file=None, flush=False):
+    """Write to the current session, like builtins.print."""
+    if file is not None:
+        builtins.print(*args, sep=sep, end=end, file=file, flush=flush)
+        return
+    get_session_io().write(sep.join(str(arg) for arg in args) + end)
+
+def input(prompt=''):
+    """Read a line from the current session, like builtins.input."""
+    return get_session_io().readline(prompt)
+
+def getpass(prompt='Password: '):
+    """Read a password from the current session without echoing it."""
+    return get_session_io().readpassword(prompt)
+
+@contextlib.contextmanager
+def screen():
+    """Group the output of one paged screen.
+
+    Sessions that can address the caller's terminal (telnet) redraw only the
+    lines that changed since the last screen; the console just prints it.
+    """
+    io = get_session_io()
+    if not hasattr(io, 'begin_screen'):
+        yield
+        return
+    io.begin_screen()
+    try:
+        yield
+    finally:
+        io.end_screen()
@@ -1,9 +1,19 @@
-from bbs_auth import register, login 
+from bbs_auth import register, login, update_password, change_user_role
 from bbs_message_board import create_thread, view_threads, reply_to_thread, edit_post
-from bbs_private_messages import send_private_message, view_inbox
+from bbs_private_messages import PM_RETENTION_DAYS, archive_old_messages, send_private_message, unread_count, view_inbox
 from character_npc_manager import character_npc_menu
-import sqlite3
+from bbs_search import search_menu
+from bbs_dice_stats import dice_odds_menu
+from bbs_data_access import CHARACTERS_DB, bbs_connection
+from bbs_io import input, print
+from bbs_message_bus import message_bus
+from bbs_migrations import CHARACTER_MIGRATIONS, run_migrations
+from bbs_passwords import hash_password, verify_password
+from bbs_session import end_session, get_access_password, store_access_password
+import argparse
 import re
+import bbs_image_converter
+import bbs_session
 
 # Function to validate the GM access password
 def validate_access_password(password):   
@@ -15,30 +25,28 @@ def validate_access_password(password):
 
 def create_gm_access_password():
     """Function to create the GM access password on the first run of the program."""
-    conn = sqlite3.connect('bbs.db')
-    c = conn.cursor()
-
-    # Ensure the system_settings table exists
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS system_settings (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            setting TEXT UNIQUE,
-            password TEXT
-        )
-    ''')
+    with bbs_connection() as conn:
+        c = conn.cursor()
+
+        # Ensure the system_settings table exists
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS system_settings (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                setting TEXT UNIQUE,
+                password TEXT
+            )
+        ''')
 
     # Check if the access password has been set before
-    c.execute('SELECT password FROM system_settings WHERE setting = "access_password"')
-    password = c.fetchone()
+    password, _ = get_access_password()
 
-    if not password or password[0] is None:
+    if password is None:
         # First run, prompt GM to create a new access password
         while True:
             new_password = input("Please set an access password for restricted sections (min 8 characters, at least 1 special character): ")
             if validate_access_password(new_password):
                 # Save the new access password to the database
-                c.execute('INSERT INTO system_settings (setting, password) VALUES ("access_password", ?)', (new_password,))
-                conn.commit()
+                store_access_password(hash_password(new_password))
                 print("Access password set successfully.")
                 break
             else:
@@ -46,25 +54,29 @@ def create_gm_access_password():
     else:
         print("Access password has already been set.")
 
-    conn.close()
+def check_user_access_password(session):
+    """Prompt the user for the access password if not already validated. GMs are always let through.
 
-def check_user_access_password():
-    """Prompt the user for the access password if not already validated."""
-    conn = sqlite3.connect('bbs.db')
-    c = conn.cursor()
+    Once entered, the password stays valid for the session for
+    bbs_session.ACCESS_TTL seconds, or until the GM changes it.
+    """
+    if session.access_validated:
+        return True
 
-    # Check if the access password has been set by the GM
-    c.execute('SELECT password FROM system_settings WHERE setting = "access_password"')
-    password = c.fetchone()
+    password, version = get_access_password()
 
-    if not password or password[0] is None:
+    if password is None:
         print("Access password not set. Please ask the GM to set it.")
         return False
     else:
         # Prompt the user to enter the access password
         for _ in range(3):  # Allow up to 3 attempts
             input_password = input("Enter the access password to view restricted sections: ")
-            if input_password == password[0]:
+            matches, needs_rehash = verify_password(input_password, password)
+            if matches:
+                if needs_rehash:
+                    store_access_password(hash_password(input_password), new_password=False)
+                session.grant_access(version)
                 return True
             else:
                 print("Incorrect access password.")
@@ -72,14 +84,10 @@ def check_user_access_password():
 
 def check_gm_access_password():
     """Prompt the GM to create or change an access password."""
-    conn = sqlite3.connect('bbs.db')
-    c = conn.cursor()
-
     # Check if the access password has already been set
-    c.execute('SELECT password FROM system_settings WHERE setting = "access_password"')
-    password = c.fetchone()
+    password, _ = get_access_password()
 
-    if not password or password[0] is None:
+    if password is None:
         create_gm_access_password()
     else:
         # Access password exists, offer the option to change it
@@ -88,94 +96,98 @@ def check_gm_access_password():
             while True:
                 new_password = input("Enter a new access password: ")
                 if validate_access_password(new_password):
-                    # Update the access password in the database
-                    c.execute('UPDATE system_settings SET password = ? WHERE setting = "access_password"', (new_password,))
-                    conn.commit()
+                    # Update the access password, which also ends every session's access
+                    store_access_password(hash_password(new_password))
                     print("Access password updated successfully.")
                     break
                 else:
                     print("Invalid password. It must be at least 8 characters long and contain at least one special character.")
 
-    conn.close()
-
 def check_gm_login_password():
     """Check GM login password before allowing GM to log in."""
-    conn = sqlite3.connect('bbs.db')
-    c = conn.cursor()
+    with bbs_connection() as conn:
+        c = conn.cursor()
 
-    # Retrieve the GM login password from the database
-    c.execute('SELECT password FROM users WHERE role = "gm"')
-    gm_password = c.fetchone()[0]
+        # Retrieve the GM login password from the database
+        c.execute('SELECT id, password FROM users WHERE role = "gm"')
+        gm_id, gm_password = c.fetchone()
 
     # Prompt for GM login password
     for _ in range(3):  # Allow up to 3 attempts
         input_password = input("Enter GM login password: ")
-        if input_password == gm_password:
+        matches, needs_rehash = verify_password(input_password, gm_password)
+        if matches:
+            if needs_rehash:
+                update_password(gm_id, hash_password(input_password))
             return True
         else:
             print("Incorrect GM login password.")
     
-    conn.close()
     return False
 
-def main_menu(user):
-    user_id = user[0]  # Assuming the first item in the user tuple is the user_id
-    role = user[1]     # Assuming the second item is the user's role ('gm' or 'user')
+def main_menu(session):
+    """The main menu for a logged-in caller. The session is passed on to every submenu."""
 
     while True:
         print("\nMain Menu")
         print("1. View Threads")
         print("2. Reply to Thread")
         print("3. Send Private Message")
-        print("4. View Inbox")
-        print("5. Create Thread" if role == 'gm' else "SORRY GM ONLY")
+        unread = unread_count(session.user_id)  # Read from a maintained counter, not a COUNT(*)
+        print(f"4. View Inbox ({unread} new)" if unread else "4. View Inbox")
+        print("5. Create Thread" if session.is_gm else "SORRY GM ONLY")
         print("6. Edit Post")
         print("7. Character/NPC Management")  # Accessible to all users now
-        print("8. Change Access Password" if role == 'gm' else "SORRY GM ONLY")
+        print("8. Change Access Password" if session.is_gm else "SORRY GM ONLY")
         print("9. Logout")
+        print("10. Search Posts & Messages")
+        print("11. Dice Odds")
+        print("12. Change User Role" if session.is_gm else "SORRY GM ONLY")
         
         choice = input("Enter your choice: ")
 
         if choice == "1":
-            view_threads(user_id)  # Pass user_id to view_threads()
+            view_threads(session)
         elif choice == "2":
-            if role == 'gm' or check_user_access_password():
-                reply_to_thread(user_id)
+            if check_user_access_password(session):
+                reply_to_thread(session)
             else:
                 print("Access denied.")
         elif choice == "3":
-            if role == 'gm' or check_user_access_password():
-                send_private_message(user_id)
+            if check_user_access_password(session):
+                send_private_message(session)
             else:
                 print("Access denied.")
         elif choice == "4":
-            if role == 'gm' or check_user_access_password():
-                view_inbox(user_id)
+            if check_user_access_password(session):
+                view_inbox(session)
             else:
                 print("Access denied.")
-        elif choice == "5" and role == 'gm':
-            create_thread(user_id)
-        elif choice == "6" and role == 'gm':
-            edit_post(user_id)
+        elif choice == "5" and session.is_gm:
+            create_thread(session)
+        elif choice == "6" and session.is_gm:
+            edit_post(session)
         elif choice == "7":
-            if role == 'gm' or check_user_access_password():
-                character_npc_menu(user_id)  # Now passes user_id
+            if check_user_access_password(session):
+                character_npc_menu(session)
             else:
                 print("Access denied.")
-        elif choice == "8" and role == 'gm':
+        elif choice == "8" and session.is_gm:
             check_gm_access_password()  # Allow GM to change the access password
         elif choice == "9":
             print("Logged out.")
             break
+        elif choice == "10":
+            search_menu(session, lambda: check_user_access_password(session))
+        elif choice == "11":
+            dice_odds_menu()
+        elif choice == "12" and session.is_gm:
+            change_user_role(session)
         else:
             print("Invalid choice.")
 
-if __name__ == "__main__":
-    print("Welcome to the RPG TERMINAL BBS")
-    
-    # Check or set GM access password on first run of the program
-    create_gm_access_password()
-    
+def run_bbs_session():
+    """Run the register/login loop for one caller, on the console or a network connection."""
     while True:
         print("\n1. Register")
         print("2. Login")
@@ -186,10 +198,49 @@ if __name__ == "__main__":
         if choice == "1":
             register()
         elif choice == "2":
-            user = login()
-            if user:
-                main_menu(user)
+            session = login()
+            if session:
+                try:
+                    main_menu(session)
+                finally:
+                    end_session(session)
         elif choice == "3":
             break
         else:
             print("Invalid choice.")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="RPG TERMINAL BBS")
+    parser.add_argument('--telnet', action='store_true', help="serve callers over telnet/TCP instead of the local console")
+    parser.add_argument('--host', default='0.0.0.0', help="address to listen on in telnet mode")
+    parser.add_argument('--port', type=int, default=2323, help="port to listen on in telnet mode")
+    parser.add_argument('--no-compression', action='store_true', help="don't offer MCCP2 compression to telnet callers")
+    parser.add_argument('--pm-retention-days', type=int, default=PM_RETENTION_DAYS, help="archive read private messages older than this many days at startup")
+    parser.add_argument('--image-dir', default='images', help="in telnet mode, the folder /pic may read images from")
+    parser.add_argument('--access-ttl', type=int, default=bbs_session.ACCESS_TTL, help="seconds an entered access password stays valid for a session")
+    args = parser.parse_args()
+    bbs_session.ACCESS_TTL = args.access_ttl
+    if args.telnet:
+        bbs_image_converter.IMAGE_DIR = args.image_dir  # Callers are remote, keep /pic away from other server files
+
+    print("Welcome to the RPG TERMINAL BBS")
+
+    # Bring the database schemas (indexes etc.) up to date
+    run_migrations(verbose=True)
+    run_migrations(CHARACTERS_DB, CHARACTER_MIGRATIONS, verbose=True)
+
+    # Keep the private message table small by archiving old, read messages
+    archived = archive_old_messages(args.pm_retention_days)
+    if archived:
+        print(f"Archived {archived} private message(s) older than {args.pm_retention_days} days.")
+    
+    # Check or set GM access password on first run of the program
+    create_gm_access_password()
+
+    if args.telnet:
+        from bbs_server import serve
+        serve(args.host, args.port, compression=not args.no_compression)
+        message_bus.flush()
+        print(f"Message bus: {message_bus.stats()}")
+    else:
+        run_bbs_session()
@@ -0,0 +1,144 @@
+import atexit
+import statistics
+import threading
+import time
+from collections import deque
+
+from bbs_data_access import bbs_connection
+from bbs_session import live_sessions
+
+FLUSH_INTERVAL = 0.05  # Seconds the flusher lets a burst of sends gather into one transaction
+MAX_BATCH = 500  # Messages stored per transaction
+METRIC_SAMPLES = 1000  # Latency and batch-size samples kept for the percentiles
+
+
+def percentiles(samples, scale=1000):
+    """Return (p50, p95, max) of the samples, scaled (to milliseconds by default)."""
+    samples = sorted(samples)
+    if not samples:
+        return 0.0, 0.0, 0.0
+    if len(samples) >= 2:
+        cuts = statistics.quantiles(samples, n=100, method='inclusive')
+        p50, p95 = cuts[49], cuts[94]
+    else:
+        p50 = p95 = samples[0]
+    return round(p50 * scale, 3), round(p95 * scale, 3), round(samples[-1] * scale, 3)
+
+
+class MessageBus:
+    """In-process delivery queue for private messages.
+
+    send() only appends to a queue, so a caller never waits on SQLite. A
+    background flusher stores the queued messages in batched transactions
+    and then pushes a notification line to each recipient's live sessions.
+    Anyone who needs to read what was sent (the inbox) calls flush() first.
+    """
+
+    def __init__(self, flush_interval=FLUSH_INTERVAL, max_batch=MAX_BATCH):
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()  # One flush at a time, so messages are stored in send order
+        self._thread = None
+        self.sent = 0
+        self.stored = 0
+        self.batches = 0
+        self.failures = 0
+        self.enqueue_latency = deque(maxlen=METRIC_SAMPLES)  # Time send() took
+        self.delivery_latency = deque(maxlen=METRIC_SAMPLES)  # From send() to stored
+        self.batch_sizes = deque(maxlen=METRIC_SAMPLES)
+
+    def send(self, sender_id, sender_name, receiver_id, content, reply_to=None):
+        """Queue a private message for delivery."""
+        started = time.perf_counter()
+        with self._cond:
+            self._queue.append((started, sender_id, sender_name, receiver_id, content, reply_to))
+            self.sent += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='bbs-message-bus', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        self.enqueue_latency.append(time.perf_counter() - started)
+
+    def flush(self):
+        """Store everything queued so far, from the calling thread. Returns the number of messages stored."""
+        stored = 0
+        with self._flush_lock:
+            while True:
+                with self._cond:
+                    batch = [self._queue.popleft() for _ in range(min(self.max_batch, len(self._queue)))]
+                if not batch:
+                    return stored
+                try:
+                    self._store(batch)
+                except Exception:
+                    with self._cond:
+                        self._queue.extendleft(reversed(batch))  # Keep them for the next try
+                        self.failures += 1
+                    raise
+                stored += len(batch)
+                self._notify(batch)
+
+    def _store(self, batch):
+        with bbs_connection() as conn:
+            conn.executemany('INSERT INTO private_messages (sender_id, receiver_id, content, reply_to) VALUES (?, ?, ?, ?)',
+                             [(sender_id, receiver_id, content, reply_to)
+                              for _, sender_id, _, receiver_id, content, reply_to in batch])
+        now = time.perf_counter()
+        self.stored += len(batch)
+        self.batches += 1
+        self.batch_sizes.append(len(batch))
+        self.delivery_latency.extend(now - queued for queued, *_ in batch)
+
+    def _notify(self, batch):
+        """Tell every recipient who is logged in that they have mail, once per sender."""
+        senders = {}
+        for _, _, sender_name, receiver_id, _, _ in batch:
+            senders.setdefault(receiver_id, {}).setdefault(sender_name, 0)
+            senders[receiver_id][sender_name] += 1
+        for receiver_id, counts in senders.items():
+            for session in live_sessions(receiver_id):
+                for sender_name, count in counts.items():
+                    what = "a new private message" if count == 1 else f"{count} new private messages"
+                    session.notify(f"You have {what} from {sender_name}.")
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Message bus could not store messages, retrying: {e!r}")
+                time.sleep(1)
+
+    def stats(self):
+        """Queue metrics: messages sent/stored, batch sizes and latencies in milliseconds."""
+        enqueue = percentiles(self.enqueue_latency)
+        delivery = percentiles(self.delivery_latency)
+        sizes = list(self.batch_sizes)
+        return {
+            'sent': self.sent,
+            'stored': self.stored,
+            'pending': len(self._queue),
+            'batches': self.batches,
+            'failures': self.failures,
+            'mean_batch': round(sum(sizes) / len(sizes), 1) if sizes else 0.0,
+            'max_batch': max(sizes, default=0),
+            'enqueue_p50_ms': enqueue[0],
+            'enqueue_p95_ms': enqueue[1],
+            'enqueue_max_ms': enqueue[2],
+            'delivery_p50_ms': delivery[0],
+            'delivery_p95_ms': delivery[1],
+            'delivery_max_ms': delivery[2],
+        }
+
+
+# The bus every session sends through
+message_bus = MessageBus()
+
+# Don't lose queued messages when the program exits
+atexit.register(message_bus.flush)
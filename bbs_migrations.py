@@ -0,0 +1,560 @@
+import sqlite3
+from bbs_data_access import BBS_DB, CHARACTERS_DB, get_pool
+from character_skills import parse_skills, set_skills
+
+SCHEMA_VERSION_SETTING = 'schema_version'
+
+# Function to build the FTS5 full-text indexes used by bbs_search
+def create_search_index(conn):
+    """Create FTS5 indexes over post content, thread titles and private messages, kept in sync by triggers."""
+    try:
+        conn.execute('CREATE VIRTUAL TABLE IF NOT EXISTS fts5_probe USING fts5(x)')
+        conn.execute('DROP TABLE fts5_probe')
+    except sqlite3.OperationalError:
+        print("SQLite was built without FTS5, search will fall back to slower LIKE matching.")
+        return
+
+    # (FTS table, source table, indexed column)
+    for fts, table, column in (('posts_fts', 'posts', 'content'),
+                               ('threads_fts', 'threads', 'title'),
+                               ('private_messages_fts', 'private_messages', 'content')):
+        conn.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+                     f"{column}, content='{table}', content_rowid='id', tokenize='porter unicode61')")
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN
+                INSERT INTO {fts} (rowid, {column}) VALUES (new.id, new.{column});
+            END
+        ''')
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN
+                INSERT INTO {fts} ({fts}, rowid, {column}) VALUES ('delete', old.id, old.{column});
+            END
+        ''')
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {column} ON {table} BEGIN
+                INSERT INTO {fts} ({fts}, rowid, {column}) VALUES ('delete', old.id, old.{column});
+                INSERT INTO {fts} (rowid, {column}) VALUES (new.id, new.{column});
+            END
+        ''')
+        # Index everything that was written before the triggers existed
+        conn.execute(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")
+
+# Function to add read/unread and archive/delete state to private messages, with per-user counters kept by triggers
+def create_inbox_counters(conn):
+    """Add private_messages.read_at, sender_state and receiver_state, and the pm_counters table.
+
+    A side's state is 0 (shown), 1 (archived) or 2 (deleted), so archiving or
+    deleting a message only takes it away from the user who did it. The
+    counters only count messages the receiver still shows.
+    """
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(private_messages)')]
+    if 'read_at' not in columns:
+        conn.execute('ALTER TABLE private_messages ADD COLUMN read_at TIMESTAMP')
+    for column in ('sender_state', 'receiver_state'):
+        if column not in columns:
+            conn.execute(f'ALTER TABLE private_messages ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0')
+    # view_inbox: the messages a user received and still shows, newest first
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_pm_receiver_state_sent '
+                 'ON private_messages (receiver_id, receiver_state, sent_at)')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS pm_counters (
+            user_id INTEGER PRIMARY KEY,
+            received INTEGER NOT NULL DEFAULT 0,
+            unread INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS pm_counters_ai AFTER INSERT ON private_messages BEGIN
+            INSERT INTO pm_counters (user_id, received, unread) VALUES (new.receiver_id, 1, new.read_at IS NULL)
+            ON CONFLICT(user_id) DO UPDATE SET received = received + 1, unread = unread + (new.read_at IS NULL);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS pm_counters_ad AFTER DELETE ON private_messages WHEN old.receiver_state = 0 BEGIN
+            UPDATE pm_counters SET received = received - 1, unread = unread - (old.read_at IS NULL)
+            WHERE user_id = old.receiver_id;
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS pm_counters_au AFTER UPDATE OF read_at, receiver_state ON private_messages
+        WHEN (old.receiver_state = 0) != (new.receiver_state = 0) OR (old.read_at IS NULL) != (new.read_at IS NULL) BEGIN
+            UPDATE pm_counters SET
+                received = received + (new.receiver_state = 0) - (old.receiver_state = 0),
+                unread = unread + (new.receiver_state = 0 AND new.read_at IS NULL)
+                                - (old.receiver_state = 0 AND old.read_at IS NULL)
+            WHERE user_id = new.receiver_id;
+        END
+    ''')
+    # Count everything received before the triggers existed
+    conn.execute('''
+        INSERT OR REPLACE INTO pm_counters (user_id, received, unread)
+        SELECT receiver_id, COUNT(*), SUM(read_at IS NULL) FROM private_messages
+        WHERE receiver_state = 0 GROUP BY receiver_id
+    ''')
+
+# Function to group private messages into conversations and give them somewhere to be archived
+def create_conversations(conn):
+    """Key every private message by its participant pair, add reply links, per-user conversation summaries and the archive.
+
+    Rows move to the archive once neither side shows them, and are removed
+    once both sides deleted them.
+    """
+    columns = [row[1] for row in conn.execute('PRAGMA table_xinfo(private_messages)')]
+    if 'reply_to' not in columns:
+        conn.execute('ALTER TABLE private_messages ADD COLUMN reply_to INTEGER')
+    # The pair (lower user id, higher user id) names a conversation whichever way a message went
+    if 'user_low' not in columns:
+        conn.execute('ALTER TABLE private_messages ADD COLUMN user_low INTEGER '
+                     'GENERATED ALWAYS AS (min(sender_id, receiver_id)) VIRTUAL')
+    if 'user_high' not in columns:
+        conn.execute('ALTER TABLE private_messages ADD COLUMN user_high INTEGER '
+                     'GENERATED ALWAYS AS (max(sender_id, receiver_id)) VIRTUAL')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_pm_conversation ON private_messages (user_low, user_high, sent_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_pm_sent ON private_messages (sent_at)')
+
+    # One row per user and conversation partner, so listing a user's conversations doesn't touch the messages.
+    # Each side sees its own set of messages, so each side has its own summary.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS pm_user_conversations (
+            user_id INTEGER NOT NULL,
+            partner_id INTEGER NOT NULL,
+            message_count INTEGER NOT NULL DEFAULT 0,
+            last_sent_at TIMESTAMP,
+            PRIMARY KEY (user_id, partner_id)
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_pm_user_conversations_recent '
+                 'ON pm_user_conversations (user_id, last_sent_at)')
+    add = '''
+            INSERT INTO pm_user_conversations (user_id, partner_id, message_count, last_sent_at)
+            SELECT {user}, {partner}, 1, new.sent_at WHERE {condition}
+            ON CONFLICT(user_id, partner_id) DO UPDATE SET message_count = message_count + 1,
+                last_sent_at = max(last_sent_at, excluded.last_sent_at);'''
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS pm_user_conversations_ai AFTER INSERT ON private_messages BEGIN
+            {add.format(user='new.sender_id', partner='new.receiver_id', condition='1')}
+            {add.format(user='new.receiver_id', partner='new.sender_id', condition='new.receiver_id != new.sender_id')}
+        END
+    ''')
+    # A side stops counting a message when it archives or deletes it, or when the row leaves the table
+    remove = '''
+            UPDATE pm_user_conversations SET message_count = message_count - 1,
+                last_sent_at = (SELECT max(sent_at) FROM private_messages
+                                WHERE user_low = min({user}, {partner}) AND user_high = max({user}, {partner})
+                                AND ((sender_id = {user} AND sender_state = 0) OR (receiver_id = {user} AND receiver_state = 0)))
+            WHERE user_id = {user} AND partner_id = {partner};
+            DELETE FROM pm_user_conversations WHERE user_id = {user} AND partner_id = {partner} AND message_count <= 0;'''
+    for name, event, row, side, user, partner in (
+            ('pm_user_conversations_sender_au', 'UPDATE OF sender_state', 'new', 'sender', 'sender_id', 'receiver_id'),
+            ('pm_user_conversations_receiver_au', 'UPDATE OF receiver_state', 'new', 'receiver', 'receiver_id', 'sender_id'),
+            ('pm_user_conversations_sender_ad', 'DELETE', 'old', 'sender', 'sender_id', 'receiver_id'),
+            ('pm_user_conversations_receiver_ad', 'DELETE', 'old', 'receiver', 'receiver_id', 'sender_id')):
+        condition = f'old.{side}_state = 0'
+        if row == 'new':
+            condition += f' AND new.{side}_state != 0'
+        if side == 'receiver':
+            condition += f' AND {row}.receiver_id != {row}.sender_id'  # A note to self is counted once
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON private_messages WHEN {condition} BEGIN
+                {remove.format(user=f'{row}.{user}', partner=f'{row}.{partner}')}
+            END
+        ''')
+    conn.execute('''
+        INSERT OR REPLACE INTO pm_user_conversations (user_id, partner_id, message_count, last_sent_at)
+        SELECT user_id, partner_id, COUNT(*), max(sent_at) FROM (
+            SELECT sender_id AS user_id, receiver_id AS partner_id, sent_at FROM private_messages
+            WHERE sender_state = 0
+            UNION ALL
+            SELECT receiver_id, sender_id, sent_at FROM private_messages
+            WHERE receiver_state = 0 AND receiver_id != sender_id
+        ) GROUP BY user_id, partner_id
+    ''')
+
+    # Archived messages leave the hot table (and its counters and search index) but can still be read
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS private_messages_archive (
+            id INTEGER PRIMARY KEY,
+            sender_id INTEGER,
+            receiver_id INTEGER,
+            content TEXT NOT NULL,
+            sent_at TIMESTAMP,
+            read_at TIMESTAMP,
+            reply_to INTEGER,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            sender_state INTEGER NOT NULL DEFAULT 0,
+            receiver_state INTEGER NOT NULL DEFAULT 0,
+            user_low INTEGER GENERATED ALWAYS AS (min(sender_id, receiver_id)) VIRTUAL,
+            user_high INTEGER GENERATED ALWAYS AS (max(sender_id, receiver_id)) VIRTUAL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_pm_archive_conversation '
+                 'ON private_messages_archive (user_low, user_high, sent_at)')
+
+# Function to move the comma-joined characters.skills text into its own table
+def create_character_skills(conn):
+    """Create character_skills and move every character's skills string into it, one row per skill."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS character_skills (
+            character_id INTEGER NOT NULL,
+            skill TEXT NOT NULL COLLATE NOCASE,
+            value INTEGER NOT NULL,
+            PRIMARY KEY (character_id, skill)
+        ) WITHOUT ROWID
+    ''')
+    # "All NPCs with Spot >= 10": skill equality, then a range over value
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_character_skills_value ON character_skills (skill, value)')
+
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(characters)')]
+    if 'skills' not in columns:
+        return
+    unparsed = 0
+    for character_id, text in conn.execute("SELECT id, skills FROM characters WHERE skills IS NOT NULL AND skills != ''").fetchall():
+        pairs, bad = parse_skills(text)
+        set_skills(conn, character_id, pairs)
+        if bad:
+            print(f"Character {character_id}: kept skills that aren't 'Name value' in the skills field: {', '.join(bad)}")
+            unparsed += 1
+        conn.execute('UPDATE characters SET skills = ? WHERE id = ?', (', '.join(bad) or None, character_id))
+    if not unparsed:
+        try:
+            conn.execute('ALTER TABLE characters DROP COLUMN skills')
+        except sqlite3.OperationalError:
+            pass  # SQLite older than 3.35 can't drop columns; the emptied column is ignored
+
+# Function to index character names and the attributes characters are searched by
+def create_character_search_index(conn):
+    """Create the NOCASE name and attribute indexes and the FTS5 trigram index over character names.
+
+    Also called after modify_fields rebuilds the characters table, which drops its indexes and triggers.
+    """
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(characters)')]
+    if not columns:
+        return
+    # Prefix search and the name-ordered list, for everyone and for players only
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_characters_name ON characters (name COLLATE NOCASE)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_characters_role_name ON characters (role, name COLLATE NOCASE)')
+    for column in ('class', 'race'):
+        if column in columns:
+            level = ', level' if 'level' in columns else ''
+            conn.execute(f'CREATE INDEX IF NOT EXISTS idx_characters_{column}_level '
+                         f'ON characters ({column} COLLATE NOCASE{level})')
+    if 'level' in columns:
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_characters_level ON characters (level)')
+
+    try:
+        conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS fts5_probe USING fts5(x, tokenize='trigram')")
+        conn.execute('DROP TABLE fts5_probe')
+    except sqlite3.OperationalError:
+        print("SQLite has no FTS5 trigram tokenizer, character substring search will fall back to LIKE matching.")
+        return
+    conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS characters_fts USING fts5("
+                 "name, content='characters', content_rowid='id', tokenize='trigram')")
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS characters_fts_ai AFTER INSERT ON characters BEGIN
+            INSERT INTO characters_fts (rowid, name) VALUES (new.id, new.name);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS characters_fts_ad AFTER DELETE ON characters BEGIN
+            INSERT INTO characters_fts (characters_fts, rowid, name) VALUES ('delete', old.id, old.name);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS characters_fts_au AFTER UPDATE OF name ON characters BEGIN
+            INSERT INTO characters_fts (characters_fts, rowid, name) VALUES ('delete', old.id, old.name);
+            INSERT INTO characters_fts (rowid, name) VALUES (new.id, new.name);
+        END
+    ''')
+    conn.execute("INSERT INTO characters_fts (characters_fts) VALUES ('rebuild')")
+
+# Function to count changes to each character sheet, so rendered sheets can be cached
+def create_character_versions(conn):
+    """Create character_versions, bumped by triggers whenever a character's row or skills change.
+
+    A character without a row is at version 0. Deleting a character bumps its
+    version instead of removing it, so a reused id never matches a sheet
+    rendered for the character that had it before.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS character_versions (
+            character_id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    bump = '''INSERT INTO character_versions (character_id, version) VALUES ({id}, 1)
+            ON CONFLICT(character_id) DO UPDATE SET version = version + 1;'''
+    for name, event, table, character_id in (
+            ('characters_version_au', 'UPDATE', 'characters', 'new.id'),
+            ('characters_version_ad', 'DELETE', 'characters', 'old.id'),
+            ('character_skills_version_ai', 'INSERT', 'character_skills', 'new.character_id'),
+            ('character_skills_version_au', 'UPDATE', 'character_skills', 'new.character_id'),
+            ('character_skills_version_ad', 'DELETE', 'character_skills', 'old.character_id')):
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON {table} BEGIN
+            {bump.format(id=character_id)}
+            END
+        ''')
+
+# Versioned schema changes for bbs.db. Each entry is (version, description, steps),
+# where a step is either an SQL statement or a function taking the connection.
+# Versions must only ever be appended, never renumbered or edited once shipped.
+BBS_MIGRATIONS = [
+    (1, "Indexes for thread and post lookups", [
+        # view_thread_content and the post count: posts WHERE thread_id = ? ORDER BY created_at, id
+        'CREATE INDEX IF NOT EXISTS idx_posts_thread_created ON posts (thread_id, created_at)',
+        # edit_post: every post, newest first
+        'CREATE INDEX IF NOT EXISTS idx_posts_created ON posts (created_at)',
+        # view_threads/lock_thread (covering) and SELECT DISTINCT category
+        'CREATE INDEX IF NOT EXISTS idx_threads_category_created ON threads (category, created_at, id, title, locked)',
+    ]),
+    (2, "Full-text search over posts, thread titles and private messages", [
+        create_search_index,
+    ]),
+    (3, "Content-addressed cache of converted /pic images", [
+        '''
+        CREATE TABLE IF NOT EXISTS image_cache (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            file_hash TEXT NOT NULL,
+            render_key TEXT NOT NULL,
+            content TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (file_hash, render_key)
+        )
+        ''',
+    ]),
+    (4, "Dice roll log with per-thread seeded streams", [
+        '''
+        CREATE TABLE IF NOT EXISTS dice_streams (
+            thread_id INTEGER PRIMARY KEY,
+            seed TEXT NOT NULL,
+            next_seq INTEGER NOT NULL DEFAULT 0
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS dice_rolls (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            thread_id INTEGER NOT NULL,
+            seq INTEGER NOT NULL,
+            post_id INTEGER,
+            user_id INTEGER NOT NULL,
+            expression TEXT NOT NULL,
+            total INTEGER NOT NULL,
+            totals TEXT NOT NULL,
+            dice TEXT NOT NULL,
+            rolled_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (thread_id, seq)
+        )
+        ''',
+        # "All rolls by user X in thread Y", newest first
+        'CREATE INDEX IF NOT EXISTS idx_dice_rolls_thread_user ON dice_rolls (thread_id, user_id, seq)',
+        'CREATE INDEX IF NOT EXISTS idx_dice_rolls_post ON dice_rolls (post_id, seq)',
+        'CREATE INDEX IF NOT EXISTS idx_dice_rolls_user ON dice_rolls (user_id, rolled_at)',
+    ]),
+    (5, "Inbox read state, per-side archive/delete state and per-user unread counters", [
+        create_inbox_counters,
+        # "Mark all as read" only touches the unread rows
+        'CREATE INDEX IF NOT EXISTS idx_pm_receiver_unread ON private_messages (receiver_id, sent_at) WHERE read_at IS NULL',
+    ]),
+    (6, "Private message conversations, reply links and the message archive", [
+        create_conversations,
+    ]),
+]
+
+# Versioned schema changes for characters_npcs.db, applied the same way as BBS_MIGRATIONS
+CHARACTER_MIGRATIONS = [
+    (1, "Character skills in their own table", [
+        create_character_skills,
+    ]),
+    (2, "Character name, attribute and trigram search indexes", [
+        create_character_search_index,
+    ]),
+    (3, "Character sheet versions for the sheet cache", [
+        create_character_versions,
+    ]),
+]
+
+# Hot queries that must be answered from an index, checked by check_query_plans()
+BBS_HOT_QUERIES = [
+    ("thread posts page",
+     'SELECT content, created_by, created_at FROM posts WHERE thread_id = ? AND (created_at, id) > (?, ?) '
+     'ORDER BY created_at ASC, id ASC LIMIT ?'),
+    ("thread posts page (newest first)",
+     'SELECT content, created_by, created_at FROM posts WHERE thread_id = ? AND (created_at, id) < (?, ?) '
+     'ORDER BY created_at DESC, id DESC LIMIT ?'),
+    ("thread post count", 'SELECT COUNT(*) FROM posts WHERE thread_id = ?'),
+    ("all posts page",
+     'SELECT id, content, created_at, locked FROM posts WHERE (created_at, id) < (?, ?) '
+     'ORDER BY created_at DESC, id DESC LIMIT ?'),
+    ("category threads page",
+     'SELECT id, title, locked FROM threads WHERE category = ? AND (created_at, id) > (?, ?) '
+     'ORDER BY created_at ASC, id ASC LIMIT ?'),
+    ("category thread count", 'SELECT COUNT(*) FROM threads WHERE category = ?'),
+    ("category list", 'SELECT DISTINCT category FROM threads'),
+    ("converted image lookup", 'SELECT id FROM image_cache WHERE file_hash = ? AND render_key = ?'),
+    ("thread dice rolls",
+     'SELECT id, seq, user_id, post_id, expression, total, dice, rolled_at FROM dice_rolls '
+     'WHERE thread_id = ? ORDER BY seq DESC LIMIT ?'),
+    ("thread dice rolls by user",
+     'SELECT id, seq, user_id, post_id, expression, total, dice, rolled_at FROM dice_rolls '
+     'WHERE thread_id = ? AND user_id = ? ORDER BY seq DESC LIMIT ?'),
+    ("post dice rolls",
+     'SELECT id, seq, user_id, post_id, expression, total, dice, rolled_at FROM dice_rolls '
+     'WHERE post_id = ? ORDER BY seq'),
+    ("inbox page",
+     'SELECT m.id, m.sender_id, u.username, m.content, m.sent_at, m.read_at, m.sent_at, m.id FROM private_messages m '
+     'LEFT JOIN users u ON u.id = m.sender_id WHERE m.receiver_id = ? AND m.receiver_state = 0 '
+     'AND (m.sent_at, m.id) < (?, ?) ORDER BY m.sent_at DESC, m.id DESC LIMIT ?'),
+    ("inbox counters", 'SELECT received, unread FROM pm_counters WHERE user_id = ?'),
+    ("conversation page",
+     'SELECT id, sender_id, content, sent_at, read_at, reply_to, sent_at, id FROM private_messages '
+     'WHERE user_low = ? AND user_high = ? AND ((sender_id = ? AND sender_state = 0) OR (receiver_id = ? AND receiver_state = 0)) '
+     'AND (sent_at, id) < (?, ?) ORDER BY sent_at DESC, id DESC LIMIT ?'),
+    ("archived conversation page",
+     'SELECT id, sender_id, content, sent_at, read_at, reply_to, sent_at, id FROM ('
+     'SELECT id, sender_id, content, sent_at, read_at, reply_to FROM private_messages '
+     'WHERE user_low = ? AND user_high = ? AND ((sender_id = ? AND sender_state = 1) OR (receiver_id = ? AND receiver_state = 1)) '
+     'UNION ALL SELECT id, sender_id, content, sent_at, read_at, reply_to FROM private_messages_archive '
+     'WHERE user_low = ? AND user_high = ? AND ((sender_id = ? AND sender_state != 2) OR (receiver_id = ? AND receiver_state != 2))) '
+     'WHERE (sent_at, id) < (?, ?) ORDER BY sent_at DESC, id DESC LIMIT ?'),
+    # The exact text list_conversations runs (bbs_private_messages.CONVERSATIONS_SQL)
+    ("conversation list", '''
+            SELECT c.partner_id, u.username, c.message_count, c.last_sent_at
+            FROM pm_user_conversations c
+            LEFT JOIN users u ON u.id = c.partner_id
+            WHERE c.user_id = ?
+            ORDER BY c.last_sent_at DESC
+        '''),
+    ("latest message from a partner",
+     'SELECT id FROM private_messages WHERE user_low = ? AND user_high = ? AND sender_id = ? AND receiver_id = ? '
+     'AND receiver_state = 0 ORDER BY sent_at DESC, id DESC LIMIT 1'),
+    ("conversation size", 'SELECT message_count FROM pm_user_conversations WHERE user_id = ? AND partner_id = ?'),
+    ("messages past retention", 'SELECT id FROM private_messages WHERE sent_at < ? AND read_at IS NOT NULL'),
+    ("unread messages",
+     'UPDATE private_messages SET read_at = CURRENT_TIMESTAMP WHERE receiver_id = ? AND receiver_state = 0 AND read_at IS NULL'),
+]
+
+# Hot queries on characters_npcs.db
+CHARACTER_HOT_QUERIES = [
+    ("character list page",
+     'SELECT id, name, role FROM characters WHERE (name, id) > (? COLLATE NOCASE, ?) '
+     'ORDER BY name COLLATE NOCASE, id LIMIT ?'),
+    ("player character list page",
+     'SELECT id, name, role FROM characters WHERE role = ? AND (name, id) < (? COLLATE NOCASE, ?) '
+     'ORDER BY name COLLATE NOCASE DESC, id DESC LIMIT ?'),
+    ("player character count", 'SELECT COUNT(*) FROM characters WHERE role = ?'),
+    ("character name prefix",
+     'SELECT id, name, role FROM characters WHERE name >= ? COLLATE NOCASE AND name < ? COLLATE NOCASE '
+     'ORDER BY name COLLATE NOCASE, id LIMIT ?'),
+    ("player name prefix",
+     'SELECT id, name, role FROM characters WHERE role = ? AND name >= ? COLLATE NOCASE AND name < ? COLLATE NOCASE '
+     'ORDER BY name COLLATE NOCASE, id LIMIT ?'),
+    ("characters by class and level",
+     'SELECT id, name, role FROM characters WHERE class = ? COLLATE NOCASE AND level >= ? AND level <= ?'),
+    ("characters by race", 'SELECT id, name, role FROM characters WHERE race = ? COLLATE NOCASE'),
+    ("character sheet skills",
+     'SELECT character_id, skill, value FROM character_skills WHERE character_id IN (?, ?) '
+     'ORDER BY character_id, skill'),
+    ("character sheet version", 'SELECT version FROM character_versions WHERE character_id = ?'),
+    ("NPCs with a skill of at least N",
+     'SELECT id, name, role FROM characters WHERE role = ? AND id IN '
+     '(SELECT character_id FROM character_skills WHERE skill = ? AND value >= ?) '
+     'ORDER BY name COLLATE NOCASE, id LIMIT ?'),
+]
+
+# Function to make sure system_settings can hold the schema version
+def ensure_settings_table(conn):
+    """Create system_settings if needed and add the generic 'value' column."""
+    c = conn.cursor()
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS system_settings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            setting TEXT UNIQUE,
+            password TEXT
+        )
+    ''')
+    try:
+        c.execute('SELECT value FROM system_settings LIMIT 1')
+    except sqlite3.OperationalError:
+        c.execute('ALTER TABLE system_settings ADD COLUMN value TEXT')
+
+def get_schema_version(conn):
+    """Return the schema version recorded in system_settings (0 if none)."""
+    row = conn.execute('SELECT value FROM system_settings WHERE setting = ?', (SCHEMA_VERSION_SETTING,)).fetchone()
+    return int(row[0]) if row and row[0] is not None else 0
+
+def set_schema_version(conn, version):
+    """Record the schema version in system_settings."""
+    conn.execute('INSERT INTO system_settings (setting, value) VALUES (?, ?) '
+                 'ON CONFLICT(setting) DO UPDATE SET value = excluded.value',
+                 (SCHEMA_VERSION_SETTING, str(version)))
+
+def run_migrations(db_path=BBS_DB, migrations=BBS_MIGRATIONS, verbose=False):
+    """Apply every migration newer than the recorded schema version. Safe to run at every startup."""
+    with get_pool(db_path).connection() as conn:
+        ensure_settings_table(conn)
+        conn.commit()
+        current = get_schema_version(conn)
+
+        for version, description, steps in migrations:
+            if version <= current:
+                continue
+            # Each migration and its version bump commit together, or not at all
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                # Another process may have applied it while we waited for the lock
+                if get_schema_version(conn) >= version:
+                    conn.rollback()
+                    continue
+                for step in steps:
+                    if callable(step):
+                        step(conn)
+                    else:
+                        conn.execute(step)
+                set_schema_version(conn, version)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            current = version
+            if verbose:
+                print(f"Applied schema migration {version} to '{db_path}': {description}")
+        return current
+
+def check_query_plans(db_path=BBS_DB, queries=BBS_HOT_QUERIES):
+    """Run EXPLAIN QUERY PLAN on each hot query. Returns (failures, skipped).
+
+    A query fails the check if any step scans a table without an index or has
+    to sort its result in a temporary B-tree. Queries on a field the GM removed
+    with Modify Fields (such as class or level) are never run, so they are
+    skipped and listed by name.
+    """
+    failures, skipped = [], []
+    with get_pool(db_path).connection() as conn:
+        for name, sql in queries:
+            params = [0] * sql.count('?')
+            try:
+                plan = [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+            except sqlite3.OperationalError as e:
+                if 'no such column' not in str(e):
+                    raise
+                skipped.append(name)
+                continue
+            for detail in plan:
+                full_scan = detail.startswith('SCAN') and 'INDEX' not in detail
+                if full_scan or 'TEMP B-TREE' in detail:
+                    failures.append((name, plan))
+                    break
+    return failures, skipped
+
+if __name__ == "__main__":
+    for db_path, migrations, queries in ((BBS_DB, BBS_MIGRATIONS, BBS_HOT_QUERIES),
+                                         (CHARACTERS_DB, CHARACTER_MIGRATIONS, CHARACTER_HOT_QUERIES)):
+        version = run_migrations(db_path, migrations, verbose=True)
+        print(f"'{db_path}' is at schema version {version}.")
+        failures, skipped = check_query_plans(db_path, queries)
+        for name, plan in failures:
+            print(f"NOT INDEXED: {name}: {plan}")
+        for name in skipped:
+            print(f"Skipped (a field it uses was removed): {name}")
+        assert not failures, "Some hot queries are not using an index."
+        print(f"All {len(queries) - len(skipped)} hot queries checked on '{db_path}' use an index.")
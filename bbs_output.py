@@ -0,0 +1,215 @@
+import re
+
+# Matches one SGR (color/style) escape and captures its parameters
+SGR_PATTERN = re.compile(r'\033\[([0-9;]*)m')
+# Matches any CSI escape, used to measure how wide a line really is on screen
+CSI_PATTERN = re.compile(r'\033\[[0-9;?]*[A-Za-z]')
+
+# Terminal style state: (attributes, foreground, background). None means unknown.
+DEFAULT_STATE = (frozenset(), (), ())
+
+# Default terminal size, used until the caller reports its own (telnet NAWS)
+TERMINAL_SIZE = (80, 24)
+
+
+def apply_sgr(state, params):
+    """Return the style state after an SGR escape, or None if it uses codes that aren't tracked."""
+    if state is None:
+        return None
+    attrs, fg, bg = set(state[0]), state[1], state[2]
+    codes = [int(code) if code else 0 for code in params.split(';')] if params else [0]
+    i = 0
+    while i < len(codes):
+        code = codes[i]
+        if code == 0:
+            attrs.clear()
+            fg = bg = ()
+        elif 1 <= code <= 9:
+            attrs.add(code)
+        elif code == 22:
+            attrs -= {1, 2}
+        elif 23 <= code <= 29 and code != 26:
+            attrs.discard(code - 20)
+        elif 30 <= code <= 37 or 90 <= code <= 97:
+            fg = (code,)
+        elif code == 39:
+            fg = ()
+        elif 40 <= code <= 47 or 100 <= code <= 107:
+            bg = (code,)
+        elif code == 49:
+            bg = ()
+        elif code in (38, 48):
+            # 38;5;n / 48;5;n (256 colors) or 38;2;r;g;b / 48;2;r;g;b (24-bit)
+            length = {5: 3, 2: 5}.get(codes[i + 1] if i + 1 < len(codes) else None)
+            if length is None or i + length > len(codes):
+                return None
+            if code == 38:
+                fg = tuple(codes[i:i + length])
+            else:
+                bg = tuple(codes[i:i + length])
+            i += length
+            continue
+        else:
+            return None
+        i += 1
+    return (frozenset(attrs), fg, bg)
+
+def sgr_transition(current, target):
+    """Return the shortest escape that takes the terminal from the current style to the target one."""
+    if current == target:
+        return ''
+    attrs, fg, bg = target
+    if current is None or not current[0] <= attrs or (current[1] and not fg) or (current[2] and not bg):
+        # Something has to be switched off, so start from a reset
+        codes = [0] + sorted(attrs) + list(fg) + list(bg)
+    else:
+        codes = sorted(attrs - current[0])
+        codes += list(fg) if fg != current[1] else []
+        codes += list(bg) if bg != current[2] else []
+    return f"\033[{';'.join(str(code) for code in codes)}m"
+
+def line_end_state(state, line):
+    """Return the style state in effect at the end of a line that started in the given state."""
+    for match in SGR_PATTERN.finditer(line):
+        state = apply_sgr(state if state is not None else DEFAULT_STATE, match.group(1))
+    return state
+
+def visible_width(line):
+    """Number of columns a line takes up, ignoring escape sequences."""
+    return len(CSI_PATTERN.sub('', line))
+
+
+class SGRFilter:
+    """Drops redundant color/style escapes from a stream of output.
+
+    Runs of escapes are collapsed into the one transition they add up to, and
+    that transition is only written when visible text follows. Resets that are
+    immediately followed by the same colors, as in per-character colored art,
+    disappear entirely.
+    """
+
+    def __init__(self):
+        self.state = DEFAULT_STATE  # What the terminal is actually showing
+        self.pending = None  # Style requested by escapes not yet written
+
+    def feed(self, text):
+        out = []
+        position = 0
+        for match in SGR_PATTERN.finditer(text):
+            if match.start() > position:
+                out.append(self._emit())
+                out.append(text[position:match.start()])
+            position = match.end()
+            params = match.group(1)
+            if params.split(';')[0] in ('', '0'):
+                base = DEFAULT_STATE  # Starts with a reset, so the previous style doesn't matter
+            else:
+                base = self.pending if self.pending is not None else self.state
+            target = apply_sgr(base, params)
+            if target is None:
+                # Codes we don't track: pass the escape through and stop assuming anything
+                out.append(self._emit())
+                out.append(match.group(0))
+                self.state = None
+                continue
+            self.pending = target
+        if position < len(text):
+            out.append(self._emit())
+            out.append(text[position:])
+        return ''.join(out)
+
+    def finish(self):
+        """Write any style change still pending, e.g. before waiting for the caller to type."""
+        return self._emit()
+
+    def _emit(self):
+        if self.pending is None:
+            return ''
+        escape = sgr_transition(self.state, self.pending)
+        self.state = self.pending
+        self.pending = None
+        return escape
+
+
+class ScreenDiff:
+    """Redraws only the lines of a paged screen that changed since it was last drawn.
+
+    The first frame clears the terminal and is drawn from the top. Later
+    frames move the cursor to each changed line and rewrite just that line,
+    then clear whatever was printed below the frame (prompts, typed answers,
+    error messages). Frames that are too wide or too tall to address line by
+    line, or a screen that has scrolled since, fall back to a full redraw.
+    """
+
+    def __init__(self, width=TERMINAL_SIZE[0], height=TERMINAL_SIZE[1]):
+        self.width = width
+        self.height = height
+        self.frame = None  # [(style at line start, line)] currently on screen
+        self.rows_below = 0  # Lines output under the frame since it was drawn
+
+    def note_output(self, text):
+        if self.frame is not None:
+            self.rows_below += text.count('\n')
+            if len(self.frame) + self.rows_below >= self.height:
+                self.frame = None  # The frame has scrolled, positions are no longer known
+
+    def note_input(self):
+        self.note_output('\n')  # The caller's Enter moves the cursor down a line
+
+    def render(self, text):
+        """Return what has to be sent to show this frame."""
+        lines = text.split('\n')
+        if lines and lines[-1] == '':
+            lines.pop()
+        if len(lines) + 2 > self.height or any(visible_width(line) >= self.width for line in lines):
+            self.frame = None
+            return text  # Wrapped or scrolled lines can't be addressed, send it as ordinary output
+
+        frame = []
+        state = DEFAULT_STATE
+        for line in lines:
+            frame.append((state, line))
+            state = line_end_state(state, line)
+
+        previous, self.frame, self.rows_below = self.frame, frame, 0
+        if previous is None:
+            return "\033[H\033[J" + '\n'.join(lines) + '\n'
+
+        out = []
+        for row, (start, line) in enumerate(frame):
+            if row < len(previous) and previous[row] == (start, line):
+                continue
+            out.append(f"\033[{row + 1};1H\033[0m{sgr_transition(DEFAULT_STATE, start or DEFAULT_STATE)}{line}\033[0m\033[K")
+        out.append(f"\033[{len(frame) + 1};1H\033[0m\033[J")
+        return ''.join(out)
+
+
+class OutputPipeline:
+    """Everything between the menu code's output and the transport.
+
+    Screens are diffed against what the caller already sees, then the whole
+    stream goes through the SGR filter. Compression, where negotiated, is
+    applied by the transport afterwards.
+    """
+
+    def __init__(self, width=TERMINAL_SIZE[0], height=TERMINAL_SIZE[1]):
+        self.sgr = SGRFilter()
+        self.screen = ScreenDiff(width, height)
+
+    def resize(self, width, height):
+        self.screen.width = width or TERMINAL_SIZE[0]
+        self.screen.height = height or TERMINAL_SIZE[1]
+        self.screen.frame = None
+
+    def text(self, text):
+        """Ordinary output, printed below whatever is on screen."""
+        self.screen.note_output(text)
+        return text
+
+    def frame(self, text):
+        """Output of a screen() block."""
+        return self.screen.render(text)
+
+    def encode(self, text):
+        """Filter a batch of output and return what goes on the wire before compression."""
+        return self.sgr.feed(text) + self.sgr.finish()
@@ -0,0 +1,196 @@
+from bbs_data_access import BBS_DB, get_pool
+
+PAGE_SIZE = 5  # Default number of rows per page
+
+
+class Page:
+    """One page of rows returned by a KeysetPager."""
+
+    def __init__(self, rows, number, total_rows, page_size, has_next, has_prev):
+        self.rows = rows
+        self.number = number  # 0-based page number
+        self.total_rows = total_rows
+        self.page_size = page_size
+        self.total_pages = max(1, (total_rows + page_size - 1) // page_size)
+        self.has_next = has_next
+        self.has_prev = has_prev
+        self.offset = number * page_size  # Rows shown before this page
+
+    def __bool__(self):
+        return bool(self.rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def numbered(self):
+        """Yield (list number, row) pairs, numbering continues across pages."""
+        for idx, row in enumerate(self.rows, start=self.offset + 1):
+            yield idx, row
+
+    def pick(self, number):
+        """Return the row shown under the given list number, or None if it isn't on this page."""
+        index = number - self.offset - 1
+        if 0 <= index < len(self.rows):
+            return self.rows[index]
+        return None
+
+
+class KeysetPager:
+    """Page through a table ordered by (created_at, id) without OFFSET or fetchall().
+
+    Each page is fetched with a row-value comparison against the first or last
+    key of the page currently on screen, so a page turn only reads one page of
+    rows no matter how deep into the table the user is. The total row count is
+    taken with a single COUNT(*) when the pager is created, unless the caller
+    already knows it and passes total_rows.
+    """
+
+    def __init__(self, table, columns, where=None, params=(), order='ASC', page_size=PAGE_SIZE,
+                 key_columns=('created_at', 'id'), db_path=BBS_DB, total_rows=None, row_factory=None):
+        self.table = table
+        self.columns = columns
+        self.where = where
+        self.params = tuple(params)
+        self.descending = order.upper() == 'DESC'
+        self.page_size = page_size
+        self.key_columns = key_columns
+        self.db_path = db_path
+        self.row_factory = row_factory  # Called with each row's columns, e.g. to build a summary object
+        self.total_rows = self.count() if total_rows is None else total_rows
+        self._page = None
+        self._first_key = None
+        self._last_key = None
+
+    def count(self):
+        """Count the rows matching the pager's filter."""
+        sql = f'SELECT COUNT(*) FROM {self.table}'
+        if self.where:
+            sql += f' WHERE {self.where}'
+        with get_pool(self.db_path).connection() as conn:
+            return conn.execute(sql, self.params).fetchone()[0]
+
+    def refresh_count(self):
+        """Re-count the rows, e.g. after the user added a post."""
+        self.total_rows = self.count()
+
+    def _fetch(self, after=None, before=None, inclusive=False):
+        """Fetch page_size + 1 rows in display order (after=) or reverse order (before=)."""
+        key_list = ', '.join(self.key_columns)
+        # A key such as 'name COLLATE NOCASE' is compared as (name, ...) > (? COLLATE NOCASE, ...),
+        # the form SQLite answers with a range over an index that uses the same collation
+        compare_list, key_marks = [], []
+        for col in self.key_columns:
+            column, collate, collation = col.partition(' COLLATE ')
+            compare_list.append(column)
+            key_marks.append(f'? COLLATE {collation}' if collate else '?')
+        compare_list = ', '.join(compare_list)
+        key_marks = ', '.join(key_marks)
+        conditions = [self.where] if self.where else []
+        params = list(self.params)
+        backwards = before is not None
+
+        # Walking back up the list means comparing and sorting the other way round
+        reverse = self.descending != backwards
+        if after is not None or before is not None:
+            operator = ('<' if reverse else '>') + ('=' if inclusive else '')
+            conditions.append(f"({compare_list}) {operator} ({key_marks})")
+            params.extend(after if after is not None else before)
+        direction = 'DESC' if reverse else 'ASC'
+
+        sql = f'SELECT {self.columns}, {key_list} FROM {self.table}'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY ' + ', '.join(f'{col} {direction}' for col in self.key_columns)
+        sql += ' LIMIT ?'
+        params.append(self.page_size + 1)
+
+        with get_pool(self.db_path).connection() as conn:
+            rows = conn.execute(sql, params).fetchall()
+
+        more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if backwards:
+            rows.reverse()
+        return rows, more
+
+    def _make_page(self, rows, number, has_next, has_prev):
+        width = len(self.key_columns)
+        if rows:
+            self._first_key = rows[0][-width:]
+            self._last_key = rows[-1][-width:]
+        rows = [row[:-width] for row in rows]
+        if self.row_factory is not None:
+            rows = [self.row_factory(*row) for row in rows]
+        self._page = Page(rows, number, self.total_rows, self.page_size, has_next, has_prev)
+        return self._page
+
+    def first(self):
+        """Return the first page."""
+        rows, more = self._fetch()
+        return self._make_page(rows, 0, more, False)
+
+    def next(self):
+        """Return the page after the current one (or the current page if it is the last)."""
+        if self._page is None:
+            return self.first()
+        if not self._page.has_next:
+            return self._page
+        rows, more = self._fetch(after=self._last_key)
+        if not rows:
+            return self._page
+        return self._make_page(rows, self._page.number + 1, more, True)
+
+    def prev(self):
+        """Return the page before the current one (or the current page if it is the first)."""
+        if self._page is None:
+            return self.first()
+        if not self._page.has_prev:
+            return self._page
+        rows, more = self._fetch(before=self._first_key)
+        if not rows:
+            return self.first()
+        number = self._page.number - 1 if more else 0
+        return self._make_page(rows, max(number, 0), True, more)
+
+    def reload(self):
+        """Re-read the current page, e.g. after one of its rows was edited or locked."""
+        if self._page is None or self._page.number == 0:
+            return self.first()
+        rows, more = self._fetch(after=self._first_key, inclusive=True)
+        return self._make_page(rows, self._page.number, more, True)
+
+
+class ListPager:
+    """Page through rows that are already in memory, such as a capped list of search results.
+
+    Offers the same first/next/prev/reload calls as KeysetPager, so a screen can take either.
+    """
+
+    def __init__(self, rows, page_size=PAGE_SIZE):
+        self.rows = list(rows)
+        self.page_size = page_size
+        self.total_rows = len(self.rows)
+        self._number = 0
+
+    def _page_at(self, number):
+        last = max(0, (self.total_rows - 1) // self.page_size)
+        self._number = min(max(number, 0), last)
+        start = self._number * self.page_size
+        return Page(self.rows[start:start + self.page_size], self._number, self.total_rows, self.page_size,
+                    self._number < last, self._number > 0)
+
+    def first(self):
+        """Return the first page."""
+        return self._page_at(0)
+
+    def next(self):
+        """Return the page after the current one (or the current page if it is the last)."""
+        return self._page_at(self._number + 1)
+
+    def prev(self):
+        """Return the page before the current one (or the current page if it is the first)."""
+        return self._page_at(self._number - 1)
+
+    def reload(self):
+        """Return the current page again."""
+        return self._page_at(self._number)
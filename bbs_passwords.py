@@ -0,0 +1,141 @@
+import base64
+import hashlib
+import hmac
+import json
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bbs_data_access import bbs_connection
+from bbs_migrations import ensure_settings_table
+
+# system_settings row holding the cost parameters new hashes are made with
+HASH_PARAMS_SETTING = 'password_hash_params'
+
+TARGET_LOGIN_SECONDS = 0.25  # Time one password check should take, set by calibrate() at install
+HASH_WORKERS = 4  # Password hashes computed at once; a burst of logins queues here instead of starving other callers
+SALT_BYTES = 16
+HASH_BYTES = 32
+
+# scrypt needs 128 * r * n bytes per hash, so n is capped and extra cost goes into p beyond that
+MIN_SCRYPT_N = 2 ** 12
+MAX_SCRYPT_N = 2 ** 16
+MIN_PBKDF2_ITERATIONS = 100000
+
+# Used until the install has calibrated the cost for this machine
+DEFAULT_PARAMS = {'algorithm': 'scrypt', 'n': 2 ** 14, 'r': 8, 'p': 1}
+if not hasattr(hashlib, 'scrypt'):  # OpenSSL built without scrypt
+    DEFAULT_PARAMS = {'algorithm': 'pbkdf2_sha256', 'iterations': 600000}
+
+_executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix='bbs-hash')
+_params = None  # Cached copy of the stored parameters
+_params_lock = threading.Lock()
+
+
+def _b64(data):
+    return base64.b64encode(data).decode('ascii')
+
+def _derive(password, salt, params):
+    """Run the key derivation function described by params."""
+    if params['algorithm'] == 'scrypt':
+        n, r, p = params['n'], params['r'], params['p']
+        return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p,
+                              maxmem=256 * r * n + 2 ** 20, dklen=HASH_BYTES)
+    return hashlib.pbkdf2_hmac('sha256', password.encode(), salt, params['iterations'], dklen=HASH_BYTES)
+
+def _encode(params, salt, digest):
+    """Write a hash as a self-describing string, e.g. 'scrypt$16384$8$1$<salt>$<hash>'."""
+    if params['algorithm'] == 'scrypt':
+        cost = f"{params['n']}${params['r']}${params['p']}"
+    else:
+        cost = str(params['iterations'])
+    return f"{params['algorithm']}${cost}${_b64(salt)}${_b64(digest)}"
+
+def _decode(stored):
+    """Split a stored hash into (params, salt, digest), or return None if it isn't one of ours."""
+    parts = stored.split('$')
+    try:
+        if parts[0] == 'scrypt' and len(parts) == 6:
+            params = {'algorithm': 'scrypt', 'n': int(parts[1]), 'r': int(parts[2]), 'p': int(parts[3])}
+        elif parts[0] == 'pbkdf2_sha256' and len(parts) == 4:
+            params = {'algorithm': 'pbkdf2_sha256', 'iterations': int(parts[1])}
+        else:
+            return None
+        return params, base64.b64decode(parts[-2]), base64.b64decode(parts[-1])
+    except ValueError:
+        return None
+
+def get_params():
+    """The cost parameters new hashes are made with, read from system_settings once."""
+    global _params
+    with _params_lock:
+        if _params is None:
+            with bbs_connection() as conn:
+                ensure_settings_table(conn)
+                row = conn.execute('SELECT value FROM system_settings WHERE setting = ?',
+                                   (HASH_PARAMS_SETTING,)).fetchone()
+            _params = json.loads(row[0]) if row and row[0] else dict(DEFAULT_PARAMS)
+        return _params
+
+def set_params(params):
+    """Store new cost parameters. Existing hashes are upgraded as their owners log in."""
+    global _params
+    with bbs_connection() as conn:
+        ensure_settings_table(conn)
+        conn.execute('INSERT INTO system_settings (setting, value) VALUES (?, ?) '
+                     'ON CONFLICT(setting) DO UPDATE SET value = excluded.value',
+                     (HASH_PARAMS_SETTING, json.dumps(params)))
+    with _params_lock:
+        _params = dict(params)
+
+def calibrate(target=TARGET_LOGIN_SECONDS):
+    """Find the cost parameters that make one hash on this machine take about `target` seconds."""
+    password, salt = 'calibration', secrets.token_bytes(SALT_BYTES)
+
+    def timed(params):
+        started = time.perf_counter()
+        _derive(password, salt, params)
+        return time.perf_counter() - started
+
+    if DEFAULT_PARAMS['algorithm'] == 'scrypt':
+        params = {'algorithm': 'scrypt', 'n': MIN_SCRYPT_N, 'r': 8, 'p': 1}
+        elapsed = timed(params)
+        # Doubling n doubles the time, until the memory cap is reached
+        while elapsed * 2 <= target and params['n'] < MAX_SCRYPT_N:
+            params['n'] *= 2
+            elapsed = timed(params)
+        # Beyond that, each extra unit of p costs another full pass
+        params['p'] = max(1, round(target / elapsed))
+        return params
+
+    params = {'algorithm': 'pbkdf2_sha256', 'iterations': MIN_PBKDF2_ITERATIONS}
+    elapsed = timed(params)
+    params['iterations'] = max(MIN_PBKDF2_ITERATIONS, int(params['iterations'] * target / elapsed))
+    return params
+
+def hash_password(password):
+    """Return a salted hash of a password, computed on the hashing pool."""
+    params = get_params()
+    salt = secrets.token_bytes(SALT_BYTES)
+    digest = _executor.submit(_derive, password, salt, params).result()
+    return _encode(params, salt, digest)
+
+def verify_password(password, stored):
+    """Check a password against a stored hash. Returns (matches, needs_rehash).
+
+    Passwords stored in plain text by older versions are still accepted, and
+    always need a rehash. A missing stored value (unknown user) still costs a
+    full hash, so a failed login takes as long whether or not the name exists.
+    """
+    decoded = _decode(stored) if stored else None
+    if decoded is None:
+        if not stored:
+            _executor.submit(_derive, password, secrets.token_bytes(SALT_BYTES), get_params()).result()
+            return False, False
+        return hmac.compare_digest(password.encode(), stored.encode()), True
+
+    params, salt, digest = decoded
+    candidate = _executor.submit(_derive, password, salt, params).result()
+    matches = hmac.compare_digest(candidate, digest)
+    return matches, matches and params != get_params()
@@ -1,41 +1,311 @@
-import sqlite3
 from bbs_auth import get_user_id
+from bbs_data_access import bbs_connection
+from bbs_io import input, print, screen
+from bbs_message_bus import message_bus
+from bbs_pagination import KeysetPager
 
-def send_private_message(sender_id):
-    conn = sqlite3.connect('bbs.db')
-    c = conn.cursor()
+# What each side of a message has done with it (sender_state and receiver_state)
+SHOWN = 0
+ARCHIVED = 1
+DELETED = 2
 
+# The inbox is paged newest first, with each sender's name joined in from users
+INBOX_TABLE = 'private_messages m LEFT JOIN users u ON u.id = m.sender_id'
+INBOX_COLUMNS = 'm.id, m.sender_id, u.username, m.content, m.sent_at, m.read_at'
+INBOX_WHERE = f'm.receiver_id = ? AND m.receiver_state = {SHOWN}'
+
+# Columns copied when a message moves to private_messages_archive
+ARCHIVE_COLUMNS = 'id, sender_id, receiver_id, content, sent_at, read_at, reply_to, sender_state, receiver_state'
+CONVERSATION_COLUMNS = 'id, sender_id, content, sent_at, read_at, reply_to'
+
+# Messages between two users that one of them (the last two parameters) has in a given state
+CONVERSATION_WHERE = ('user_low = ? AND user_high = ? AND '
+                      '((sender_id = ? AND sender_state {test}) OR (receiver_id = ? AND receiver_state {test}))')
+
+# The user's conversations, most recent first, from the summaries the triggers keep per user
+CONVERSATIONS_SQL = '''
+            SELECT c.partner_id, u.username, c.message_count, c.last_sent_at
+            FROM pm_user_conversations c
+            LEFT JOIN users u ON u.id = c.partner_id
+            WHERE c.user_id = ?
+            ORDER BY c.last_sent_at DESC
+        '''
+
+PM_RETENTION_DAYS = 90  # Read messages older than this are moved to the archive at startup
+
+def conversation_key(user_a, user_b):
+    """The (lower id, higher id) pair that names the conversation between two users."""
+    return min(user_a, user_b), max(user_a, user_b)
+
+def send_private_message(session):
     receiver_username = input("Enter the receiver's username: ")
     receiver_id = get_user_id(receiver_username)
 
     if receiver_id:
         content = input("Enter your message: ")
-        c.execute('INSERT INTO private_messages (sender_id, receiver_id, content) VALUES (?, ?, ?)', 
-                  (sender_id, receiver_id, content))
-        conn.commit()
+        message_bus.send(session.user_id, session.username, receiver_id, content)  # Stored by the bus in the background
         print("Message sent successfully!")
     else:
         print("User not found.")
-    
-    conn.close()
-
-def view_inbox(user_id):
-    conn = sqlite3.connect('bbs.db')
-    c = conn.cursor()
-
-    c.execute('''
-    SELECT sender_id, content, sent_at 
-    FROM private_messages 
-    WHERE receiver_id = ? 
-    ORDER BY sent_at DESC
-    ''', (user_id,))
-    messages = c.fetchall()
-
-    if messages:
-        print("\nInbox:")
-        for message in messages:
-            print(f"From {message[0]}: {message[1]} (Sent at {message[2]})")
+
+def inbox_counts(user_id):
+    """Return (messages received, unread) from the counters the triggers keep, without counting rows."""
+    with bbs_connection() as conn:
+        row = conn.execute('SELECT received, unread FROM pm_counters WHERE user_id = ?', (user_id,)).fetchone()
+    return row if row else (0, 0)
+
+def unread_count(user_id):
+    """Number of unread private messages, e.g. for the main menu."""
+    return inbox_counts(user_id)[1]
+
+def mark_read(user_id, message_ids):
+    """Mark some of a user's messages as read."""
+    if not message_ids:
+        return
+    marks = ', '.join('?' for _ in message_ids)
+    with bbs_connection() as conn:
+        conn.execute(f'UPDATE private_messages SET read_at = CURRENT_TIMESTAMP '
+                     f'WHERE receiver_id = ? AND receiver_state = {SHOWN} AND read_at IS NULL AND id IN ({marks})',
+                     [user_id, *message_ids])
+
+def mark_all_read(user_id):
+    """Mark every unread message of a user as read."""
+    with bbs_connection() as conn:
+        conn.execute(f'UPDATE private_messages SET read_at = CURRENT_TIMESTAMP '
+                     f'WHERE receiver_id = ? AND receiver_state = {SHOWN} AND read_at IS NULL', (user_id,))
+
+# Bulk operations. Each one runs in a single transaction and only changes the acting user's
+# side of a message; the triggers keep the counters, conversation summaries and search index
+# in step, and a row is only archived or removed once both sides are done with it.
+def move_to_archive(conn, where, params):
+    """Move the messages matching a condition into the archive. Returns how many were moved."""
+    conn.execute(f'INSERT OR REPLACE INTO private_messages_archive ({ARCHIVE_COLUMNS}) '
+                 f'SELECT {ARCHIVE_COLUMNS} FROM private_messages WHERE {where}', params)
+    return conn.execute(f'DELETE FROM private_messages WHERE {where}', params).rowcount
+
+def set_state(conn, table, user_id, state, where, params):
+    """Move the user's side of the matching messages on to state (archived or deleted). Returns how many changed."""
+    return conn.execute(f'''
+        UPDATE {table} SET
+            sender_state = CASE WHEN sender_id = ? THEN max(sender_state, ?) ELSE sender_state END,
+            receiver_state = CASE WHEN receiver_id = ? THEN max(receiver_state, ?) ELSE receiver_state END
+        WHERE ({where}) AND ((sender_id = ? AND sender_state < ?) OR (receiver_id = ? AND receiver_state < ?))
+    ''', [user_id, state, user_id, state, *params, user_id, state, user_id, state]).rowcount
+
+def settle(conn, where, params):
+    """Remove the matching messages both sides deleted, and archive the ones neither side still shows."""
+    gone = f'({where}) AND sender_state = {DELETED} AND receiver_state = {DELETED}'
+    conn.execute(f'DELETE FROM private_messages WHERE {gone}', params)
+    move_to_archive(conn, f'({where}) AND sender_state != {SHOWN} AND receiver_state != {SHOWN}', params)
+    conn.execute(f'DELETE FROM private_messages_archive WHERE {gone}', params)
+
+def selected_messages(message_ids):
+    """WHERE clause and parameters for the given messages."""
+    marks = ', '.join('?' for _ in message_ids)
+    return f'id IN ({marks})', list(message_ids)
+
+def archive_messages(user_id, message_ids):
+    """Archive a selection of a user's messages at once, for that user only."""
+    if not message_ids:
+        return 0
+    where, params = selected_messages(message_ids)
+    with bbs_connection() as conn:
+        archived = set_state(conn, 'private_messages', user_id, ARCHIVED, where, params)
+        settle(conn, where, params)
+    return archived
+
+def delete_messages(user_id, message_ids):
+    """Delete a selection of a user's messages at once, for that user only."""
+    if not message_ids:
+        return 0
+    where, params = selected_messages(message_ids)
+    with bbs_connection() as conn:
+        deleted = set_state(conn, 'private_messages', user_id, DELETED, where, params)
+        settle(conn, where, params)
+    return deleted
+
+def archive_conversation(user_id, partner_id):
+    """Archive every message between two users, for the first of them only."""
+    key = conversation_key(user_id, partner_id)
+    with bbs_connection() as conn:
+        archived = set_state(conn, 'private_messages', user_id, ARCHIVED, 'user_low = ? AND user_high = ?', key)
+        settle(conn, 'user_low = ? AND user_high = ?', key)
+    return archived
+
+def delete_conversation(user_id, partner_id):
+    """Delete every message between two users, archived ones included, for the first of them only."""
+    key = conversation_key(user_id, partner_id)
+    with bbs_connection() as conn:
+        deleted = set_state(conn, 'private_messages', user_id, DELETED, 'user_low = ? AND user_high = ?', key)
+        deleted += set_state(conn, 'private_messages_archive', user_id, DELETED, 'user_low = ? AND user_high = ?', key)
+        settle(conn, 'user_low = ? AND user_high = ?', key)
+    return deleted
+
+def archive_old_messages(days=PM_RETENTION_DAYS):
+    """Retention policy: move read messages older than `days` days to the archive, keeping the inbox table small."""
+    with bbs_connection() as conn:
+        return move_to_archive(conn, "sent_at < datetime('now', ?) AND read_at IS NOT NULL", (f'-{days} days',))
+
+def parse_numbers(text):
+    """Turn '1, 3 5' into [1, 3, 5], ignoring anything that isn't a number."""
+    return [int(part) for part in text.replace(',', ' ').split() if part.isdigit()]
+
+def list_conversations(user_id):
+    """The user's conversations, most recent first, as (partner id, partner name, messages, last sent)."""
+    with bbs_connection() as conn:
+        return conn.execute(CONVERSATIONS_SQL, (user_id,)).fetchall()
+
+def latest_from(partner_id, user_id):
+    """Id of the newest message the partner sent the user that the user still shows, or None."""
+    with bbs_connection() as conn:
+        row = conn.execute(f'''
+            SELECT id FROM private_messages
+            WHERE user_low = ? AND user_high = ? AND sender_id = ? AND receiver_id = ? AND receiver_state = {SHOWN}
+            ORDER BY sent_at DESC, id DESC LIMIT 1
+        ''', (*conversation_key(partner_id, user_id), partner_id, user_id)).fetchone()
+    return row[0] if row else None
+
+def view_conversation(session, partner_id, partner_name, archived=False):
+    """Page through the messages between the session's user and one partner, newest first."""
+    message_bus.flush()  # Include messages still queued for delivery
+    key = conversation_key(session.user_id, partner_id)
+    mine = (*key, session.user_id, session.user_id)
+    if archived:
+        # What this user archived that the partner still shows, and everything in the archive table
+        # this user hasn't deleted (retention moves messages there for both sides)
+        table = (f"(SELECT {CONVERSATION_COLUMNS} FROM private_messages WHERE {CONVERSATION_WHERE.format(test=f'= {ARCHIVED}')} "
+                 f"UNION ALL SELECT {CONVERSATION_COLUMNS} FROM private_messages_archive "
+                 f"WHERE {CONVERSATION_WHERE.format(test=f'!= {DELETED}')})")
+        pager = KeysetPager(table, CONVERSATION_COLUMNS, params=mine * 2, order='DESC', key_columns=('sent_at', 'id'))
     else:
+        with bbs_connection() as conn:
+            row = conn.execute('SELECT message_count FROM pm_user_conversations WHERE user_id = ? AND partner_id = ?',
+                               (session.user_id, partner_id)).fetchone()
+        pager = KeysetPager('private_messages', CONVERSATION_COLUMNS, CONVERSATION_WHERE.format(test=f'= {SHOWN}'),
+                            mine, order='DESC', key_columns=('sent_at', 'id'), total_rows=row[0] if row else 0)
+    page = pager.first()
+    if not page:
+        print("No archived messages with this user." if archived else "No messages with this user.")
+        return
+
+    heading = "Archived conversation" if archived else "Conversation"
+    while True:
+        with screen():
+            print(f"\n--- {heading} with {partner_name} (Page {page.number + 1}/{page.total_pages}) ---")
+            for number, (message_id, sender_id, content, sent_at, read_at, reply_to) in page.numbered():
+                who = "You" if sender_id == session.user_id else partner_name
+                new = "[NEW] " if read_at is None and sender_id != session.user_id else ""
+                reply = f" (reply to #{reply_to})" if reply_to else ""
+                print(f"{number}. {new}#{message_id} {who}{reply}: {content} (Sent at {sent_at})")
+        if not archived:
+            mark_read(session.user_id, [row[0] for row in page.rows if row[4] is None and row[1] != session.user_id])
+
+        options = "\n'n' for next page, 'p' for previous page, "
+        if not archived:
+            options += "'r' to reply, 'a' to archive the conversation, "
+        action = input(options + "'d' to delete the conversation, 'q' to quit: ").lower()
+        if action == 'n' and page.has_next:
+            page = pager.next()
+        elif action == 'p' and page.has_prev:
+            page = pager.prev()
+        elif action == 'r' and not archived:
+            content = input("Enter your reply: ")
+            message_bus.send(session.user_id, session.username, partner_id, content,
+                             reply_to=latest_from(partner_id, session.user_id))
+            message_bus.flush()  # Store it now so it shows up on the page
+            print("Reply sent.")
+            pager.total_rows += 1
+            page = pager.first()
+        elif action == 'a' and not archived:
+            print(f"Archived {archive_conversation(session.user_id, partner_id)} message(s).")
+            break
+        elif action == 'd':
+            confirm = input(f"Delete every message with {partner_name}, archived ones too? "
+                            f"They stay in {partner_name}'s messages. This cannot be undone. (y/n): ")
+            if confirm.strip().lower() == 'y':
+                print(f"Deleted {delete_conversation(session.user_id, partner_id)} message(s).")
+                break
+        elif action == 'q':
+            break
+        else:
+            print("Invalid choice, please try again.")
+
+def conversations_menu(session):
+    """List the user's conversations and open one of them, or its archive."""
+    message_bus.flush()
+    conversations = list_conversations(session.user_id)
+    if conversations:
+        print("\n--- Conversations ---")
+        for number, (partner_id, partner_name, message_count, last_sent_at) in enumerate(conversations, start=1):
+            print(f"{number}. {partner_name or f'User ID {partner_id}'} ({message_count} message(s), last at {last_sent_at})")
+    else:
+        print("No current conversations.")
+
+    choice = input("Enter a conversation number, or 'v' and a number or username for archived messages "
+                   "(e.g. 'v 2', 'v GM'), or press Enter to return: ").strip()
+    archived = choice[:1].lower() == 'v'
+    target = choice[1:].strip() if archived else choice
+    if target.isdigit() and 1 <= int(target) <= len(conversations):
+        partner_id, partner_name = conversations[int(target) - 1][:2]
+        view_conversation(session, partner_id, partner_name or f'User ID {partner_id}', archived)
+    elif archived and target:
+        partner_id = get_user_id(target)
+        if partner_id:
+            view_conversation(session, partner_id, target, archived=True)
+        else:
+            print("User not found.")
+
+def view_inbox(session):
+    """Page through the inbox, newest first. Messages are marked read once they have been shown."""
+    message_bus.flush()  # Include messages still queued for delivery
+    received, unread = inbox_counts(session.user_id)
+    if not received:
         print("No messages.")
+        if input("Open your conversations (including archived ones)? (y/n): ").strip().lower() == 'y':
+            conversations_menu(session)
+        return
+
+    def open_pager():
+        pager = KeysetPager(INBOX_TABLE, INBOX_COLUMNS, INBOX_WHERE, (session.user_id,), order='DESC',
+                            key_columns=('m.sent_at', 'm.id'), total_rows=received)
+        return pager, pager.first()
+
+    pager, page = open_pager()
+    while page:
+        with screen():
+            print(f"\nInbox: {received} message(s), {unread} new (Page {page.number + 1}/{page.total_pages})")
+            for number, (message_id, sender_id, sender, content, sent_at, read_at) in page.numbered():
+                new = "[NEW] " if read_at is None else ""
+                print(f"{number}. {new}From {sender or f'User ID {sender_id}'}: {content} (Sent at {sent_at})")
+        mark_read(session.user_id, [row[0] for row in page.rows if row[5] is None])
+        unread = unread_count(session.user_id)
 
-    conn.close()
+        action = input("\n'n' for next page, 'p' for previous page, 'a' to mark all as read, 'c' for conversations, "
+                       "'x' to archive or 'd' to delete messages by number, 'q' to quit: ").lower()
+        if action == 'n' and page.has_next:
+            page = pager.next()
+        elif action == 'p' and page.has_prev:
+            page = pager.prev()
+        elif action == 'a':
+            mark_all_read(session.user_id)
+            unread = 0
+            print("All messages marked as read.")
+        elif action == 'c':
+            conversations_menu(session)
+            received, unread = inbox_counts(session.user_id)
+            pager, page = open_pager()
+        elif action in ('x', 'd'):
+            numbers = parse_numbers(input("Enter the message numbers on this page (e.g. 1, 3, 4): "))
+            message_ids = [page.pick(number)[0] for number in numbers if page.pick(number)]
+            if action == 'x':
+                print(f"Archived {archive_messages(session.user_id, message_ids)} message(s).")
+            else:
+                print(f"Deleted {delete_messages(session.user_id, message_ids)} message(s).")
+            received, unread = inbox_counts(session.user_id)
+            pager, page = open_pager()
+            if not page:
+                print("Your inbox is empty.")
+        elif action == 'q':
+            break
+        else:
+            print("Invalid choice, please try again.")
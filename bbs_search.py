@@ -0,0 +1,210 @@
+import re
+from bbs_data_access import bbs_connection
+from bbs_io import input, print, screen
+from bbs_message_board import bbcode_parser, view_thread_content
+from bbs_pagination import PAGE_SIZE
+
+SNIPPET_TOKENS = 12  # Words of context shown around each hit
+
+# Search scopes
+POSTS_SCOPE = 'posts'
+THREADS_SCOPE = 'threads'
+MESSAGES_SCOPE = 'messages'
+
+# Per scope: the FTS5 table, the ranked query and its count, and the LIKE fallback used
+# when SQLite has no FTS5. Result rows are (id, link id, heading, snippet, timestamp).
+# Private-message rows carry the sender id and the other user's name, joined in from users.
+_SEARCH_SQL = {
+    POSTS_SCOPE: {
+        'fts': 'posts_fts',
+        'search': '''
+            SELECT p.id, p.thread_id, t.title,
+                   snippet(posts_fts, 0, '[b]', '[/b]', '...', ?), p.created_at
+            FROM posts_fts
+            JOIN posts p ON p.id = posts_fts.rowid
+            JOIN threads t ON t.id = p.thread_id
+            WHERE posts_fts MATCH ?
+            ORDER BY posts_fts.rank
+            LIMIT ? OFFSET ?
+        ''',
+        'count': 'SELECT COUNT(*) FROM posts_fts WHERE posts_fts MATCH ?',
+        'like': '''
+            SELECT p.id, p.thread_id, t.title, substr(p.content, 1, 80), p.created_at
+            FROM posts p JOIN threads t ON t.id = p.thread_id
+            WHERE p.content LIKE ?
+            ORDER BY p.created_at DESC, p.id DESC
+            LIMIT ? OFFSET ?
+        ''',
+        'like_count': 'SELECT COUNT(*) FROM posts WHERE content LIKE ?',
+    },
+    THREADS_SCOPE: {
+        'fts': 'threads_fts',
+        'search': '''
+            SELECT t.id, t.id, t.category,
+                   highlight(threads_fts, 0, '[b]', '[/b]'), t.created_at
+            FROM threads_fts
+            JOIN threads t ON t.id = threads_fts.rowid
+            WHERE threads_fts MATCH ?
+            ORDER BY threads_fts.rank
+            LIMIT ? OFFSET ?
+        ''',
+        'count': 'SELECT COUNT(*) FROM threads_fts WHERE threads_fts MATCH ?',
+        'like': '''
+            SELECT id, id, category, title, created_at FROM threads
+            WHERE title LIKE ?
+            ORDER BY created_at DESC, id DESC
+            LIMIT ? OFFSET ?
+        ''',
+        'like_count': 'SELECT COUNT(*) FROM threads WHERE title LIKE ?',
+    },
+    MESSAGES_SCOPE: {
+        'fts': 'private_messages_fts',
+        'search': '''
+            SELECT m.id, m.sender_id,
+                   CASE WHEN m.sender_id = ? THEN COALESCE(r.username, 'User ID ' || m.receiver_id)
+                        ELSE COALESCE(s.username, 'User ID ' || m.sender_id) END,
+                   snippet(private_messages_fts, 0, '[b]', '[/b]', '...', ?), m.sent_at
+            FROM private_messages_fts
+            JOIN private_messages m ON m.id = private_messages_fts.rowid
+            LEFT JOIN users s ON s.id = m.sender_id
+            LEFT JOIN users r ON r.id = m.receiver_id
+            WHERE private_messages_fts MATCH ? AND ((m.receiver_id = ? AND m.receiver_state = 0) OR (m.sender_id = ? AND m.sender_state = 0))
+            ORDER BY private_messages_fts.rank
+            LIMIT ? OFFSET ?
+        ''',
+        'count': '''
+            SELECT COUNT(*) FROM private_messages_fts
+            JOIN private_messages m ON m.id = private_messages_fts.rowid
+            WHERE private_messages_fts MATCH ? AND ((m.receiver_id = ? AND m.receiver_state = 0) OR (m.sender_id = ? AND m.sender_state = 0))
+        ''',
+        'like': '''
+            SELECT m.id, m.sender_id,
+                   CASE WHEN m.sender_id = ? THEN COALESCE(r.username, 'User ID ' || m.receiver_id)
+                        ELSE COALESCE(s.username, 'User ID ' || m.sender_id) END,
+                   substr(m.content, 1, 80), m.sent_at
+            FROM private_messages m
+            LEFT JOIN users s ON s.id = m.sender_id
+            LEFT JOIN users r ON r.id = m.receiver_id
+            WHERE m.content LIKE ? AND ((m.receiver_id = ? AND m.receiver_state = 0) OR (m.sender_id = ? AND m.sender_state = 0))
+            ORDER BY m.sent_at DESC, m.id DESC
+            LIMIT ? OFFSET ?
+        ''',
+        'like_count': '''
+            SELECT COUNT(*) FROM private_messages
+            WHERE content LIKE ? AND ((receiver_id = ? AND receiver_state = 0) OR (sender_id = ? AND sender_state = 0))
+        ''',
+    },
+}
+
+_fts_available = {}
+
+# Function to turn what the user typed into a safe FTS5 query
+def to_match_expression(text):
+    """Quote every word so FTS5 operators in user input can't cause syntax errors; the last word matches as a prefix."""
+    words = re.findall(r'\w+', text)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+def fts_available(scope):
+    """Check (once) whether the FTS5 index for a scope exists."""
+    if scope not in _fts_available:
+        with bbs_connection() as conn:
+            row = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                               (_SEARCH_SQL[scope]['fts'],)).fetchone()
+        _fts_available[scope] = row is not None
+    return _fts_available[scope]
+
+def search(scope, text, user_id=None, page=0, page_size=PAGE_SIZE):
+    """Return (rows, total matches) for one page of ranked results.
+
+    Each row is (id, thread id or sender id, thread title/category or the other user's name, snippet, timestamp).
+    Private-message searches only ever see messages the user sent or received and hasn't archived or deleted.
+    """
+    sql = _SEARCH_SQL[scope]
+    owner = (user_id, user_id) if scope == MESSAGES_SCOPE else ()
+    partner = (user_id,) if scope == MESSAGES_SCOPE else ()  # Picks whose name a message row shows
+    offset = page * page_size
+
+    if fts_available(scope):
+        match = to_match_expression(text)
+        if match is None:
+            return [], 0
+        snippet = (SNIPPET_TOKENS,) if scope != THREADS_SCOPE else ()
+        with bbs_connection() as conn:
+            total = conn.execute(sql['count'], (match,) + owner).fetchone()[0]
+            rows = conn.execute(sql['search'], partner + snippet + (match,) + owner + (page_size, offset)).fetchall()
+    else:
+        pattern = f"%{text}%"
+        with bbs_connection() as conn:
+            total = conn.execute(sql['like_count'], (pattern,) + owner).fetchone()[0]
+            rows = conn.execute(sql['like'], partner + (pattern,) + owner + (page_size, offset)).fetchall()
+    return rows, total
+
+def search_posts(text, page=0, page_size=PAGE_SIZE):
+    """Ranked search over post content."""
+    return search(POSTS_SCOPE, text, page=page, page_size=page_size)
+
+def search_thread_titles(text, page=0, page_size=PAGE_SIZE):
+    """Ranked search over thread titles."""
+    return search(THREADS_SCOPE, text, page=page, page_size=page_size)
+
+def search_private_messages(user_id, text, page=0, page_size=PAGE_SIZE):
+    """Ranked search over the private messages a user sent or received."""
+    return search(MESSAGES_SCOPE, text, user_id=user_id, page=page, page_size=page_size)
+
+def search_menu(session, can_read_messages):
+    """Interactive search over posts, thread titles and (with access) the user's private messages."""
+    print("\n--- Search ---")
+    print("1. Posts")
+    print("2. Thread titles")
+    print("3. My private messages")
+    scope = {'1': POSTS_SCOPE, '2': THREADS_SCOPE, '3': MESSAGES_SCOPE}.get(input("Search in: ").strip())
+    if scope is None:
+        print("Invalid choice.")
+        return
+    if scope == MESSAGES_SCOPE and not can_read_messages():
+        print("Access denied.")
+        return
+
+    text = input("Search for: ").strip()
+    page = 0
+    while True:
+        rows, total = search(scope, text, user_id=session.user_id, page=page)
+        if not rows:
+            print("No matches found.")
+            return
+
+        num_pages = (total + PAGE_SIZE - 1) // PAGE_SIZE
+        with screen():
+            print(f"\n--- {total} match(es) for '{text}' (Page {page + 1}/{num_pages}) ---")
+            for idx, (row_id, link_id, heading, snippet, when) in enumerate(rows, start=1 + page * PAGE_SIZE):
+                snippet = bbcode_parser(' '.join(snippet.split()))  # Keep each hit on one line
+                if scope == POSTS_SCOPE:
+                    print(f"{idx}. In '{heading}' (Post ID: {row_id}, On: {when})\n   {snippet}")
+                elif scope == THREADS_SCOPE:
+                    print(f"{idx}. [{heading}] {snippet} (On: {when})")
+                else:
+                    direction = f"To {heading}" if link_id == session.user_id else f"From {heading}"
+                    print(f"{idx}. {direction} (Sent at {when})\n   {snippet}")
+
+        prompt = "\n'n' for next page, 'p' for previous page, "
+        if scope != MESSAGES_SCOPE:
+            prompt += "a result number to open its thread, "
+        action = input(prompt + "'q' to quit: ").strip().lower()
+        if action == 'n' and page < num_pages - 1:
+            page += 1
+        elif action == 'p' and page > 0:
+            page -= 1
+        elif action.isdigit() and scope != MESSAGES_SCOPE:
+            index = int(action) - 1 - page * PAGE_SIZE
+            if 0 <= index < len(rows):
+                view_thread_content(rows[index][1], session)
+            else:
+                print("That result is not on this page.")
+        elif action == 'q':
+            break
+        else:
+            print("Invalid choice, please try again.")
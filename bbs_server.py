@@ -0,0 +1,399 @@
+import asyncio
+import itertools
+import statistics
+import threading
+import time
+import zlib
+from collections import deque
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+
+import bbs_io
+from bbs_output import OutputPipeline
+
+# Server limits
+MAX_SESSIONS = 250  # Concurrent callers served by one process
+IDLE_TIMEOUT = 900  # Seconds of silence before a caller is disconnected
+LATENCY_SAMPLES = 500  # Response-time samples kept per session for percentiles
+LINK_BPS = 1200  # Reference link speed for the per-session transfer-time estimate (10 bits per byte)
+
+# Telnet protocol bytes
+IAC = 255
+DONT = 254
+DO = 253
+WONT = 252
+WILL = 251
+SB = 250
+SE = 240
+ECHO = 1
+NAWS = 31  # Negotiate About Window Size
+COMPRESS2 = 86  # MCCP2: zlib compression of everything the server sends
+
+
+class SessionStats:
+    """Per-session response-time statistics.
+
+    Latency is measured from the moment a caller's line arrives to the moment
+    the BBS has written its reply and is waiting at the next prompt.
+    """
+
+    def __init__(self, session_id, peer):
+        self.session_id = session_id
+        self.peer = peer
+        self.started = time.monotonic()
+        self.requests = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.samples = deque(maxlen=LATENCY_SAMPLES)
+        self.bytes_in = 0
+        self.bytes_raw = 0  # What the menus wrote
+        self.bytes_filtered = 0  # After escape dedupe and screen diffing
+        self.bytes_out = 0  # What went on the wire, after compression
+        self.compressed = False
+
+    def record(self, latency):
+        self.requests += 1
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+        self.samples.append(latency)
+
+    def summary(self):
+        """Return the session's latency figures in milliseconds and its output savings."""
+        samples = sorted(self.samples)
+        if len(samples) >= 2:
+            cuts = statistics.quantiles(samples, n=100, method='inclusive')
+            p50, p95 = cuts[49], cuts[94]
+        else:
+            p50 = p95 = samples[0] if samples else 0.0
+        return {
+            'session': self.session_id,
+            'peer': self.peer,
+            'requests': self.requests,
+            'mean_ms': round(1000 * self.total_latency / self.requests, 2) if self.requests else 0.0,
+            'p50_ms': round(1000 * p50, 2),
+            'p95_ms': round(1000 * p95, 2),
+            'max_ms': round(1000 * self.max_latency, 2),
+            'bytes_in': self.bytes_in,
+            'bytes_raw': self.bytes_raw,
+            'bytes_filtered': self.bytes_filtered,
+            'bytes_out': self.bytes_out,
+            'bytes_saved': self.bytes_raw - self.bytes_out,
+            'saved_pct': round(100 * (self.bytes_raw - self.bytes_out) / self.bytes_raw, 1) if self.bytes_raw else 0.0,
+            'compressed': self.compressed,
+            # Time the output takes at LINK_BPS, unoptimised versus as actually sent
+            'raw_link_s': round(self.bytes_raw * 10 / LINK_BPS, 1),
+            'link_s': round(self.bytes_out * 10 / LINK_BPS, 1),
+            'duration_s': round(time.monotonic() - self.started, 1),
+        }
+
+
+class TelnetSessionIO:
+    """Session I/O for one telnet/TCP caller.
+
+    The menu code runs in a worker thread and calls write()/readline() like it
+    would on the console. Those calls hand the actual socket work to the event
+    loop, so a slow caller never blocks anyone else. Output passes through an
+    OutputPipeline and, if the client agrees to MCCP2, through zlib.
+    """
+
+    def __init__(self, loop, reader, writer, stats, compression=True):
+        self.loop = loop
+        self.reader = reader
+        self.writer = writer
+        self.stats = stats
+        self.compression = compression
+        self.pipeline = OutputPipeline()
+        self._compressor = None  # zlib stream, once MCCP2 has been negotiated
+        self._buffer = []  # Output written since the last flush
+        self._frame = None  # Output of the screen() block in progress
+        self._pending = bytearray()  # Received bytes not yet split into lines
+        self._line_received_at = None
+        self._after_cr = False  # The last line ended in a bare CR, drop a following LF
+        self._notices = []  # Notices from other threads, not yet shown
+        self._notice_lock = threading.Lock()
+        self._waiting = False  # The session thread is blocked at a prompt
+        self._prompt = ''
+
+    def negotiate(self):
+        """Offer compression and ask for the caller's window size."""
+        offers = bytes([IAC, DO, NAWS])
+        if self.compression:
+            offers += bytes([IAC, WILL, COMPRESS2])
+        self._send(offers)
+
+    # Output, called from the session thread
+    def write(self, text):
+        text = text.replace('\r\n', '\n')
+        self.stats.bytes_raw += len(text.replace('\n', '\r\n').encode('utf-8', 'replace'))
+        if self._frame is not None:
+            self._frame.append(text)
+        else:
+            self._buffer.append(self.pipeline.text(text))
+
+    def begin_screen(self):
+        self._frame = []
+
+    def end_screen(self):
+        frame, self._frame = ''.join(self._frame), None
+        self._buffer.append(self.pipeline.frame(frame))
+
+    def flush(self):
+        if not self._buffer:
+            return
+        text = self.pipeline.encode(''.join(self._buffer)).replace('\n', '\r\n')
+        self._buffer.clear()
+        data = text.encode('utf-8', 'replace')
+        self.stats.bytes_filtered += len(data)
+        self._send(data)
+
+    def _send(self, data):
+        if self._compressor is not None:
+            data = self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        self.stats.bytes_out += len(data)
+        self._run(self._write_and_drain(data))
+
+    def _run(self, coro):
+        """Run a coroutine on the event loop and wait for its result."""
+        try:
+            future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        except RuntimeError as e:
+            coro.close()  # The event loop is already closed
+            raise EOFError("Server shutting down.") from e
+        try:
+            return future.result()
+        except (ConnectionError, CancelledError) as e:
+            # The caller hung up or the server is shutting down
+            raise EOFError("Caller disconnected.") from e
+
+    async def _write_and_drain(self, data):
+        if self.writer.is_closing():
+            raise ConnectionResetError()
+        self.writer.write(data)
+        await self.writer.drain()
+
+    # Notices, e.g. new mail, pushed from other threads
+    def notify(self, text):
+        """Show a notice now if the caller is sitting at a prompt, otherwise just before the next one."""
+        with self._notice_lock:
+            self._notices.append(text)
+            waiting = self._waiting
+        if waiting:
+            self._show_notices_soon()
+
+    def _show_notices_soon(self):
+        try:
+            self.loop.call_soon_threadsafe(self._show_notices)
+        except RuntimeError:
+            pass  # The event loop is closed, the caller is gone anyway
+
+    def _show_notices(self):
+        """Write pending notices and repeat the prompt (runs on the event loop)."""
+        with self._notice_lock:
+            # Only while the session thread waits for input, so nothing else is being sent right now
+            if not self._waiting or not self._notices or self.writer.is_closing():
+                return
+            text = ''.join(f"\n*** {notice} ***\n" for notice in self._notices) + self._prompt
+            self._notices.clear()
+            self.pipeline.screen.note_output(text)
+            data = text.replace('\n', '\r\n').encode('utf-8', 'replace')
+            self.stats.bytes_raw += len(data)
+            self.stats.bytes_filtered += len(data)
+            if self._compressor is not None:
+                data = self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+            self.stats.bytes_out += len(data)
+            self.writer.write(data)
+
+    # Input, called from the session thread
+    def readline(self, prompt=''):
+        with self._notice_lock:
+            notices, self._notices = self._notices, []
+        for notice in notices:
+            self.write(f"\n*** {notice} ***\n")
+        self.write(prompt)
+        self.flush()
+        if self._line_received_at is not None:
+            self.stats.record(time.monotonic() - self._line_received_at)
+        with self._notice_lock:
+            self._prompt = prompt
+            self._waiting = True
+            missed = bool(self._notices)  # Arrived while the prompt was being written
+        if missed:
+            self._show_notices_soon()
+        try:
+            line = self._run(self._read_line())
+        finally:
+            with self._notice_lock:
+                self._waiting = False
+        if line is None:
+            raise EOFError("Caller disconnected.")
+        self._line_received_at = time.monotonic()
+        self.pipeline.screen.note_input()
+        return line
+
+    def readpassword(self, prompt='Password: '):
+        # WILL ECHO tells the client we echo, so it stops echoing locally
+        self._send(bytes([IAC, WILL, ECHO]))
+        try:
+            return self.readline(prompt)
+        finally:
+            self._send(bytes([IAC, WONT, ECHO]))
+            self.write('\n')
+
+    async def _read_line(self):
+        """Read one line from the socket, stripping telnet negotiation."""
+        while True:
+            line = self._take_line()
+            if line is not None:
+                return line
+            try:
+                chunk = await asyncio.wait_for(self.reader.read(1024), IDLE_TIMEOUT)
+            except (asyncio.TimeoutError, ConnectionError):
+                return None
+            if not chunk:
+                return None
+            self.stats.bytes_in += len(chunk)
+            self._pending.extend(chunk)
+
+    def _take_line(self):
+        """Pop the first complete line out of the receive buffer, if any."""
+        data = self._pending
+        if self._after_cr and data:
+            if data[0] in (0x0a, 0x00):
+                del data[:1]
+            self._after_cr = False
+        text = bytearray()
+        i = 0
+        while i < len(data):
+            byte = data[i]
+            if byte == IAC:
+                if i + 1 >= len(data):
+                    return None  # Wait for the rest of the command
+                command = data[i + 1]
+                if command == IAC:
+                    text.append(IAC)
+                    i += 2
+                elif command in (WILL, WONT, DO, DONT):
+                    if i + 2 >= len(data):
+                        return None
+                    self._negotiated(command, data[i + 2])
+                    i += 3
+                elif command == SB:
+                    end = data.find(bytes([IAC, SE]), i + 2)
+                    if end == -1:
+                        return None
+                    self._subnegotiated(bytes(data[i + 2:end]).replace(bytes([IAC, IAC]), bytes([IAC])))
+                    i = end + 2
+                else:
+                    i += 2
+            elif byte in (0x0d, 0x0a):
+                # Accept CR LF, CR NUL, bare CR and bare LF as line endings
+                i += 1
+                if byte == 0x0d:
+                    if i < len(data):
+                        if data[i] in (0x0a, 0x00):
+                            i += 1
+                    else:
+                        self._after_cr = True
+                del data[:i]
+                return text.decode('utf-8', 'replace')
+            elif byte in (0x08, 0x7f):
+                if text:
+                    text.pop()
+                i += 1
+            else:
+                text.append(byte)
+                i += 1
+        return None
+
+    def _negotiated(self, command, option):
+        """Handle the caller's answer to one of our telnet offers (runs on the event loop)."""
+        if command == DO and option == COMPRESS2 and self.compression and self._compressor is None:
+            # The session thread is waiting for input, so nothing else is being sent right now
+            self.writer.write(bytes([IAC, SB, COMPRESS2, IAC, SE]))
+            self.stats.bytes_out += 5
+            self._compressor = zlib.compressobj(9)
+            self.stats.compressed = True
+
+    def _subnegotiated(self, payload):
+        """Handle a telnet subnegotiation, currently only the window size."""
+        if len(payload) == 5 and payload[0] == NAWS:
+            self.pipeline.resize(int.from_bytes(payload[1:3], 'big'), int.from_bytes(payload[3:5], 'big'))
+
+
+class BBSServer:
+    """Asyncio TCP front end running each caller's menus as a separate session."""
+
+    def __init__(self, host, port, max_sessions=MAX_SESSIONS, compression=True):
+        self.host = host
+        self.port = port
+        self.max_sessions = max_sessions
+        self.compression = compression
+        self.executor = ThreadPoolExecutor(max_workers=max_sessions, thread_name_prefix='bbs-session')
+        self.sessions = {}  # session id -> SessionStats for connected callers
+        self.finished = deque(maxlen=1000)  # Summaries of recently closed sessions
+        self._ids = itertools.count(1)
+
+    async def handle_client(self, reader, writer):
+        peer = writer.get_extra_info('peername')
+        if len(self.sessions) >= self.max_sessions:
+            writer.write(b"The BBS is full, please call back later.\r\n")
+            await writer.drain()
+            writer.close()
+            return
+
+        session_id = next(self._ids)
+        stats = SessionStats(session_id, peer)
+        self.sessions[session_id] = stats
+        io = TelnetSessionIO(asyncio.get_running_loop(), reader, writer, stats, self.compression)
+        try:
+            # The menu code is blocking, so it runs on a worker thread
+            await asyncio.get_running_loop().run_in_executor(self.executor, self.run_session, io)
+        finally:
+            del self.sessions[session_id]
+            summary = stats.summary()
+            self.finished.append(summary)
+            print(f"Session {session_id} from {peer} closed: {summary}")
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    def run_session(self, io):
+        """Run the BBS menus for one caller (executed on a worker thread)."""
+        from bbs_main import run_bbs_session
+
+        bbs_io.set_session_io(io)
+        try:
+            io.negotiate()
+            bbs_io.print("Welcome to the RPG TERMINAL BBS")
+            run_bbs_session()
+            bbs_io.print("Goodbye!")
+            io.flush()
+        except EOFError:
+            pass  # The caller hung up or went idle
+        except Exception as e:
+            print(f"Session {io.stats.session_id} crashed: {e!r}")
+
+    def latency_report(self):
+        """Return latency summaries for the connected and recently closed sessions."""
+        return [stats.summary() for stats in list(self.sessions.values())] + list(self.finished)
+
+    async def serve_forever(self):
+        server = await asyncio.start_server(self.handle_client, self.host, self.port)
+        addresses = ', '.join(str(sock.getsockname()) for sock in server.sockets)
+        print(f"BBS listening on {addresses} (up to {self.max_sessions} callers)")
+        async with server:
+            await server.serve_forever()
+
+
+def serve(host='0.0.0.0', port=2323, max_sessions=MAX_SESSIONS, compression=True):
+    """Run the multi-user telnet/TCP server until interrupted."""
+    server = BBSServer(host, port, max_sessions, compression)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        print("Shutting down.")
+    finally:
+        for summary in server.latency_report():
+            print(summary)
+        server.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,121 @@
+import threading
+import time
+
+from bbs_data_access import bbs_connection
+from bbs_io import get_session_io
+
+ACCESS_TTL = 30 * 60  # Seconds an entered access password stays valid for a session
+
+
+class Session:
+    """A logged-in caller: who they are and what they're allowed to do.
+
+    Created by bbs_auth.login() and handed to every menu, so permission
+    checks are attribute reads instead of a users query each time.
+    """
+
+    def __init__(self, user_id, username, role):
+        self.user_id = user_id
+        self.username = username
+        self.role = role
+        self.access_token = None  # (access password version, expiry) once the access password was entered
+        self.io = get_session_io()  # Where the caller is connected, for notifications from other threads
+
+    @property
+    def is_gm(self):
+        return self.role == 'gm'
+
+    @property
+    def access_validated(self):
+        """Whether the session may use restricted sections without being asked for the access password."""
+        return self.has_access(get_access_password()[1])
+
+    def has_access(self, version):
+        """Check the access token against the current access password version. GMs never need one."""
+        if self.is_gm:
+            return True
+        if self.access_token is None:
+            return False
+        token_version, expires = self.access_token
+        return token_version == version and time.monotonic() < expires
+
+    def grant_access(self, version):
+        """Remember that the access password (this version of it) was entered, for ACCESS_TTL seconds."""
+        self.access_token = (version, time.monotonic() + ACCESS_TTL)
+
+    def notify(self, text):
+        """Show the caller a one-line notice, e.g. about new mail. Safe to call from any thread."""
+        if hasattr(self.io, 'notify'):
+            self.io.notify(text)
+
+    def __repr__(self):
+        return f"Session(user_id={self.user_id}, username={self.username!r}, role={self.role!r})"
+
+
+# Sessions currently logged in, by user id (one user may be connected more than once)
+_live_sessions = {}
+_live_lock = threading.Lock()
+
+
+def start_session(user_id, username, role):
+    """Create the Session for a successful login and register it as live."""
+    session = Session(user_id, username, role)
+    with _live_lock:
+        _live_sessions.setdefault(user_id, set()).add(session)
+    return session
+
+def end_session(session):
+    """Forget a session when its caller logs out or disconnects."""
+    with _live_lock:
+        sessions = _live_sessions.get(session.user_id)
+        if sessions is not None:
+            sessions.discard(session)
+            if not sessions:
+                del _live_sessions[session.user_id]
+
+def live_sessions(user_id):
+    """The live sessions of one user."""
+    with _live_lock:
+        return list(_live_sessions.get(user_id, ()))
+
+def role_changed(user_id, role):
+    """Bring every live session of a user up to date after their role changed in the database.
+
+    This is the one place role changes reach logged-in callers; anything that
+    caches permissions on a Session must be reset here.
+    """
+    for session in live_sessions(user_id):
+        session.role = role
+        session.access_token = None
+
+
+# The access password's hash, cached in memory. The version goes up whenever the GM sets a new
+# password, which expires every access token granted for the old one.
+_access_password = {'loaded': False, 'hash': None, 'version': 0}
+_access_password_lock = threading.Lock()
+
+
+def get_access_password():
+    """Return (stored hash or None, version) of the access password, reading system_settings only once."""
+    with _access_password_lock:
+        if not _access_password['loaded']:
+            with bbs_connection() as conn:
+                row = conn.execute('SELECT password FROM system_settings WHERE setting = "access_password"').fetchone()
+            _access_password['hash'] = row[0] if row else None
+            _access_password['loaded'] = True
+        return _access_password['hash'], _access_password['version']
+
+def store_access_password(hashed, new_password=True):
+    """Save the access password's hash to the database and the cache.
+
+    A new password bumps the version, so every session has to enter it
+    again; rehashing the same password with a newer cost doesn't.
+    """
+    with bbs_connection() as conn:
+        conn.execute('INSERT INTO system_settings (setting, password) VALUES ("access_password", ?) '
+                     'ON CONFLICT(setting) DO UPDATE SET password = excluded.password', (hashed,))
+    with _access_password_lock:
+        _access_password['hash'] = hashed
+        _access_password['loaded'] = True
+        if new_password:
+            _access_password['version'] += 1
@@ -1,8 +1,19 @@
+import os
 import sqlite3
+from bbs_data_access import characters_connection
+from bbs_io import input, print
+from bbs_pagination import ListPager
+from character_schema import SchemaChangeError, add_field, get_schema, remove_field
+from character_search import FUZZY, PREFIX, SUBSTRING, character_pager, find_by_name, search_characters
+from character_sheet import character_sheet, load_character, sheet_render_cache
+from character_skills import DND_SKILLS, delete_skills, parse_skill, set_skills
+from character_transfer import TransferError, export_characters, import_characters
 
 # Pagination constants
 PAGE_SIZE = 5  # Number of characters/NPCs to display per page
 
+IMPORT_ERRORS_SHOWN = 20  # Skipped rows listed after an import
+
 # Helper function to get numeric input with validation
 def get_numeric_input(field_name):
     """Prompt for and validate numeric input."""
@@ -43,26 +54,13 @@ def get_role_input():
 # Function to get skills with values from the user
 def get_skills_with_values():
     """Prompt for D&D 3.5 skills and their corresponding values."""
-    dnd_skills = [
-        "Appraise", "Balance", "Bluff", "Climb", "Concentration", "Craft", 
-        "Decipher Script", "Diplomacy", "Disable Device", "Disguise", 
-        "Escape Artist", "Forgery", "Gather Information", "Handle Animal", 
-        "Heal", "Hide", "Intimidate", "Jump", "Knowledge (Arcana)", 
-        "Knowledge (Dungeoneering)", "Knowledge (Geography)", "Knowledge (History)", 
-        "Knowledge (Local)", "Knowledge (Nature)", "Knowledge (Nobility and Royalty)", 
-        "Knowledge (Religion)", "Listen", "Move Silently", "Open Lock", "Perform", 
-        "Profession", "Ride", "Search", "Sense Motive", "Sleight of Hand", 
-        "Speak Language", "Spellcraft", "Spot", "Survival", "Swim", "Tumble", 
-        "Use Magic Device", "Use Rope"
-    ]
-    
     print("\nEnter the skill values for the following D&D 3.5 skills:")
     
     # Create a dictionary to store skill names and their values
     skill_values = {}
     
     # Loop through the skills and prompt the user for a value for each one
-    for skill in dnd_skills:
+    for skill in DND_SKILLS:
         while True:
             try:
                 value = int(input(f"{skill}: "))  # Prompt for the skill value
@@ -71,268 +69,148 @@ def get_skills_with_values():
             except ValueError:
                 print("Please enter a valid number for the skill value.")
     
-    # Return the skill values as a formatted string, e.g., "Tumble 12, Use Rope 1"
-    return ', '.join(f"{skill} {value}" for skill, value in skill_values.items())
-
-# Helper function to check if the user is a GM
-def is_gm(user_id):
-    """Check if the user is a GM based on their user_id."""
-    conn = sqlite3.connect('bbs.db')  # Assuming GM info is stored in the 'bbs.db' database
-    c = conn.cursor()
-    c.execute("SELECT role FROM users WHERE id = ?", (user_id,))
-    role = c.fetchone()
-    conn.close()
-
-    # Assuming 'gm' is the role for a GM user
-    return role is not None and role[0] == 'gm'
+    # Stored one row per skill in character_skills
+    return skill_values
 
 # Function to create the character and NPC table
 def create_character_npc_table():
     """Create a table for characters and NPCs with additional fields for D&D style game, including skills, hit dice, and saving throws."""
-    conn = sqlite3.connect('characters_npcs.db')  # Separate database
-    c = conn.cursor()
-    
-    c.execute('''
-    CREATE TABLE IF NOT EXISTS characters ( 
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT NOT NULL,
-        role BOOLEAN NOT NULL,  -- 1 for NPC, 0 for character
-        race TEXT NOT NULL,
-        class TEXT NOT NULL,
-        level INTEGER NOT NULL DEFAULT 1,
-        health INTEGER NOT NULL,
-        strength INTEGER NOT NULL,
-        intelligence INTEGER NOT NULL,
-        armor_class INTEGER NOT NULL,
-        hit_dice TEXT NOT NULL,
-        fortitude INTEGER NOT NULL,
-        reflex INTEGER NOT NULL,
-        will INTEGER NOT NULL,
-        abilities TEXT,
-        skills TEXT,  -- New column for skills
-        non_consumable_inventory TEXT,
-        consumable_inventory TEXT,
-        spells_known TEXT
-    )
-    ''')
-
-    # Commit the changes and close the connection
-    conn.commit()
-    conn.close()
-    print("Character/NPC, was created in 'characters_npcs.db'.")
-
-import sqlite3
-
-# Function to view all characters/NPCs for GM or only characters for regular users
-def view_character_npc_details(user_id):
-    """View all characters/NPCs for GM or only characters for regular users with pagination and search."""
-    
-    # Helper function for pagination
-    def paginate_list(items, page_size):
-        """Generator for paginating a list."""
-        for i in range(0, len(items), page_size):
-            yield items[i:i + page_size]
-	   
-    def display_character_sheet(character, column_names):
-        """Display a formatted character sheet for a selected character/NPC, grouped into sections with extra fields at the bottom."""
-        
-        print("\n--- Character Sheet ---")
-        
-        # Define the columns for each section
-        general_info = ['name', 'race', 'class', 'alignment', 'deity', 'level', 'experience_points']
-        attributes = ['strength', 'dexterity', 'constitution', 'intelligence', 'wisdom', 'charisma', 'armor_class', 'hit_points', 'initiative', 'speed']
-        saves = ['fortitude_save', 'reflex_save', 'will_save']
-        combat = ['base_attack_bonus', 'grapple']
-        inventory = ['weapons', 'armor', 'gear', 'gold']
-        feats_spells = ['feats', 'spells']
-        special_abilities = ['special_abilities']
-
-        # Track displayed columns
-        displayed_columns = set(general_info + attributes + saves + combat + inventory + feats_spells + special_abilities + ['skills'])
-
-        # Display general info
-        for col_name, value in zip(column_names, character):
-            if col_name in general_info:
-                display_name = col_name.replace('_', ' ').title()
-                print(f"{display_name}: {value}")
-
-        # Attributes section
-        print("\n--- Attributes ---")
-        for col_name, value in zip(column_names, character):
-            if col_name in attributes:
-                display_name = col_name.replace('_', ' ').title()
-                print(f"{display_name}: {value}")
-
-        # Saves section
-        print("\n--- Saves ---")
-        for col_name, value in zip(column_names, character):
-            if col_name in saves:
-                display_name = col_name.replace('_', ' ').title()
-                print(f"{display_name}: {value}")
-
-        # Combat section
-        print("\n--- Combat ---")
-        for col_name, value in zip(column_names, character):
-            if col_name in combat:
-                display_name = col_name.replace('_', ' ').title()
-                print(f"{display_name}: {value}")
-
-        # Skills section (displayed as an ASCII table)
-        skills_str = character[column_names.index('skills')]
-        if skills_str:
-            print("\n--- Skills ---")
-            print(f"{'Skill':<25} | {'Value':<5}")
-            print("-" * 32)
-            
-            skills_list = [skill.strip() for skill in skills_str.split(',')]
-            for skill in skills_list:
-                skill_name, skill_value = skill.rsplit(' ', 1)  # Split skill name and value
-                print(f"{skill_name:<25} | {skill_value:<5}")
-
-        # Inventory section
-        print("\n--- Inventory ---")
-        for col_name, value in zip(column_names, character):
-            if col_name in inventory:
-                display_name = col_name.replace('_', ' ').title()
-                print(f"{display_name}: {value}")
-
-        # Feats & Spells section
-        print("\n--- Feats & Spells ---")
-        for col_name, value in zip(column_names, character):
-            if col_name in feats_spells:
-                display_name = col_name.replace('_', ' ').title()
-                print(f"{display_name}: {value}")
-
-        # Special Abilities section
-        print("\n--- Special Abilities ---")
-        for col_name, value in zip(column_names, character):
-            if col_name in special_abilities:
-                display_name = col_name.replace('_', ' ').title()
-                print(f"{display_name}: {value}")
+    with characters_connection() as conn:  # Separate database
+        c = conn.cursor()
         
-        # Append any additional information that doesn't fit into these categories
-        print("\n--- Other Information ---")
-        for col_name, value in zip(column_names, character):
-            if col_name not in displayed_columns and value is not None and value != '':
-                display_name = col_name.replace('_', ' ').title()
-                print(f"{display_name}: {value}")
-
-        print("\n--- End of Character Sheet ---")
-        print("=" * 40)
-    
-    # Helper function to search characters/NPCs by name
-    def search_characters_by_name(search_term):
-        """Search characters/NPCs by name."""
-        if is_gm(user_id):
-            c.execute("SELECT * FROM characters WHERE name LIKE ?", ('%' + search_term + '%',))
-        else:
-            c.execute("SELECT * FROM characters WHERE role = 0 AND name LIKE ?", ('%' + search_term + '%',))
-        return c.fetchall()
-
-    # Helper function to check if the user is a GM
-    def is_gm(user_id):
-        """Check if the user is a GM based on their user_id."""
-        c.execute("SELECT role FROM users WHERE id = ?", (user_id,))
-        role = c.fetchone()
-        return role is not None and role[0] == 'gm'
-
-    # Constants
-    PAGE_SIZE = 5  # Number of characters/NPCs to display per page
-
-    # Connect to database
-    conn = sqlite3.connect('characters_npcs.db')
-    c = conn.cursor()
-
-    # Fetch all column names dynamically
-    c.execute("PRAGMA table_info(characters)")
-    columns_info = c.fetchall()
-    column_names = [col[1] for col in columns_info]  # Extract column names
-
-    # Fetch characters or NPCs depending on user role
-    if is_gm(user_id):
-        c.execute('SELECT * FROM characters')
-        characters = c.fetchall()
-        print("Displaying all characters and NPCs (GM view):")
-    else:
-        c.execute('SELECT * FROM characters WHERE role = 0')  # Only show characters
-        characters = c.fetchall()
-        print("Displaying all characters:")
+        c.execute('''
+        CREATE TABLE IF NOT EXISTS characters ( 
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            role BOOLEAN NOT NULL,  -- 1 for NPC, 0 for character
+            race TEXT NOT NULL,
+            class TEXT NOT NULL,
+            level INTEGER NOT NULL DEFAULT 1,
+            health INTEGER NOT NULL,
+            strength INTEGER NOT NULL,
+            intelligence INTEGER NOT NULL,
+            armor_class INTEGER NOT NULL,
+            hit_dice TEXT NOT NULL,
+            fortitude INTEGER NOT NULL,
+            reflex INTEGER NOT NULL,
+            will INTEGER NOT NULL,
+            abilities TEXT,
+            non_consumable_inventory TEXT,
+            consumable_inventory TEXT,
+            spells_known TEXT
+        )
+        ''')
+
+        # Commit the changes, the pool keeps the connection open
+        conn.commit()
+    print("Character/NPC, was created in 'characters_npcs.db'.")
 
-    # If no characters/NPCs are found
+# Function to ask for a name and look it up, or page through everyone when left blank
+def choose_characters(session, prompt="Enter a name to search or press Enter to list all: "):
+    """Return a pager over the CharacterSummary rows to show, or None if there are none.
+
+    Regular users only see characters. The full list is paged from the database with a
+    keyset pager, so browsing costs the same whatever the number or width of the sheets.
+    """
+    role = None if session.is_gm else 0  # Regular users only see characters
+    search_term = input(prompt).strip()
+    if not search_term:
+        pager = character_pager(role, PAGE_SIZE)
+        if not pager.total_rows:
+            return None
+        print("Displaying all characters and NPCs (GM view):" if session.is_gm else "Displaying all characters:")
+        return pager
+
+    characters, mode = find_by_name(search_term, role)
     if not characters:
-        print("No characters or NPCs found. You may want to add some using the 'Add Character/NPC' option.")
-        conn.close()
-        return
-
-    # Paginate and display results by name
-    pages = list(paginate_list(characters, PAGE_SIZE))
-    total_pages = len(pages)
-    page_num = 0
-
+        return None
+    if mode == FUZZY:
+        print(f"No names contain '{search_term}', showing similar names:")
+    return ListPager(characters, PAGE_SIZE)
+
+# Function to page through characters/NPCs until one is picked
+def pick_character(session, pager, prompt="Select a character by number"):
+    """Show the pager's pages, starting from its current one. Returns the CharacterSummary picked, or None on 'q'."""
+    page = pager.reload()
     while True:
         # Display current page
-        print(f"\n--- Page {page_num + 1} of {total_pages} ---")
-        current_page = pages[page_num]
+        print(f"\n--- Page {page.number + 1} of {page.total_pages} ---")
 
         # Numbered list of characters/NPCs by name on the current page
-        for idx, character in enumerate(current_page, start=1 + page_num * PAGE_SIZE):
-            print(f"{idx}. {character[2]}")  # Display name with index (name is in column 2)
+        for idx, character in page.numbered():
+            role_name = " (NPC)" if character.is_npc and session.is_gm else ""
+            print(f"{idx}. {character.name}{role_name}")
 
         # Prompt to select a character or navigate pages
-        action = input(f"\nSelect a character by number, or 'n' for next page, 'p' for previous page, 'q' to quit: ").strip().lower()
+        action = input(f"\n{prompt}, or 'n' for next page, 'p' for previous page, 'q' to quit: ").strip().lower()
 
         # Handle navigation or selection
         if action.isdigit():
-            char_index = int(action) - 1
-            if 0 <= char_index < len(characters):
-                selected_character = characters[char_index]
-                display_character_sheet(selected_character, column_names)  # Display the character sheet
-            else:
-                print("Invalid selection.")
-        elif action == 'n' and page_num < total_pages - 1:
-            page_num += 1
-        elif action == 'p' and page_num > 0:
-            page_num -= 1
+            character = page.pick(int(action))
+            if character:
+                return character
+            print("Invalid selection. Please pick a number shown on this page.")
+        elif action == 'n' and page.has_next:
+            page = pager.next()
+        elif action == 'p' and page.has_prev:
+            page = pager.prev()
         elif action == 'q':
-            break
+            return None
         else:
             print("Invalid input. Please try again.")
 
-    # Close the connection
-    conn.close()
+# Function to view all characters/NPCs for GM or only characters for regular users
+def view_character_npc_details(session, pager=None):
+    """View all characters/NPCs for GM or only characters for regular users with pagination and search.
+
+    pager, if given, pages through other CharacterSummary rows instead (e.g. search results).
+    """
+    # The list only holds summaries, the full sheet is loaded once one is picked
+    if pager is None:
+        pager = choose_characters(session)
+
+    # If no characters/NPCs are found
+    if pager is None:
+        print("No characters or NPCs found. You may want to add some using the 'Add Character/NPC' option.")
+        return
+
+    while True:
+        selected = pick_character(session, pager)
+        if selected is None:
+            break
+        sheet = character_sheet(selected.id)  # Rendered once, then from the sheet cache until it changes
+        if sheet is None:
+            print("Character/NPC not found.")
+        else:
+            print(sheet, end='')  # Display the character sheet
 
 #Function to add Characters and NPCs
 def add_character():
-    conn = sqlite3.connect('characters_npcs.db')
-    c = conn.cursor()
-
-    # Retrieve the column names and types from the 'characters' table, starting from column 2
-    c.execute("PRAGMA table_info(characters)")
-    columns_info = c.fetchall()[2:]  # Skip the 'id' column
+    # Retrieve the column names and types of the 'characters' table from the schema cache
+    schema = get_schema()
 
     # Initialize a dictionary to hold column names and user input values
     user_input = {}
 
-    # Loop through each column starting from the second and prompt the user for input
-    for column in columns_info:
-        column_name = column[1]  # Column name is at index 1
-        column_type = column[2]  # Column type is at index 2
+    # Loop through each column and prompt the user for input
+    for column_name in schema.columns:
+        # Skip the id, the owner link, and the old skills text field (skills now have their own table)
+        if column_name in ('id', 'user_id', 'skills'):
+            continue
+        user_input[column_name] = get_input_for_column(column_name, schema.types[column_name])
 
-        if column_name == 'skills':  # Special case for skills input
-            user_input[column_name] = get_skills_with_values()
-        else:
-            user_input[column_name] = get_input_for_column(column_name, column_type)
+    # Skills are asked for last and stored in character_skills
+    skills = get_skills_with_values()
 
     # Prepare SQL placeholders for the insert query
     columns_string = ', '.join(user_input.keys())
     placeholders = ', '.join(['?' for _ in user_input])
 
-    # Insert the new character/NPC data into the database
+    # Insert the new character/NPC and its skills in one transaction
     query = f"INSERT INTO characters ({columns_string}) VALUES ({placeholders})"
-    c.execute(query, list(user_input.values()))
-
-    conn.commit()
-    conn.close()
+    with characters_connection() as conn:
+        cursor = conn.execute(query, list(user_input.values()))
+        set_skills(conn, cursor.lastrowid, skills)
 
     print(f"Character/NPC '{user_input.get('name', 'Unknown')}' added successfully.")
 
@@ -353,261 +231,155 @@ def get_input_for_column(column_name, column_type):
 # Function to edit characters or NPCs dynamically based on table fields
 
 # Function to edit an existing character or NPC with pagination and search
-def edit_character_npc(user_id):
+def edit_character_npc(session):
     """Edit an existing character or NPC with quick field search and option to modify all fields."""
     
-    # Helper function for pagination
-    def paginate_list(items, page_size):
-        """Generator for paginating a list."""
-        for i in range(0, len(items), page_size):
-            yield items[i:i + page_size]
-
-    # Helper function to search characters/NPCs by name
-    def search_characters_by_name(search_term):
-        """Search characters/NPCs by name."""
-        if is_gm(user_id):
-            c.execute("SELECT * FROM characters WHERE name LIKE ?", ('%' + search_term + '%',))
-        else:
-            c.execute("SELECT * FROM characters WHERE role = 0 AND name LIKE ?", ('%' + search_term + '%',))
-        return c.fetchall()
-
     # Helper function to get input for a specific field
     def get_input_for_column(column_name, current_value):
         """Prompt user for input based on column type, allowing them to keep the current value."""
         new_value = input(f"Enter new value for {column_name.replace('_', ' ').title()} (leave blank to keep '{current_value}'): ").strip()
         return new_value if new_value else current_value
 
-    # Helper function to check if the user is a GM
-    def is_gm(user_id):
-        """Check if the user is a GM based on their user_id."""
-        conn = sqlite3.connect('bbs.db')  # Use the correct database here
-        c = conn.cursor()
-        c.execute("SELECT role FROM users WHERE id = ?", (user_id,))
-        role = c.fetchone()
-        conn.close()
-        
-        return role is not None and role[0] == 'gm'
-
-    # Constants
-    PAGE_SIZE = 5  # Number of characters/NPCs to display per page
-
-    # Connect to the database
-    conn = sqlite3.connect('characters_npcs.db')
-    c = conn.cursor()
-
-    # Fetch all column names dynamically
-    c.execute("PRAGMA table_info(characters)")
-    columns_info = c.fetchall()
-    column_names = [col[1] for col in columns_info]  # Extract column names
+    # Helper function to change skill values
+    def get_skill_changes():
+        """Prompt for 'Skill value' pairs until a blank line. Returns {skill: new value}."""
+        changes = {}
+        while True:
+            entry = input("Enter a skill and its new value (e.g. 'Spot 12'), or press Enter to finish: ").strip()
+            if not entry:
+                return changes
+            parsed = parse_skill(entry)
+            if parsed:
+                changes[parsed[0]] = parsed[1]
+            else:
+                print("Please enter the skill name followed by a number.")
 
-    # Fetch characters or NPCs depending on user role
-    if is_gm(user_id):
-        c.execute('SELECT * FROM characters')
-        characters = c.fetchall()
-        print("Displaying all characters and NPCs (GM view):")
-    else:
-        c.execute('SELECT * FROM characters WHERE role = 0')  # Only show characters
-        characters = c.fetchall()
-        print("Displaying all characters:")
+    column_names = get_schema().columns  # From the schema cache
 
-    # If no characters/NPCs are found
-    if not characters:
+    # Search option, the list only holds summaries
+    characters = choose_characters(session, "Enter a name to search or press Enter to skip: ")
+    if characters is None:
         print("No characters or NPCs found.")
-        conn.close()
         return
 
-    # Search option
-    search_term = input("Enter a name to search or press Enter to skip: ").strip()
-    if search_term:
-        characters = search_characters_by_name(search_term)
-        if not characters:
-            print(f"No characters found with the name '{search_term}'.")
-            conn.close()
-            return
-
-    # Paginate and display results
-    pages = list(paginate_list(characters, PAGE_SIZE))
-    total_pages = len(pages)
-    page_num = 0
+    selected = pick_character(session, characters)
+    if selected is None:
+        return
 
-    while True:
-        # Display current page
-        print(f"\n--- Page {page_num + 1} of {total_pages} ---")
-        current_page = pages[page_num]
+    # Fetch the selected character and its skills
+    character, skills = load_character(selected.id)
 
-        # Numbered list of characters/NPCs on the current page
-        for idx, character in enumerate(current_page, start=1 + page_num * PAGE_SIZE):
-            print(f"{idx}. {character[1]}")  # Display name with index
+    if not character:
+        print("Character/NPC not found.")
+        return
 
-        # Prompt to select a character or navigate pages
-        action = input(f"\nSelect a character by number, 'n' for next page, 'p' for previous page, 'q' to quit: ").strip().lower()
+    # Initialize a dictionary to hold column names and updated values
+    updated_values = {col: character[i] for i, col in enumerate(column_names) if col != 'id'}
+    skill_values = dict(skills)
+    changed_skills = {}
 
-        # Handle navigation or selection
-        if action.isdigit():
-            char_index = int(action) - 1
-            if 0 <= char_index < len(characters):
-                selected_character = characters[char_index]
-                
-                # Fetch the selected character
-                c.execute("SELECT * FROM characters WHERE id = ?", (selected_character[0],))  # Assuming ID is in the first column
-                character = c.fetchone()
-
-                if not character:
-                    print("Character/NPC not found.")
-                    conn.close()
-                    return
-
-                # Initialize a dictionary to hold column names and updated values
-                updated_values = {col: character[i] for i, col in enumerate(column_names) if col != 'id'}
-
-                # Main loop for editing fields
-                while True:
-                    # Display current values
-                    print("\n--- Current Character Information ---")
-                    for col_name, value in updated_values.items():
-                        display_name = col_name.replace('_', ' ').title()
-                        print(f"{display_name}: {value}")
-
-                    # Ask the user if they want to search for a specific field or run through all fields
-                    edit_mode = input("\nDo you want to (1) search a specific field or (2) run through all fields? (1/2): ").strip()
-
-                    if edit_mode == '1':  # Search and modify a specific field
-                        field_to_modify = input("Enter the field name to modify: ").strip().lower()
-                        
-                        if field_to_modify in updated_values:
-                            updated_values[field_to_modify] = get_input_for_column(field_to_modify, updated_values[field_to_modify])
-
-                            # Ask if the user wants to continue editing or save and exit
-                            continue_editing = input("\nDo you want to modify another field? (y/n): ").strip().lower()
-                            if continue_editing == 'n':
-                                break
-                        else:
-                            print(f"Field '{field_to_modify}' does not exist. Please enter a valid field.")
-                    elif edit_mode == '2':  # Run through all fields
-                        for col_name in updated_values.keys():
-                            updated_values[col_name] = get_input_for_column(col_name, updated_values[col_name])
-                        
-                        # Ask if the user wants to continue editing or save and exit
-                        continue_editing = input("\nDo you want to modify another field? (y/n): ").strip().lower()
-                        if continue_editing == 'n':
-                            break
-                    else:
-                        print("Invalid option. Please enter '1' or '2'.")
-                        continue
-
-                # Prepare the query to update the character
-                set_clause = ', '.join(f"{col} = ?" for col in updated_values.keys())
-                query = f"UPDATE characters SET {set_clause} WHERE id = ?"
-
-                # Execute the update query with the updated values
-                c.execute(query, list(updated_values.values()) + [character[0]])
-
-                conn.commit()
-                print(f"Character/NPC '{updated_values.get('name', 'Unknown')}' updated successfully.")
-                break  # Exit the loop after successful update
+    # Main loop for editing fields
+    while True:
+        # Display current values
+        print("\n--- Current Character Information ---")
+        for col_name, value in updated_values.items():
+            display_name = col_name.replace('_', ' ').title()
+            print(f"{display_name}: {value}")
+        print("Skills: " + (', '.join(f"{skill} {value}" for skill, value in sorted(skill_values.items())) or 'None'))
+
+        # Ask the user if they want to search for a specific field or run through all fields
+        edit_mode = input("\nDo you want to (1) search a specific field or (2) run through all fields? (1/2): ").strip()
+
+        if edit_mode == '1':  # Search and modify a specific field
+            field_to_modify = input("Enter the field name to modify (or 'skills'): ").strip().lower()
+
+            if field_to_modify == 'skills':
+                changes = get_skill_changes()
+                skill_values.update(changes)
+                changed_skills.update(changes)
+
+                continue_editing = input("\nDo you want to modify another field? (y/n): ").strip().lower()
+                if continue_editing == 'n':
+                    break
+            elif field_to_modify in updated_values:
+                updated_values[field_to_modify] = get_input_for_column(field_to_modify, updated_values[field_to_modify])
+
+                # Ask if the user wants to continue editing or save and exit
+                continue_editing = input("\nDo you want to modify another field? (y/n): ").strip().lower()
+                if continue_editing == 'n':
+                    break
             else:
-                print("Invalid selection.")
-        elif action == 'n' and page_num < total_pages - 1:
-            page_num += 1
-        elif action == 'p' and page_num > 0:
-            page_num -= 1
-        elif action == 'q':
-            break
+                print(f"Field '{field_to_modify}' does not exist. Please enter a valid field.")
+        elif edit_mode == '2':  # Run through all fields
+            for col_name in updated_values.keys():
+                updated_values[col_name] = get_input_for_column(col_name, updated_values[col_name])
+
+            # Ask if the user wants to continue editing or save and exit
+            continue_editing = input("\nDo you want to modify another field? (y/n): ").strip().lower()
+            if continue_editing == 'n':
+                break
         else:
-            print("Invalid input. Please try again.")
+            print("Invalid option. Please enter '1' or '2'.")
+            continue
 
-    conn.close()
+    # Prepare the query to update the character
+    set_clause = ', '.join(f"{col} = ?" for col in updated_values.keys())
+    query = f"UPDATE characters SET {set_clause} WHERE id = ?"
 
-import sqlite3
+    # Execute the update query with the updated values, and store changed skills with it
+    with characters_connection() as conn:
+        conn.execute(query, list(updated_values.values()) + [character[0]])
+        set_skills(conn, character[0], changed_skills)
 
-import sqlite3
+    print(f"Character/NPC '{updated_values.get('name', 'Unknown')}' updated successfully.")
 
-def delete_character_npc(user_id):
+def delete_character_npc(session):
     """Delete a character or NPC from the system, with restrictions based on user role."""
+    gm_view = session.is_gm
 
-    # Check if the user is a GM
-    def is_gm(user_id):
-        conn = sqlite3.connect('bbs.db')
-        c = conn.cursor()
-        c.execute("SELECT role FROM users WHERE id = ?", (user_id,))
-        role = c.fetchone()
-        conn.close()
-        return role is not None and role[0] == 'gm'
-
-    # Connect to the characters database
-    conn = sqlite3.connect('characters_npcs.db')
-    c = conn.cursor()
-
-    # Fetch characters based on user role
-    if is_gm(user_id):
-        c.execute('SELECT id, name, role FROM characters')
-    else:
-        c.execute('SELECT id, name, role FROM characters WHERE role = 0')  # Non-GMs can only delete characters, not NPCs
-    characters = c.fetchall()
+    # Page through characters based on user role, non-GMs can only delete characters, not NPCs
+    characters = character_pager(None if gm_view else 0, PAGE_SIZE)
 
-    if not characters:
+    if not characters.total_rows:
         print("No characters or NPCs found to delete.")
-        conn.close()
         return
 
-    # Display the list of characters/NPCs
-    print("\n--- Character/NPC List ---")
-    for idx, character in enumerate(characters, start=1):
-        char_id, char_name, char_role = character
-        role_name = "NPC" if char_role == 1 else "Character"
-        print(f"{idx}. {char_name} ({role_name})")
-
     # Deletion by selecting number from the list
-    while True:
-        try:
-            selection = input("\nSelect a character by number to delete, or 'q' to quit: ").strip().lower()
-            if selection == 'q':
-                print("Deletion canceled.")
-                conn.close()
-                return
-            selection = int(selection)
-            if 1 <= selection <= len(characters):
-                selected_character = characters[selection - 1]  # Get the selected character
-                char_id, char_name, char_role = selected_character
-                break
-            else:
-                print(f"Please select a valid number between 1 and {len(characters)}.")
-        except ValueError:
-            print("Invalid input. Please enter a valid number.")
+    print("\n--- Character/NPC List ---")
+    selected = pick_character(session, characters, "Select a character by number to delete")
+    if selected is None:
+        print("Deletion canceled.")
+        return
+    char_id, char_name = selected.id, selected.name
 
     # Fetch creator information for the selected character
-    c.execute("SELECT role, user_id FROM characters WHERE id = ?", (char_id,))
-    char_role, creator_id = c.fetchone()
+    with characters_connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT role, user_id FROM characters WHERE id = ?", (char_id,))
+        char_role, creator_id = c.fetchone()
 
     # Ensure that only GMs can delete NPCs and users can delete their own characters
-    if char_role == 1 and not is_gm(user_id):
+    if char_role == 1 and not gm_view:
         print("Only GMs can delete NPCs.")
-    elif char_role == 0 and user_id != creator_id:
+    elif char_role == 0 and session.user_id != creator_id:
         print("You can only delete your own characters.")
     else:
         # Confirm and delete
         confirm = input(f"Are you sure you want to delete '{char_name}'? (y/n): ").strip().lower()
         if confirm == 'y':
-            c.execute("DELETE FROM characters WHERE id = ?", (char_id,))
-            conn.commit()
+            with characters_connection() as conn:
+                conn.execute("DELETE FROM characters WHERE id = ?", (char_id,))
+                delete_skills(conn, char_id)
+            sheet_render_cache.invalidate(char_id)
             print(f"Character/NPC '{char_name}' deleted successfully.")
         else:
             print("Deletion canceled.")
 
-    conn.close()
 # Function to add or remove fields dynamically
-def modify_fields(user_id):
+def modify_fields(session):
     """Add or remove fields in the character table."""
-    conn = sqlite3.connect('characters_npcs.db')
-    c = conn.cursor()
-
     # Check if the user is GM
-    gm_status = is_gm(user_id)
-
-    # Fetch current columns from 'characters' table
-    def get_existing_columns():
-        c.execute("PRAGMA table_info(characters)")
-        return [col[1] for col in c.fetchall()]
+    gm_status = session.is_gm
 
     while True:
         print("\n--- Modify Fields ---")
@@ -622,29 +394,14 @@ def modify_fields(user_id):
                 print("Only the GM can add fields.")
                 continue
 
-            # Add a new field
+            # Add a new field, ALTER TABLE ADD COLUMN doesn't touch the existing rows
             field_name = input("Enter the name of the new field: ").strip()
             field_type = input("Enter the type of the field (TEXT, INTEGER, BOOLEAN, REAL): ").upper().strip()
 
-            if not field_name or ' ' in field_name:
-                print("Invalid field name. Field name cannot be empty or contain spaces.")
-                continue
-
-            existing_columns = get_existing_columns()
-
-            if field_name in existing_columns:
-                print(f"Field '{field_name}' already exists.")
-                continue
-
-            if field_type not in ('TEXT', 'INTEGER', 'BOOLEAN', 'REAL'):
-                print(f"Invalid field type: {field_type}. Must be TEXT, INTEGER, BOOLEAN, or REAL.")
-                continue
-
             try:
-                c.execute(f"ALTER TABLE characters ADD COLUMN {field_name} {field_type}")
-                conn.commit()
+                add_field(field_name, field_type)
                 print(f"Field '{field_name}' added successfully.")
-            except sqlite3.OperationalError as e:
+            except SchemaChangeError as e:
                 print(f"Error adding field: {e}")
         elif choice == '2':
             if not gm_status:
@@ -654,9 +411,7 @@ def modify_fields(user_id):
             # Remove an existing field
             field_name = input("Enter the name of the field to remove: ").strip()
 
-            existing_columns = get_existing_columns()
-
-            if field_name not in existing_columns:
+            if field_name not in get_schema():  # Current columns, re-read once the table changes
                 print(f"Field '{field_name}' does not exist.")
                 continue
 
@@ -666,23 +421,127 @@ def modify_fields(user_id):
                 continue
 
             try:
-                columns_to_keep = [col for col in existing_columns if col != field_name]
-                c.execute(f"CREATE TABLE characters_new AS SELECT {', '.join(columns_to_keep)} FROM characters")
-                c.execute("DROP TABLE characters")
-                c.execute("ALTER TABLE characters_new RENAME TO characters")
-                conn.commit()
+                remove_field(field_name)
                 print(f"Field '{field_name}' removed successfully.")
-            except sqlite3.OperationalError as e:
+            except SchemaChangeError as e:
                 print(f"Error removing field: {e}")
         elif choice == '3':
             break
         else:
             print("Invalid choice. Please try again.")
 
-    conn.close()
+# Helper function to read a level or level range such as '5' or '3-8'
+def parse_level_range(text):
+    """Return (min level, max level), either may be None. Returns None if the text isn't a level or range."""
+    text = text.replace(' ', '')
+    if not text:
+        return None, None
+    low, dash, high = text.partition('-')
+    if not dash:
+        return (int(low), int(low)) if low.isdigit() else None
+    if not (low or high) or (low and not low.isdigit()) or (high and not high.isdigit()):
+        return None
+    return (int(low) if low else None), (int(high) if high else None)
+
+# Function to search characters/NPCs by name, class, race, level and skill
+def search_characters_menu(session):
+    """Find characters/NPCs by any mix of name, class, race, level range and a minimum skill value."""
+    print("\n--- Search Characters/NPCs ---")
+    print("Leave a question blank to skip it.")
+    name = input("Name (names starting with it; put '*' first to match anywhere, '~' for similar names): ").strip()
+    mode = PREFIX
+    if name[:1] == '*':
+        mode, name = SUBSTRING, name[1:]
+    elif name[:1] == '~':
+        mode, name = FUZZY, name[1:]
+    # Only ask about the fields the sheet still has
+    schema = get_schema()
+    character_class = input("Class: ").strip() if 'class' in schema else ''
+    race = input("Race: ").strip() if 'race' in schema else ''
+    levels = (None, None)
+    while 'level' in schema:
+        levels = parse_level_range(input("Level or level range (e.g. 5 or 3-8): "))
+        if levels is not None:
+            break
+        print("Please enter a level such as 5 or a range such as 3-8.")
+    while True:
+        entry = input("Skill and minimum value (e.g. 'Spot 10'): ").strip()
+        skill = parse_skill(entry) if entry else (None, None)
+        if skill:
+            break
+        print("Please enter the skill name followed by a number.")
+
+    role = 0  # Regular users only see characters
+    if session.is_gm:
+        role = {'c': 0, 'n': 1}.get(input("Show only (c)haracters or (n)PCs, or press Enter for both: ").strip().lower())
+
+    try:
+        characters = search_characters(name, mode, role, character_class, race, *levels, *skill)
+    except sqlite3.OperationalError as e:
+        print(f"Search failed: {e}")
+        return
+    if not characters:
+        print("No characters or NPCs match your search.")
+        return
+    print(f"Found {len(characters)} match(es).")
+    view_character_npc_details(session, ListPager(characters, PAGE_SIZE))
+
+# Function to import characters/NPCs from a file (GM only)
+def import_characters_menu(session):
+    """Bulk import characters/NPCs from a CSV or JSON Lines file and report the rows that were skipped."""
+    if not session.is_gm:
+        print("Only the GM can import characters and NPCs.")
+        return
+
+    print("Each row is one character/NPC. Fields are matched by name, and 'skills' holds values like 'Spot 12, Hide 3'.")
+    path = input("Enter the file to import (.csv or .jsonl), or press Enter to cancel: ").strip()
+    if not path:
+        return
+
+    try:
+        result = import_characters(path)
+    except (OSError, TransferError) as e:
+        print(f"Error importing: {e}")
+        return
+
+    print(f"Imported {result.imported} characters/NPCs.")
+    if result.errors:
+        print(f"{len(result.errors)} problem(s) found, those rows were skipped:")
+        for line_no, message in result.errors[:IMPORT_ERRORS_SHOWN]:
+            print(f"  Line {line_no}: {message}")
+        if len(result.errors) > IMPORT_ERRORS_SHOWN:
+            print(f"  ... and {len(result.errors) - IMPORT_ERRORS_SHOWN} more.")
+
+# Function to export characters/NPCs to a file (GM only)
+def export_characters_menu(session):
+    """Export characters/NPCs, with their skills, to a CSV or JSON Lines file."""
+    if not session.is_gm:
+        print("Only the GM can export characters and NPCs.")
+        return
+
+    roles = {'1': None, '2': 1, '3': 0}
+    choice = input("Export (1) everyone, (2) NPCs only or (3) characters only? (1/2/3): ").strip()
+    if choice not in roles:
+        print("Invalid choice.")
+        return
+    path = input("Enter the file to export to (.csv or .jsonl), or press Enter to cancel: ").strip()
+    if not path:
+        return
+    if os.path.exists(path):
+        confirm = input(f"'{path}' already exists. Overwrite it? (y/n): ").strip().lower()
+        if confirm != 'y':
+            print("Export canceled.")
+            return
+
+    try:
+        count = export_characters(path, roles[choice])
+    except (OSError, TransferError) as e:
+        print(f"Error exporting: {e}")
+        return
+    print(f"Exported {count} characters/NPCs to '{path}'.")
 
 # Character/NPC main menu
-def character_npc_menu(user_id):
+def character_npc_menu(session):
     while True:
         print("\n--- Character/NPC Management ---")
         print("1. Add Character/NPC")
@@ -690,21 +549,30 @@ def character_npc_menu(user_id):
         print("3. Edit Character/NPC")
         print("4. Delete Character/NPC")
         print("5. Modify Fields")
-        print("6. Back to Main Menu")
+        print("6. Search Characters/NPCs")
+        print("7. Import Characters/NPCs (GM only)")
+        print("8. Export Characters/NPCs (GM only)")
+        print("9. Back to Main Menu")
         
         choice = input("Enter your choice: ")
         
         if choice == "1":
             add_character()
         elif choice == "2":
-            view_character_npc_details(user_id)  # Modified to view characters/NPCs based on user role
+            view_character_npc_details(session)  # Shows characters/NPCs based on the session's role
         elif choice == "3":
-            edit_character_npc(user_id)
+            edit_character_npc(session)
         elif choice == "4":
-            delete_character_npc(user_id)
+            delete_character_npc(session)
         elif choice == "5":
-            modify_fields(user_id)  # Pass user_id to modify_fields
+            modify_fields(session)
         elif choice == "6":
+            search_characters_menu(session)
+        elif choice == "7":
+            import_characters_menu(session)
+        elif choice == "8":
+            export_characters_menu(session)
+        elif choice == "9":
             break
         else:
             print("Invalid choice. Please try again.")
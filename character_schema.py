@@ -0,0 +1,380 @@
+import re
+import sqlite3
+import threading
+from bbs_data_access import characters_connection
+
+CHARACTERS_TABLE = 'characters'
+FIELD_TYPES = ('TEXT', 'INTEGER', 'BOOLEAN', 'REAL')
+PROTECTED_FIELDS = ('id', 'name', 'role')  # Lists, search and permission checks depend on these
+FIELD_NAME_PATTERN = re.compile(r'[A-Za-z_][A-Za-z0-9_]*$')
+DROP_COLUMN_VERSION = (3, 35, 0)  # First SQLite release with ALTER TABLE ... DROP COLUMN
+RENAME_COLUMN_VERSION = (3, 25, 0)  # First SQLite release with ALTER TABLE ... RENAME COLUMN
+BOOLEAN_VALUES = {'true': 1, '1': 1, 'yes': 1, 'false': 0, '0': 0, 'no': 0}  # Accepted spellings of BOOLEAN values
+
+# Sections of the character sheet in display order, as (heading, fields). The first section is
+# shown under the sheet title, fields None marks where the skills table goes, and any field not
+# listed here is shown under OTHER_SECTION.
+SHEET_SECTIONS = (
+    (None, ('name', 'race', 'class', 'alignment', 'deity', 'level', 'experience_points')),
+    ('Attributes', ('strength', 'dexterity', 'constitution', 'intelligence', 'wisdom', 'charisma',
+                    'armor_class', 'hit_points', 'initiative', 'speed')),
+    ('Saves', ('fortitude_save', 'reflex_save', 'will_save')),
+    ('Combat', ('base_attack_bonus', 'grapple')),
+    ('Skills', None),
+    ('Inventory', ('weapons', 'armor', 'gear', 'gold')),
+    ('Feats & Spells', ('feats', 'spells')),
+    ('Special Abilities', ('special_abilities',)),
+)
+OTHER_SECTION = 'Other Information'
+
+
+class SchemaChangeError(Exception):
+    """Raised when a field can't be added or removed. The message says why."""
+
+
+class TableSchema:
+    """Column metadata of a table, read once per database schema version.
+
+    columns lists the names in table order and index maps each one to its
+    position in a SELECT * row. types holds the declared types (upper case),
+    not_null the NOT NULL columns, defaults the columns that have a DEFAULT,
+    and labels the display names. sections
+    is SHEET_SECTIONS resolved against the columns that exist, as (heading,
+    [(label, row index), ...]), with the fields it doesn't list under
+    OTHER_SECTION.
+    """
+
+    def __init__(self, table, version, info):
+        self.table = table
+        self.version = version  # PRAGMA schema_version the metadata was read at
+        self.columns = [row[1] for row in info]
+        self.index = {name: i for i, name in enumerate(self.columns)}
+        self.types = {row[1]: (row[2] or '').upper() for row in info}
+        self.not_null = {row[1] for row in info if row[3]}
+        self.defaults = {row[1] for row in info if row[4] is not None}
+        self.labels = {name: name.replace('_', ' ').title() for name in self.columns}
+
+        listed = set()
+        self.sections = []
+        for heading, fields in SHEET_SECTIONS:
+            if fields is None:
+                self.sections.append((heading, None))
+                continue
+            listed.update(fields)
+            self.sections.append((heading, [(self.labels[name], self.index[name]) for name in fields
+                                            if name in self.index]))
+        self.sections.append((OTHER_SECTION, [(self.labels[name], self.index[name]) for name in self.columns
+                                              if name not in listed]))
+
+    def __contains__(self, column):
+        return column in self.index
+
+
+_schemas = {}
+_schemas_lock = threading.Lock()
+
+
+def get_schema(table=CHARACTERS_TABLE):
+    """Return the table's TableSchema, reading PRAGMA table_info again only after the schema changed.
+
+    SQLite bumps PRAGMA schema_version on every schema change (Modify Fields,
+    install.py, another process), so checking it is all a cache hit costs.
+    """
+    with characters_connection() as conn:
+        version = conn.execute('PRAGMA schema_version').fetchone()[0]
+        with _schemas_lock:
+            schema = _schemas.get(table)
+        if schema is not None and schema.version == version:
+            return schema
+        info = conn.execute(f'PRAGMA table_info({quote_name(table)})').fetchall()
+    schema = TableSchema(table, version, info)
+    with _schemas_lock:
+        _schemas[table] = schema
+    return schema
+
+def quote_name(name):
+    """Quote an identifier for use in SQL."""
+    return '"' + name.replace('"', '""') + '"'
+
+def field_names(conn, table=CHARACTERS_TABLE):
+    """The table's column names, in order."""
+    return [row[1] for row in conn.execute(f'PRAGMA table_info({quote_name(table)})')]
+
+def default_literal(field_type, value):
+    """Turn a default value typed by the GM into an SQL literal for the field type."""
+    try:
+        if field_type == 'BOOLEAN':
+            return str(BOOLEAN_VALUES[value.strip().lower()])
+        if field_type == 'INTEGER':
+            return str(int(value))
+        if field_type == 'REAL':
+            return repr(float(value))
+    except (KeyError, ValueError):
+        raise SchemaChangeError(f"'{value}' is not a valid default for a {field_type} field.") from None
+    return "'" + value.replace("'", "''") + "'"
+
+# Function to add a field to the characters table
+def add_field(field_name, field_type, not_null=False, default=None, table=CHARACTERS_TABLE):
+    """Add a column. SQLite only rewrites the schema for this, so it takes the same time on any size of table."""
+    field_type = field_type.strip().upper()
+    if not FIELD_NAME_PATTERN.match(field_name or ''):
+        raise SchemaChangeError("Field names must start with a letter or '_' and contain only letters, digits and '_'.")
+    if field_type not in FIELD_TYPES:
+        raise SchemaChangeError(f"Invalid field type: {field_type}. Must be {', '.join(FIELD_TYPES)}.")
+
+    definition = f'{quote_name(field_name)} {field_type}'
+    if not_null:
+        definition += ' NOT NULL'
+    if default not in (None, ''):
+        definition += ' DEFAULT ' + default_literal(field_type, default)
+
+    with characters_connection() as conn:
+        if field_name.lower() in (name.lower() for name in field_names(conn, table)):
+            raise SchemaChangeError(f"Field '{field_name}' already exists.")
+        try:
+            conn.execute(f'ALTER TABLE {quote_name(table)} ADD COLUMN {definition}')
+        except sqlite3.OperationalError as e:
+            raise SchemaChangeError(str(e)) from None
+
+def index_columns(conn, index):
+    """(column, descending, collation) for each key column of an index. Expressions have column None."""
+    return [(name, desc, coll) for _, cid, name, desc, coll, key
+            in conn.execute(f'PRAGMA index_xinfo({quote_name(index)})') if key]
+
+def indexes_on(conn, table, column):
+    """Indexes of the table that include the column, as (name, unique, origin, columns)."""
+    found = []
+    for _, name, unique, origin, _ in conn.execute(f'PRAGMA index_list({quote_name(table)})').fetchall():
+        columns = index_columns(conn, name)
+        if any(col == column for col, _, _ in columns):
+            found.append((name, unique, origin, columns))
+    return found
+
+def index_covered(conn, table, key_columns):
+    """True if the key columns are the same as, or a prefix of, those of an existing full index of the table."""
+    if any(col is None for col, _, _ in key_columns):
+        return False  # Expression terms can't be compared
+    for _, name, _, _, partial in conn.execute(f'PRAGMA index_list({quote_name(table)})').fetchall():
+        if not partial and index_columns(conn, name)[:len(key_columns)] == key_columns:
+            return True
+    return False
+
+def split_index_sql(sql):
+    """Split a CREATE INDEX statement into (text before the key list, key terms, text after it).
+
+    The text after the key list holds the WHERE clause of a partial index.
+    Commas and parentheses inside quotes or nested expressions are skipped.
+    """
+    terms, depth, start, quote = [], 0, 0, None
+    head = None
+    for i, char in enumerate(sql):
+        if quote:
+            if char == quote:
+                quote = None  # A doubled quote just opens the string again on the next character
+            continue
+        if char in '\'"`':
+            quote = char
+        elif char == '[':
+            quote = ']'
+        elif char == '(':
+            depth += 1
+            if depth == 1:
+                head, start = sql[:i], i + 1
+        elif char == ')':
+            depth -= 1
+            if depth == 0:
+                terms.append(sql[start:i].strip())
+                return head, terms, sql[i + 1:]
+        elif char == ',' and depth == 1:
+            terms.append(sql[start:i].strip())
+            start = i + 1
+    raise sqlite3.OperationalError(f"Can't read the index definition: {sql}")
+
+def recreate_index(conn, table, sql, key_columns, column):
+    """Create an index again from its original SQL, leaving out the column's key terms.
+
+    key_columns is the index_xinfo of the index, read before it was dropped;
+    its key rows are in the same order as the terms of the SQL, so everything
+    else (COLLATE, DESC, expressions, the WHERE clause) is kept as written.
+    Returns False if no key term is left, if another index already starts with
+    the remaining keys (a non-UNIQUE copy would only slow down writes), or if
+    an expression or the WHERE clause needs the column (or a UNIQUE index no
+    longer holds) and SQLite refuses it.
+    """
+    head, terms, tail = split_index_sql(sql)
+    kept = [term for term, (col, _, _) in zip(terms, key_columns) if col != column]
+    if not kept:
+        return False
+    unique = head.split()[1].upper() == 'UNIQUE'
+    if not unique and index_covered(conn, table, [key for key in key_columns if key[0] != column]):
+        return False
+    try:
+        conn.execute(f"{head}({', '.join(kept)}){tail}")
+    except (sqlite3.OperationalError, sqlite3.IntegrityError):
+        return False
+    return True
+
+def triggers_compile(conn, table, columns):
+    """Whether SQLite can compile every trigger of the table, i.e. none of them uses a column that's gone.
+
+    Renaming a column to its own name makes SQLite check every trigger on the
+    table, bodies and WHEN clauses included, without changing the schema text.
+    Before SQLite 3.25 there is no RENAME COLUMN, so INSERT, UPDATE and DELETE
+    are run with WHERE 0 instead: preparing them compiles the triggers they
+    would fire, without changing any rows.
+    """
+    name = quote_name(table)
+    try:
+        if sqlite3.sqlite_version_info >= RENAME_COLUMN_VERSION:
+            conn.execute(f'ALTER TABLE {name} RENAME COLUMN {quote_name(columns[0])} TO {quote_name(columns[0])}')
+        else:
+            column_list = ', '.join(quote_name(col) for col in columns)
+            assignments = ', '.join(f'{quote_name(col)} = {quote_name(col)}' for col in columns)
+            conn.execute(f'INSERT INTO {name} ({column_list}) SELECT {column_list} FROM {name} WHERE 0')
+            conn.execute(f'UPDATE {name} SET {assignments} WHERE 0')
+            conn.execute(f'DELETE FROM {name} WHERE 0')
+    except sqlite3.OperationalError:
+        return False
+    return True
+
+def drop_column(conn, table, column):
+    """Remove the column with ALTER TABLE DROP COLUMN. Returns False if SQLite can't do that here.
+
+    SQLite refuses to drop an indexed column, so indexes that include it are
+    dropped first and put back without it (unless it was their only column).
+    """
+    if sqlite3.sqlite_version_info < DROP_COLUMN_VERSION:
+        return False
+    indexes = indexes_on(conn, table, column)
+    if any(origin != 'c' for _, _, origin, _ in indexes):
+        return False  # Part of a PRIMARY KEY or UNIQUE constraint
+    definitions = {name: conn.execute("SELECT sql FROM sqlite_master WHERE type = 'index' AND name = ?",
+                                      (name,)).fetchone()[0]
+                   for name, _, _, _ in indexes}
+
+    conn.execute('SAVEPOINT drop_column')
+    try:
+        for name, _, _, _ in indexes:
+            conn.execute(f'DROP INDEX {quote_name(name)}')
+        conn.execute(f'ALTER TABLE {quote_name(table)} DROP COLUMN {quote_name(column)}')
+    except sqlite3.OperationalError:
+        # e.g. a trigger, view, CHECK or FOREIGN KEY uses the column
+        conn.execute('ROLLBACK TO drop_column')
+        conn.execute('RELEASE drop_column')
+        return False
+    conn.execute('RELEASE drop_column')
+
+    for name, _, _, columns in indexes:
+        recreate_index(conn, table, definitions[name], columns, column)
+    return True
+
+def table_definition(conn, table, keep):
+    """CREATE TABLE body for the table with only the `keep` columns, keeping their constraints.
+
+    Carries over types, NOT NULL, DEFAULT, the PRIMARY KEY (and AUTOINCREMENT),
+    UNIQUE constraints and FOREIGN KEYs. CHECK constraints aren't listed by any
+    PRAGMA and are not carried over.
+    """
+    info = conn.execute(f'PRAGMA table_info({quote_name(table)})').fetchall()
+    sql = conn.execute('SELECT sql FROM sqlite_master WHERE type = ? AND name = ?', ('table', table)).fetchone()[0]
+    primary_key = [name for _, name, _, _, _, pk in sorted(info, key=lambda row: row[5]) if pk and name in keep]
+
+    lines = []
+    for _, name, col_type, not_null, default, pk in info:
+        if name not in keep:
+            continue
+        line = f'{quote_name(name)} {col_type}'.rstrip()
+        if pk and len(primary_key) == 1:
+            line += ' PRIMARY KEY'
+            if re.search(r'\bAUTOINCREMENT\b', sql, re.IGNORECASE):
+                line += ' AUTOINCREMENT'
+        if not_null and not pk:
+            line += ' NOT NULL'
+        if default is not None:
+            line += f' DEFAULT {default}'
+        lines.append(line)
+    if len(primary_key) > 1:
+        lines.append(f"PRIMARY KEY ({', '.join(quote_name(name) for name in primary_key)})")
+
+    for _, name, _, origin, _ in conn.execute(f'PRAGMA index_list({quote_name(table)})').fetchall():
+        columns = [col for col, _, _ in index_columns(conn, name)]
+        if origin == 'u' and all(col in keep for col in columns):
+            lines.append(f"UNIQUE ({', '.join(quote_name(col) for col in columns)})")
+
+    foreign_keys = {}
+    for fk_id, _, parent, child, parent_col, on_update, on_delete, _ in conn.execute(
+            f'PRAGMA foreign_key_list({quote_name(table)})'):
+        entry = foreign_keys.setdefault(fk_id, {'parent': parent, 'from': [], 'to': [],
+                                                'on_update': on_update, 'on_delete': on_delete})
+        entry['from'].append(child)
+        entry['to'].append(parent_col)
+    for fk in foreign_keys.values():
+        if not all(col in keep for col in fk['from']):
+            continue
+        line = f"FOREIGN KEY ({', '.join(quote_name(col) for col in fk['from'])}) REFERENCES {quote_name(fk['parent'])}"
+        if all(fk['to']):
+            line += f" ({', '.join(quote_name(col) for col in fk['to'])})"
+        for action in ('on_update', 'on_delete'):
+            if fk[action] != 'NO ACTION':
+                line += f" {action.upper().replace('_', ' ')} {fk[action]}"
+        lines.append(line)
+    return ',\n    '.join(lines)
+
+def rebuild_without(conn, table, column):
+    """Copy the table without one column, keeping its constraints, indexes, triggers and AUTOINCREMENT counter.
+
+    The fallback for SQLite versions (or columns) where DROP COLUMN doesn't work.
+    Runs inside the caller's transaction, so the old table stays in place if anything fails.
+    """
+    keep = [name for name in field_names(conn, table) if name != column]
+    kept_columns = ', '.join(quote_name(name) for name in keep)
+    new_table = table + '_new'
+    definition = table_definition(conn, table, keep)
+
+    # Indexes and triggers are dropped with the old table, remember them to create them again
+    indexes = [(sql, index_columns(conn, name)) for name, sql in conn.execute(
+                   "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+                   (table,)).fetchall()]
+    triggers = conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name = ?",
+                            (table,)).fetchall()
+    sequence = None
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_sequence'").fetchone():
+        sequence = conn.execute('SELECT seq FROM sqlite_sequence WHERE name = ?', (table,)).fetchone()
+
+    conn.execute(f'DROP TABLE IF EXISTS {quote_name(new_table)}')
+    conn.execute(f'CREATE TABLE {quote_name(new_table)} (\n    {definition}\n)')
+    conn.execute(f'INSERT INTO {quote_name(new_table)} ({kept_columns}) SELECT {kept_columns} FROM {quote_name(table)}')
+    conn.execute(f'DROP TABLE {quote_name(table)}')
+    conn.execute(f'ALTER TABLE {quote_name(new_table)} RENAME TO {quote_name(table)}')
+    # Untouched indexes first, so a shortened one that duplicates one of them is left out
+    for sql, columns in sorted(indexes, key=lambda index: any(col == column for col, _, _ in index[1])):
+        recreate_index(conn, table, sql, columns, column)
+    for name, sql in triggers:
+        # A trigger that used the column can't work without it
+        conn.execute(sql)
+        if not triggers_compile(conn, table, keep):
+            conn.execute(f'DROP TRIGGER {quote_name(name)}')
+    if sequence is not None:
+        # Keep handing out ids after the highest one ever used, not just the highest one copied
+        conn.execute('UPDATE sqlite_sequence SET seq = max(seq, ?) WHERE name = ?', (sequence[0], table))
+
+# Function to remove a field from the characters table
+def remove_field(field_name, table=CHARACTERS_TABLE):
+    """Remove a column in one transaction. Returns 'drop' or 'rebuild', whichever way it was done.
+
+    Uses ALTER TABLE DROP COLUMN where SQLite supports it, which doesn't copy
+    the table, and a constraint-preserving rebuild otherwise.
+    """
+    if field_name in PROTECTED_FIELDS:
+        raise SchemaChangeError(f"The '{field_name}' field cannot be removed as it is essential.")
+    with characters_connection() as conn:
+        conn.execute('BEGIN IMMEDIATE')  # Hold the write lock from the check to the change
+        if field_name not in field_names(conn, table):
+            raise SchemaChangeError(f"Field '{field_name}' does not exist.")
+        try:
+            if drop_column(conn, table, field_name):
+                return 'drop'
+            rebuild_without(conn, table, field_name)
+            return 'rebuild'
+        except sqlite3.OperationalError as e:
+            raise SchemaChangeError(str(e)) from None
@@ -0,0 +1,139 @@
+import difflib
+from collections import namedtuple
+from bbs_data_access import CHARACTERS_DB, characters_connection
+from bbs_pagination import PAGE_SIZE, KeysetPager
+from character_schema import get_schema
+from character_skills import canonical_skill
+
+SEARCH_LIMIT = 200  # Most characters/NPCs returned by one search
+FUZZY_CANDIDATES = 500  # Trigram matches re-ranked by similarity for a fuzzy search
+FUZZY_CUTOFF = 0.6  # Lowest similarity (0-1) a fuzzy match may have
+
+# Name matching modes
+PREFIX = 'prefix'  # Names starting with the term, from the NOCASE name index
+SUBSTRING = 'substring'  # Names containing the term, from the trigram index
+FUZZY = 'fuzzy'  # Names similar to the term, e.g. misspelled
+
+# List screens only read these columns, however many fields the GM has added to the sheet
+RESULT_COLUMNS = 'id, name, role'
+NAME_ORDER = 'name COLLATE NOCASE, id'
+
+
+class CharacterSummary(namedtuple('CharacterSummary', RESULT_COLUMNS)):
+    """The part of a character/NPC that list and paging screens show. Load the full sheet by id."""
+
+    __slots__ = ()
+
+    @property
+    def is_npc(self):
+        return self.role == 1
+
+
+def has_trigram_index(conn):
+    """Whether the characters_fts trigram index exists (SQLite 3.34+ with FTS5)."""
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'characters_fts'").fetchone() is not None
+
+def prefix_bounds(prefix):
+    """The [low, high) range of names that start with prefix, compared case-insensitively."""
+    low = prefix.lower()  # NOCASE folds to lower case, so the upper bound must be built from that
+    return low, low[:-1] + chr(ord(low[-1]) + 1)
+
+def fts_phrase(text):
+    """Quote text as a single FTS5 phrase."""
+    return '"' + text.replace('"', '""') + '"'
+
+def trigrams(text):
+    """The distinct three-character pieces of text, lower-cased."""
+    text = text.lower()
+    return sorted({text[i:i + 3] for i in range(len(text) - 2)})
+
+def similarity(term, name):
+    """How close a name is to the search term (0-1), matching the whole name or any word of it."""
+    term = term.lower()
+    name = (name or '').lower()
+    return max(difflib.SequenceMatcher(None, term, part).ratio() for part in [name, *name.split()])
+
+def search_characters(name='', mode=PREFIX, role=None, character_class=None, race=None,
+                      min_level=None, max_level=None, skill=None, min_skill=None, limit=SEARCH_LIMIT):
+    """Find characters/NPCs by name and attributes. Returns CharacterSummary rows ordered by name.
+
+    role is 1 for NPCs only, 0 for characters only, or None for both. class
+    and race match case-insensitively, and skill/min_skill keeps only those
+    whose skill is at least min_skill. Fuzzy results are ordered by similarity.
+    A filter on a field the GM has removed matches nothing.
+    """
+    filters = [('class = ? COLLATE NOCASE', 'class', character_class and character_class.strip()),
+               ('race = ? COLLATE NOCASE', 'race', race and race.strip()),
+               ('level >= ?', 'level', min_level),
+               ('level <= ?', 'level', max_level)]
+    schema = get_schema()
+    where, params = [], []
+    if role is not None:
+        where.append('role = ?')
+        params.append(role)
+    for condition, field, value in filters:
+        if value is None or value == '':
+            continue
+        if field not in schema:
+            return []
+        where.append(condition)
+        params.append(value)
+    if skill:
+        where.append('id IN (SELECT character_id FROM character_skills WHERE skill = ? AND value >= ?)')
+        params.extend([canonical_skill(skill), min_skill if min_skill is not None else 0])
+
+    name = name.strip()
+    if mode == FUZZY and len(name) < 3:
+        mode = PREFIX  # Too short to have trigrams or a useful similarity
+
+    with characters_connection() as conn:
+        trigram_index = len(name) >= 3 and has_trigram_index(conn)
+        if name and mode == PREFIX:
+            where.append('name >= ? COLLATE NOCASE AND name < ? COLLATE NOCASE')
+            params.extend(prefix_bounds(name))
+        elif name and mode == SUBSTRING:
+            if trigram_index:
+                where.append('id IN (SELECT rowid FROM characters_fts WHERE characters_fts MATCH ?)')
+                params.append(fts_phrase(name))
+            else:
+                # Shorter than a trigram, or no FTS5: a LIKE scan over the names
+                where.append("name LIKE ? ESCAPE '\\'")
+                params.append('%' + name.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%')
+        elif name and mode == FUZZY and trigram_index:
+            # Candidates share at least one trigram with the term, best matches first
+            where.append('id IN (SELECT rowid FROM characters_fts WHERE characters_fts MATCH ? ORDER BY rank LIMIT ?)')
+            params.extend([' OR '.join(fts_phrase(piece) for piece in trigrams(name)), FUZZY_CANDIDATES])
+
+        sql = f'SELECT {RESULT_COLUMNS} FROM characters'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        if name and mode == FUZZY:
+            rows = conn.execute(sql, params).fetchall()
+        else:
+            rows = conn.execute(f'{sql} ORDER BY {NAME_ORDER} LIMIT ?', [*params, limit]).fetchall()
+    rows = [CharacterSummary(*row) for row in rows]
+
+    if name and mode == FUZZY:
+        scored = [(similarity(name, row.name), row) for row in rows]
+        scored = [item for item in scored if item[0] >= FUZZY_CUTOFF]
+        scored.sort(key=lambda item: (-item[0], (item[1].name or '').lower()))
+        rows = [row for _, row in scored[:limit]]
+    return rows
+
+def find_by_name(name, role=None, limit=SEARCH_LIMIT):
+    """Look a name up the cheapest way that finds something: prefix, then substring, then fuzzy.
+
+    Returns (rows, mode that matched).
+    """
+    for mode in (PREFIX, SUBSTRING, FUZZY):
+        rows = search_characters(name, mode, role=role, limit=limit)
+        if rows:
+            return rows, mode
+    return [], None
+
+def character_pager(role=None, page_size=PAGE_SIZE):
+    """Page through every character/NPC (or only one role) by name, one page of CharacterSummary rows at a time."""
+    where, params = ('role = ?', (role,)) if role is not None else (None, ())
+    return KeysetPager('characters', RESULT_COLUMNS, where, params, page_size=page_size,
+                       key_columns=('name COLLATE NOCASE', 'id'), db_path=CHARACTERS_DB,
+                       row_factory=CharacterSummary)
@@ -0,0 +1,112 @@
+import threading
+from bbs_data_access import characters_connection
+from bbs_render_cache import RenderCache
+from character_schema import OTHER_SECTION, get_schema
+from character_skills import get_skills
+
+# Rendered sheets by character id, each stored at (sheet version, schema version)
+sheet_render_cache = RenderCache(max_entries=1000, max_bytes=4 * 1024 * 1024)
+
+# Steps of a compiled sheet layout
+TEXT = 0  # Fixed text: headings, the skills table header, the footer
+FIELD = 1  # 'Label: ' and the row value at an index
+OPTIONAL_FIELD = 2  # The same, left out when the value is empty (Other Information)
+SKILLS = 3  # The skills table, left out when there are no skills
+
+_layout = (None, None)  # (schema version, layout) of the last layout compiled
+_layout_lock = threading.Lock()
+
+
+# Function to fetch one character sheet by id
+def load_character(char_id):
+    """Fetch the full row and the skills of one character/NPC. Returns (row, skills), row is None if it's gone."""
+    with characters_connection() as conn:
+        character = conn.execute("SELECT * FROM characters WHERE id = ?", (char_id,)).fetchone()
+    if character is None:
+        return None, []
+    return character, get_skills([char_id])[char_id]  # All of its skills in one query
+
+def compile_layout(schema):
+    """Turn the schema's sheet sections into a flat list of (step, text, row index).
+
+    Labels and headings are formatted here, and neighbouring fixed text is
+    merged, so rendering a row is a single pass over the steps.
+    """
+    layout = []
+
+    def add_text(text):
+        if layout and layout[-1][0] == TEXT:
+            layout[-1] = (TEXT, layout[-1][1] + text, None)
+        else:
+            layout.append((TEXT, text, None))
+
+    add_text("\n--- Character Sheet ---\n")
+    for heading, fields in schema.sections:
+        if fields is None:
+            layout.append((SKILLS, f"\n--- {heading} ---\n{'Skill':<25} | {'Value':<5}\n{'-' * 32}\n", None))
+            continue
+        if heading:
+            add_text(f"\n--- {heading} ---\n")
+        step = OPTIONAL_FIELD if heading == OTHER_SECTION else FIELD
+        for label, index in fields:
+            layout.append((step, f"{label}: ", index))
+    add_text("\n--- End of Character Sheet ---\n" + "=" * 40 + "\n")
+    return layout
+
+def sheet_layout(schema):
+    """Return the compiled layout for the schema, compiling it only when the schema version changed."""
+    global _layout
+    with _layout_lock:
+        version, layout = _layout
+        if version != schema.version:
+            layout = compile_layout(schema)
+            _layout = (schema.version, layout)
+        return layout
+
+def render_sheet(character, skills, layout):
+    """Render a character row and its (skill, value) pairs into the sheet text."""
+    out = []
+    for step, text, index in layout:
+        if step == TEXT:
+            out.append(text)
+        elif step == FIELD:
+            out.append(f"{text}{character[index]}\n")
+        elif step == OPTIONAL_FIELD:
+            value = character[index]
+            if value is not None and value != '':
+                out.append(f"{text}{value}\n")
+        elif skills:
+            out.append(text)
+            out.extend(f"{skill_name:<25} | {skill_value:<5}\n" for skill_name, skill_value in skills)
+    return ''.join(out)
+
+def sheet_version(char_id):
+    """How many times the character's row or skills have changed, kept by triggers in character_versions."""
+    with characters_connection() as conn:
+        row = conn.execute('SELECT version FROM character_versions WHERE character_id = ?', (char_id,)).fetchone()
+    return row[0] if row else 0
+
+# Function to get a character sheet ready to print
+def character_sheet(char_id):
+    """Return the rendered sheet of one character/NPC, or None if it's gone.
+
+    A sheet is only rendered again after the character, its skills or the
+    table's fields changed. Until then it comes from sheet_render_cache
+    without loading the row.
+    """
+    schema = get_schema()
+    version = (sheet_version(char_id), schema.version)
+    sheet = sheet_render_cache.get(char_id, version)
+    if sheet is not None:
+        return sheet
+
+    character, skills = load_character(char_id)
+    if character is None:
+        return None
+    if len(character) != len(schema.columns):
+        # A field was added or removed since the schema was read
+        schema = get_schema()
+        version = (version[0], schema.version)
+    sheet = render_sheet(character, skills, sheet_layout(schema))
+    sheet_render_cache.put(char_id, version, sheet)
+    return sheet
@@ -0,0 +1,82 @@
+from bbs_data_access import characters_connection
+
+# The D&D 3.5 skills asked for when a character/NPC is created
+DND_SKILLS = [
+    "Appraise", "Balance", "Bluff", "Climb", "Concentration", "Craft",
+    "Decipher Script", "Diplomacy", "Disable Device", "Disguise",
+    "Escape Artist", "Forgery", "Gather Information", "Handle Animal",
+    "Heal", "Hide", "Intimidate", "Jump", "Knowledge (Arcana)",
+    "Knowledge (Dungeoneering)", "Knowledge (Geography)", "Knowledge (History)",
+    "Knowledge (Local)", "Knowledge (Nature)", "Knowledge (Nobility and Royalty)",
+    "Knowledge (Religion)", "Listen", "Move Silently", "Open Lock", "Perform",
+    "Profession", "Ride", "Search", "Sense Motive", "Sleight of Hand",
+    "Speak Language", "Spellcraft", "Spot", "Survival", "Swim", "Tumble",
+    "Use Magic Device", "Use Rope"
+]
+
+
+def canonical_skill(name):
+    """Return the skill as spelled in DND_SKILLS (any case), or the stripped name for custom skills."""
+    name = ' '.join(name.split())
+    for skill in DND_SKILLS:
+        if skill.lower() == name.lower():
+            return skill
+    return name
+
+def parse_skill(text):
+    """Turn 'Spot 12' into ('Spot', 12). Returns None if it doesn't end in a number."""
+    parts = text.strip().rsplit(' ', 1)
+    if len(parts) != 2 or not parts[0].strip():
+        return None
+    try:
+        return canonical_skill(parts[0]), int(parts[1])
+    except ValueError:
+        return None
+
+def parse_skills(text):
+    """Split the old comma-joined skills text ("Tumble 12, Use Rope 1") into (skill, value) pairs.
+
+    Returns (pairs, pieces that could not be parsed).
+    """
+    pairs, bad = [], []
+    for piece in (text or '').split(','):
+        if not piece.strip():
+            continue
+        parsed = parse_skill(piece)
+        if parsed:
+            pairs.append(parsed)
+        else:
+            bad.append(piece.strip())
+    return pairs, bad
+
+def set_skills(conn, character_id, skills):
+    """Store skill values for a character inside the caller's transaction. Skills not given are left alone."""
+    set_skill_rows(conn, [(character_id, skill, value) for skill, value in dict(skills).items()])
+
+def set_skill_rows(conn, rows):
+    """Store (character id, skill, value) rows for any number of characters in one executemany."""
+    conn.executemany('INSERT INTO character_skills (character_id, skill, value) VALUES (?, ?, ?) '
+                     'ON CONFLICT(character_id, skill) DO UPDATE SET value = excluded.value', rows)
+
+def delete_skills(conn, character_id):
+    """Remove every skill of a character inside the caller's transaction."""
+    conn.execute('DELETE FROM character_skills WHERE character_id = ?', (character_id,))
+
+def get_skills(character_ids, conn=None):
+    """Fetch the skills of several characters in one query, as {character id: [(skill, value), ...]}.
+
+    Pass conn to read on a connection the caller already holds instead of borrowing another from the pool.
+    """
+    character_ids = list(character_ids)
+    skills = {character_id: [] for character_id in character_ids}
+    if not character_ids:
+        return skills
+    if conn is None:
+        with characters_connection() as conn:
+            return get_skills(character_ids, conn)
+    marks = ', '.join('?' for _ in character_ids)
+    rows = conn.execute(f'SELECT character_id, skill, value FROM character_skills '
+                        f'WHERE character_id IN ({marks}) ORDER BY character_id, skill', character_ids)
+    for character_id, skill, value in rows:
+        skills[character_id].append((skill, value))
+    return skills
@@ -0,0 +1,224 @@
+import csv
+import json
+import os
+import sqlite3
+from collections import namedtuple
+from bbs_data_access import characters_connection
+from character_schema import BOOLEAN_VALUES, get_schema, quote_name
+from character_skills import canonical_skill, get_skills, parse_skills, set_skill_rows
+
+IMPORT_CHUNK = 500  # Characters/NPCs inserted per transaction
+EXPORT_BATCH = 500  # Rows fetched from the cursor at a time
+
+# File formats, chosen by extension
+CSV = 'csv'
+JSONL = 'jsonl'  # One JSON object per line
+FORMATS = {'.csv': CSV, '.jsonl': JSONL, '.ndjson': JSONL, '.json': JSONL}
+
+SKILLS_FIELD = 'skills'  # Skill values in import/export files, stored in character_skills
+NOT_IMPORTED = ('id', 'skills')  # Imports get new ids, and the old skills text field isn't filled from files
+
+ImportResult = namedtuple('ImportResult', 'imported errors')  # errors is a list of (line number, message)
+
+
+class TransferError(Exception):
+    """Raised when a file can't be imported or exported at all. The message says why."""
+
+
+class RowError(ValueError):
+    """Raised for one row of an import file that doesn't fit the characters table."""
+
+
+def file_format(path):
+    """Return CSV or JSONL from the file's extension."""
+    fmt = FORMATS.get(os.path.splitext(path)[1].lower())
+    if fmt is None:
+        raise TransferError(f"Can't tell the format of '{path}'. Use a .csv or .jsonl file.")
+    return fmt
+
+def convert_value(column_type, value):
+    """Convert a value read from a file to the column's declared type. Empty values become NULL."""
+    if value is None or value == '':
+        return None
+    if isinstance(value, (list, dict)):
+        raise ValueError
+    if column_type == 'BOOLEAN':
+        if isinstance(value, bool):
+            return int(value)
+        return BOOLEAN_VALUES[str(value).strip().lower()]
+    if isinstance(value, bool):
+        raise ValueError  # JSON true/false only fits a BOOLEAN field
+    if column_type == 'INTEGER':
+        if isinstance(value, float) and not value.is_integer():
+            raise ValueError
+        return int(value)
+    if column_type == 'REAL':
+        return float(value)
+    return value if isinstance(value, str) else str(value)
+
+def convert_skills(value):
+    """Read skill values given as 'Spot 12, Hide 3', {"Spot": 12} or [["Spot", 12]]. Returns (skill, value) pairs."""
+    if value is None or value == '':
+        return []
+    if isinstance(value, str):
+        pairs, bad = parse_skills(value)
+        if bad:
+            raise RowError(f"skills: {', '.join(bad)} should be a skill name followed by a number.")
+        return pairs
+    try:
+        items = value.items() if isinstance(value, dict) else value
+        return [(canonical_skill(skill), int(skill_value)) for skill, skill_value in items]
+    except (AttributeError, TypeError, ValueError):
+        raise RowError("skills must be 'Skill value' pairs.") from None
+
+def prepare_row(schema, record):
+    """Validate one record against the schema. Returns (columns, values, skills) ready to insert."""
+    unknown = [str(key) for key in record if key not in schema and key != SKILLS_FIELD]
+    if unknown:
+        raise RowError(f"Unknown fields: {', '.join(unknown)}.")
+
+    columns, values = [], []
+    for column in schema.columns:
+        if column in NOT_IMPORTED or column not in record:
+            continue
+        column_type = schema.types[column]
+        try:
+            value = convert_value(column_type, record[column])
+        except (KeyError, TypeError, ValueError):
+            raise RowError(f"{column}: '{record[column]}' is not a valid {column_type or 'value'}.") from None
+        if value is None and column in schema.defaults:
+            continue  # Leave it to the field's default
+        if value is None and column in schema.not_null:
+            raise RowError(f"{column} is required.")
+        columns.append(column)
+        values.append(value)
+
+    missing = [column for column in schema.columns if column in schema.not_null and column not in schema.defaults
+               and column not in NOT_IMPORTED and column not in record]
+    if missing:
+        raise RowError(f"Missing required fields: {', '.join(missing)}.")
+    return tuple(columns), values, convert_skills(record.get(SKILLS_FIELD))
+
+def read_records(file, fmt):
+    """Yield (line number, record, error) for each record of an open file, reading one line at a time."""
+    try:
+        if fmt == CSV:
+            reader = csv.DictReader(file)
+            for record in reader:
+                if None in record:
+                    yield reader.line_num, None, "More values than there are columns in the header."
+                else:
+                    yield reader.line_num, record, None
+            return
+
+        for line_no, line in enumerate(file, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield line_no, None, f"Not valid JSON: {e}"
+                continue
+            if isinstance(record, dict):
+                yield line_no, record, None
+            else:
+                yield line_no, None, "Each line must be a JSON object."
+    except (csv.Error, UnicodeDecodeError) as e:
+        raise TransferError(f"Can't read the file: {e}") from None
+
+def first_free_id(conn):
+    """The id AUTOINCREMENT would give the next character, read under the caller's write lock."""
+    next_id = conn.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM characters').fetchone()[0]
+    try:
+        sequence = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'characters'").fetchone()
+    except sqlite3.OperationalError:
+        sequence = None  # No AUTOINCREMENT table in this database
+    return max(next_id, sequence[0] + 1) if sequence else next_id
+
+def insert_chunk(chunk, errors):
+    """Insert prepared rows and their skills in one transaction. Returns how many were inserted.
+
+    If the database refuses any row, none of the chunk is inserted and the
+    error is added to errors. executemany can't report each new id, so the
+    ids are handed out up front while the write lock is held.
+    """
+    try:
+        with characters_connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            next_id = first_free_id(conn)
+            by_columns, skill_rows = {}, []
+            for offset, (_, columns, values, skills) in enumerate(chunk):
+                char_id = next_id + offset
+                by_columns.setdefault(columns, []).append([char_id, *values])
+                skill_rows.extend((char_id, skill, value) for skill, value in skills)
+            # One executemany for each set of fields the rows fill in (CSV rows all share one)
+            for columns, rows in by_columns.items():
+                names = ', '.join(quote_name(column) for column in ('id', *columns))
+                marks = ', '.join('?' for _ in range(len(columns) + 1))
+                conn.executemany(f'INSERT INTO characters ({names}) VALUES ({marks})', rows)
+            set_skill_rows(conn, skill_rows)
+    except sqlite3.DatabaseError as e:
+        errors.append((chunk[0][0], f"Lines {chunk[0][0]}-{chunk[-1][0]} were not imported: {e}"))
+        return 0
+    return len(chunk)
+
+# Function to import characters/NPCs from a CSV or JSON Lines file
+def import_characters(path, chunk_size=IMPORT_CHUNK):
+    """Stream a file into the characters table, chunk_size rows per transaction. Returns an ImportResult.
+
+    Fields are matched to columns by name and checked against the cached
+    schema. Rows that don't fit are skipped and reported, the rest are
+    imported with new ids. An 'id' field is ignored.
+    """
+    fmt = file_format(path)
+    schema = get_schema()
+    imported, errors, chunk = 0, [], []
+    with open(path, newline='', encoding='utf-8-sig') as file:
+        for line_no, record, error in read_records(file, fmt):
+            if error is None:
+                try:
+                    chunk.append((line_no, *prepare_row(schema, record)))
+                except RowError as e:
+                    error = str(e)
+            if error is not None:
+                errors.append((line_no, error))
+            elif len(chunk) >= chunk_size:
+                imported += insert_chunk(chunk, errors)
+                chunk = []
+    if chunk:
+        imported += insert_chunk(chunk, errors)
+    return ImportResult(imported, errors)
+
+# Function to export characters/NPCs to a CSV or JSON Lines file
+def export_characters(path, role=None):
+    """Write every character/NPC (or one role) with its skills to a file. Returns how many were written.
+
+    Rows are fetched from the cursor EXPORT_BATCH at a time, so the whole
+    table is never held in memory.
+    """
+    fmt = file_format(path)
+    columns = [column for column in get_schema().columns if column != 'skills']
+    id_index = columns.index('id')
+    where, params = ('WHERE role = ?', (role,)) if role is not None else ('', ())
+    count = 0
+    with open(path, 'w', newline='', encoding='utf-8') as file, characters_connection() as conn:
+        cursor = conn.execute(f"SELECT {', '.join(quote_name(column) for column in columns)} "
+                              f"FROM characters {where} ORDER BY id", params)
+        writer = csv.writer(file) if fmt == CSV else None
+        if writer:
+            writer.writerow(columns + [SKILLS_FIELD])
+        while True:
+            rows = cursor.fetchmany(EXPORT_BATCH)
+            if not rows:
+                break
+            skills = get_skills((row[id_index] for row in rows), conn)  # One query per batch, on the same connection
+            for row in rows:
+                character_skills = skills[row[id_index]]
+                if writer:
+                    writer.writerow([*row, ', '.join(f"{skill} {value}" for skill, value in character_skills)])
+                else:
+                    record = dict(zip(columns, row))
+                    record[SKILLS_FIELD] = dict(character_skills)
+                    file.write(json.dumps(record) + '\n')
+            count += len(rows)
+    return count
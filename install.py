@@ -1,5 +1,9 @@
 import sqlite3
 import os
+from bbs_data_access import CHARACTERS_DB
+from bbs_migrations import CHARACTER_MIGRATIONS, run_migrations
+from bbs_passwords import TARGET_LOGIN_SECONDS, calibrate, hash_password, set_params
+from character_schema import FIELD_TYPES, SchemaChangeError, add_field, get_schema, remove_field
 
 # Create the users table in both databases
 def create_users_table():
@@ -34,6 +38,15 @@ def create_users_table():
     
     print("Users table created in both 'bbs.db' and 'characters_npcs.db'.")
 
+# Tune password hashing to this machine
+def configure_password_hashing():
+    """Pick the password hashing cost that makes one login check take about TARGET_LOGIN_SECONDS here."""
+    print(f"Calibrating password hashing for about {TARGET_LOGIN_SECONDS * 1000:.0f} ms per login...")
+    params = calibrate()
+    set_params(params)
+    cost = ', '.join(f"{key}={value}" for key, value in params.items() if key != 'algorithm')
+    print(f"Passwords will be hashed with {params['algorithm']} ({cost}).")
+
 # Create default GM user with a password prompt
 def create_gm_user():
     """Create a default user called GM with a user-defined password in both databases."""
@@ -43,11 +56,12 @@ def create_gm_user():
 
     # Prompt the user for the GM password
     password = input("Please enter the password for the GM account: ")
+    hashed = hash_password(password)  # Only the salted hash is stored
 
     # Insert GM user into bbs.db
     c_bbs.execute('''
         INSERT INTO users (username, role, password) VALUES ('GM', 'gm', ?)
-    ''', (password,))
+    ''', (hashed,))
     gm_user_id = c_bbs.lastrowid  # Get the GM's user ID from bbs.db
     conn_bbs.commit()
     conn_bbs.close()
@@ -59,7 +73,7 @@ def create_gm_user():
     # Insert GM user into characters_npcs.db with the same ID
     c_chars.execute('''
         INSERT INTO users (id, username, role, password) VALUES (?, 'GM', 'gm', ?)
-    ''', (gm_user_id, password))
+    ''', (gm_user_id, hashed))
     conn_chars.commit()
     conn_chars.close()
 
@@ -160,8 +174,7 @@ def create_character_npc_table():
             reflex_save INTEGER NOT NULL,
             will_save INTEGER NOT NULL,
             
-            -- Skills
-            skills TEXT,  -- List of skills
+            -- Skills are stored one per row in character_skills (see bbs_migrations.py)
             
             -- Equipment
             weapons TEXT,  -- List of weapons
@@ -188,27 +201,16 @@ def create_character_npc_table():
     conn.close()
     print("Character/NPC table created successfully in 'characters_npcs.db'.")
 
-# Function to ensure 'id' and 'role' fields cannot be deleted
-def prevent_id_and_role_deletion(field_name):
-    """Helper function to prevent deletion of 'id' and 'role' fields."""
-    if field_name in ['id', 'role']:
-        print(f"Error: The '{field_name}' field cannot be deleted as it is essential.")
-        return False
-    return True
-
 # Function to add new fields dynamically
 def add_field_to_table():
     """Add a new field to the characters table dynamically."""
-    conn = sqlite3.connect('characters_npcs.db')
-    c = conn.cursor()
-
     while True:
         field_name = input("Enter the name of the new field (or type 'done' to finish adding fields): ")
         if field_name.lower() == 'done':
             break
 
         field_type = input("Enter the type of the field (INTEGER, TEXT, REAL, BOOLEAN): ").upper()
-        if field_type not in ['INTEGER', 'TEXT', 'REAL', 'BOOLEAN']:
+        if field_type not in FIELD_TYPES:
             print("Invalid field type. Please choose from INTEGER, TEXT, REAL, BOOLEAN.")
             continue
 
@@ -219,73 +221,26 @@ def add_field_to_table():
 
         default_value = input("Enter the default value for this field (optional, press Enter to skip): ")
 
-        query = f"ALTER TABLE characters ADD COLUMN {field_name} {field_type}"
-        
-        if nullable == 'no':
-            query += " NOT NULL"
-        if default_value:
-            # Handle BOOLEAN default values
-            if field_type == 'BOOLEAN':
-                if default_value.lower() in ['true', '1']:
-                    default = 1
-                elif default_value.lower() in ['false', '0']:
-                    default = 0
-                else:
-                    print("Invalid default value for BOOLEAN type. Using NULL.")
-                    default = None
-                if default is not None:
-                    query += f" DEFAULT {default}"
-            else:
-                query += f" DEFAULT '{default_value}'"
-
         try:
-            c.execute(query)
-            conn.commit()
+            add_field(field_name, field_type, not_null=nullable == 'no', default=default_value)
             print(f"Field '{field_name}' of type '{field_type}' added to the characters table.")
-        except sqlite3.OperationalError as e:
+        except SchemaChangeError as e:
             print(f"Error: {e}")
 
-    conn.close()
-
 # Function to remove fields dynamically
 def remove_field_from_table():
     """Remove a field from the characters table dynamically."""
-    conn = sqlite3.connect('characters_npcs.db')
-    c = conn.cursor()
-
-    # Get the list of existing columns
-    c.execute("PRAGMA table_info(characters)")
-    columns = [col[1] for col in c.fetchall()]
-    print("Existing fields:", columns)
+    print("Existing fields:", get_schema().columns)
 
     field_name = input("Enter the name of the field to remove: ")
 
-    if not prevent_id_and_role_deletion(field_name):
-        conn.close()
-        return
-
-    if field_name not in columns:
-        print(f"Field '{field_name}' does not exist in the table.")
-        conn.close()
-        return
-
-    # Remove the column by creating a new table without the unwanted field
-    columns.remove(field_name)
-    columns_str = ", ".join(columns)
+    # Dropped in place where SQLite supports it, otherwise rebuilt with every constraint kept
     try:
-        c.execute(f'''
-            CREATE TABLE IF NOT EXISTS characters_new AS
-            SELECT {columns_str} FROM characters
-        ''')
-        c.execute("DROP TABLE characters")
-        c.execute("ALTER TABLE characters_new RENAME TO characters")
-        conn.commit()
+        remove_field(field_name)
         print(f"Field '{field_name}' removed from the characters table.")
-    except sqlite3.OperationalError as e:
+    except SchemaChangeError as e:
         print(f"Error: {e}")
 
-    conn.close()
-
 # Combined add/remove fields function based on user's choice
 def modify_fields():
     """Give the user the option to add or remove fields."""
@@ -344,12 +299,21 @@ def install():
         os.remove('characters_npcs.db')
         print("'characters_npcs.db' removed.")
 
+    # The BBS runs its databases in WAL mode, so clear out any leftover journal files too
+    for db_file in ('bbs.db', 'characters_npcs.db'):
+        for suffix in ('-wal', '-shm'):
+            if os.path.exists(db_file + suffix):
+                os.remove(db_file + suffix)
+
     # Create users table in both databases
     create_users_table()
 
     # Create the BBS tables (no default threads)
     create_bbs_tables()
 
+    # Calibrate password hashing before the first password is stored
+    configure_password_hashing()
+
     # Create the GM user with user-defined password, inserted into both databases
     create_gm_user()
 
@@ -362,6 +326,10 @@ def install():
     # Set thread categories without creating threads
     set_thread_categories()
 
+    # Add the indexes and record the schema version of both databases
+    run_migrations(verbose=True)
+    run_migrations(CHARACTERS_DB, CHARACTER_MIGRATIONS, verbose=True)
+
     # Inform the user of completion and ask if they want to close the window
     print("Installation is complete!")
     close_window = input("Would you like to close the window? (yes/no): ").lower()